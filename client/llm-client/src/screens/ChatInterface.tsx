@@ -28,7 +28,7 @@ interface Message {
   streaming?: boolean;
   isEmbedding?: boolean;
   isGenerate?: boolean;
-  confidence?: number;
+  confidence?: number | null;
   ragHit?: boolean;
 }
 
@@ -290,7 +290,7 @@ function ChatTab() {
     );
   };
 
-  const finalizeMessage = (msgId: string, meta?: { confidence?: number; ragHit?: boolean }) => {
+  const finalizeMessage = (msgId: string, meta?: { confidence?: number | null; ragHit?: boolean }) => {
     setMessages(prev =>
       prev.map(m => m.id === msgId ? { ...m, streaming: false, ...meta } : m)
     );
@@ -363,7 +363,7 @@ function ChatTab() {
 
         const reader = r.body!.getReader();
         const decoder = new TextDecoder();
-        let meta: { confidence?: number; ragHit?: boolean } = {};
+        let meta: { confidence?: number | null; ragHit?: boolean } = {};
         let buffer = "";
 
         while (true) {
@@ -456,7 +456,11 @@ function ChatTab() {
                 <Box sx={{ mt: 1, display: "flex", gap: 1 }}>
                   <Chip
                     size="small"
-                    label={msg.ragHit ? `RAG ${(msg.confidence * 100).toFixed(0)}%` : "LLM fallback"}
+                    label={
+                      !msg.ragHit ? "LLM fallback"
+                        : msg.confidence == null ? "RAG keyword match"
+                        : `RAG ${(msg.confidence * 100).toFixed(0)}%`
+                    }
                     color={msg.ragHit ? "success" : "warning"}
                   />
                 </Box>
@@ -0,0 +1,165 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Lower runs first. Background work is never rejected, only queued.
+PRIORITY_INTERACTIVE = 0  # /support and /support-stream generation, query embeddings
+PRIORITY_EXPANSION = 1  # LLM query expansion: skipped rather than waited for
+PRIORITY_BACKGROUND = 2  # training-job embeddings
+
+_priority: ContextVar[int] = ContextVar("ollama_priority", default=PRIORITY_INTERACTIVE)
+
+# Weight of the newest call in the moving average of call durations
+SERVICE_TIME_EWMA = 0.2
+
+
+@contextmanager
+def priority(level: int):
+    """Run the Ollama calls made in this block (and tasks it starts) at ``level``."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class Overloaded(Exception):
+    """A call was refused because it would wait too long for a slot."""
+
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """At most ``max_concurrency`` calls at once; the rest wait, highest priority first.
+
+    Interactive and expansion calls are refused with ``Overloaded`` instead of
+    queueing when ``max_queue`` calls are already waiting, or when the
+    estimated wait (calls ahead of it times the average call duration, spread
+    over the slots) exceeds ``max_wait_seconds``; a call still waiting at
+    that deadline is refused too. Background calls always queue.
+    """
+
+    def __init__(self, name: str, max_concurrency: int = 4, max_queue: int = 64, max_wait_seconds: float = 10.0):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._active = 0
+        self._waiters: list = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._service_seconds = 0.0
+        self._timed_calls = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.peak_queued = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @property
+    def free_slots(self) -> int:
+        return self.max_concurrency - self._active
+
+    @property
+    def queued(self) -> int:
+        return sum(not future.done() for _, _, future in self._waiters)
+
+    def estimated_wait(self, level: int) -> float:
+        """Seconds a call at ``level`` would wait if it arrived now."""
+        if self._active < self.max_concurrency:
+            return 0.0
+        ahead = sum(not future.done() and p <= level for p, _, future in self._waiters)
+        return (ahead + 1) * self._service_seconds / self.max_concurrency
+
+    def check(self, level: Optional[int] = None) -> None:
+        """Raise ``Overloaded`` if a call at ``level`` would be refused right now."""
+        level = current_priority() if level is None else level
+        if level >= PRIORITY_BACKGROUND or self._active < self.max_concurrency:
+            return
+        if self.queued >= self.max_queue:
+            self._reject(f"{self.name} queue is full ({self.max_queue} waiting)", self.estimated_wait(level))
+        estimate = self.estimated_wait(level)
+        if estimate > self.max_wait_seconds:
+            self._reject(f"{self.name} wait would be {estimate:.1f}s", estimate)
+
+    def _reject(self, message: str, wait: float) -> None:
+        self.rejected += 1
+        raise Overloaded(message, retry_after=max(1, math.ceil(wait)))
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the slots for the duration of the block, at the current priority."""
+        await self._acquire(current_priority())
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            weight = SERVICE_TIME_EWMA if self._timed_calls else 1.0
+            self._service_seconds += weight * (elapsed - self._service_seconds)
+            self._timed_calls += 1
+            self._release()
+
+    async def _acquire(self, level: int) -> None:
+        self.check(level)
+        if self._active < self.max_concurrency and not self.queued:
+            self._active += 1
+            self._admit(0.0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._seq), future))
+        self.peak_queued = max(self.peak_queued, self.queued)
+        start = time.perf_counter()
+        timeout = None if level >= PRIORITY_BACKGROUND else self.max_wait_seconds
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():  # otherwise the slot was handed over just at the deadline
+                future.cancel()
+                self._reject(f"{self.name} wait exceeded {self.max_wait_seconds:.1f}s", self.estimated_wait(level))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            else:
+                future.cancel()
+            raise
+        self._admit(time.perf_counter() - start)
+
+    def _admit(self, waited: float) -> None:
+        self.admitted += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def _release(self) -> None:
+        # Hand the slot straight to the best waiter, so a newcomer cannot take it first.
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(1000 * self._wait_total / self.admitted, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(1000 * self._wait_max, 1),
+            "avg_call_ms": round(1000 * self._service_seconds, 1),
+        }
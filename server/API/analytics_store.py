@@ -16,7 +16,7 @@ class QueryLog:
     timestamp: str
     query: str
     matched_category: Optional[str]
-    confidence: float
+    confidence: Optional[float]  # cosine similarity; None for keyword fast-path matches
     response_time_ms: int
     session_id: Optional[str] = None
     rag_hit: bool = False
@@ -61,7 +61,7 @@ class AnalyticsStore:
         rag_hits = [e for e in today_logs if e.get("rag_hit", False)]
         rag_hit_rate = round(len(rag_hits) / total_today * 100, 1) if total_today else 0.0
 
-        confidences = [e["confidence"] for e in today_logs if "confidence" in e]
+        confidences = [e["confidence"] for e in today_logs if e.get("confidence") is not None]
         avg_confidence = round(sum(confidences) / len(confidences), 3) if confidences else 0.0
 
         categories = [e["matched_category"] for e in today_logs if e.get("matched_category")]
@@ -0,0 +1,269 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the ``k`` highest scores, best first (argpartition + small sort)."""
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        positions = np.argpartition(-scores, k - 1)[:k]
+    else:
+        positions = np.arange(n)
+    return positions[np.argsort(-scores[positions], kind="stable")]
+
+
+class InvertedLists:
+    """Bucket -> rows mapping for a row-aligned, append-only store.
+
+    Every row belongs to exactly one bucket. Rows are only ever appended, so a
+    reader holding an older row count can keep gathering while a writer adds
+    rows; it just ignores rows past its count. Removal is done by rebuilding
+    (``from_assignments``) into a new object.
+    """
+
+    def __init__(self, n_buckets: int = 0):
+        self._lists: list[list[int]] = [[] for _ in range(n_buckets)]
+        self._bucket: list[int] = []  # row -> bucket
+
+    def __len__(self) -> int:
+        return len(self._bucket)
+
+    @property
+    def n_buckets(self) -> int:
+        return len(self._lists)
+
+    def add_bucket(self) -> int:
+        self._lists.append([])
+        return len(self._lists) - 1
+
+    def append(self, row: int, bucket: int) -> None:
+        if row != len(self._bucket):
+            raise ValueError(f"Rows must be appended in order (expected {len(self._bucket)}, got {row})")
+        self._bucket.append(bucket)
+        self._lists[bucket].append(row)
+
+    def rows(self, bucket: int) -> list[int]:
+        return self._lists[bucket]
+
+    def gather(self, buckets, limit: Optional[int] = None) -> np.ndarray:
+        """Rows in ``buckets``; with ``limit``, only rows below it (a reader's row count)."""
+        members = [self._lists[b] for b in buckets]
+        if not members:
+            return np.empty(0, dtype=np.int64)
+        rows = np.fromiter((row for m in members for row in m), dtype=np.int64)
+        return rows if limit is None else rows[rows < limit]
+
+    def assignments(self) -> np.ndarray:
+        return np.asarray(self._bucket, dtype=np.int32)
+
+    @classmethod
+    def from_assignments(cls, assignments: np.ndarray, n_buckets: int) -> "InvertedLists":
+        lists = cls(n_buckets)
+        for row, bucket in enumerate(assignments.tolist()):
+            lists.append(row, bucket)
+        return lists
+
+
+def _live_top_k(scores: np.ndarray, k: int, live: Optional[np.ndarray]) -> np.ndarray:
+    """top_k_rows that never returns rows masked out by ``live``."""
+    if live is None:
+        return top_k_rows(scores, k)
+    scores = np.where(live, scores, -np.inf)
+    rows = top_k_rows(scores, k)
+    return rows[np.isfinite(scores[rows])]
+
+
+class ExactIndex:
+    """Brute-force backend: scores every row with one matrix-vector product."""
+
+    kind = "exact"
+
+    def needs_training(self, n: int) -> bool:
+        return False
+
+    def train(self, matrix: np.ndarray) -> None:
+        pass
+
+    def add(self, row: int, vector: np.ndarray) -> None:
+        pass
+
+    def compact(self, keep: np.ndarray) -> None:
+        pass
+
+    def reset(self) -> None:
+        pass
+
+    def view(self):
+        return self
+
+    def search(
+        self, matrix: np.ndarray, query_vec: np.ndarray, top_k: int, live: Optional[np.ndarray] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Top-K rows of ``matrix``; rows where ``live`` is False are skipped."""
+        scores = matrix @ query_vec
+        rows = _live_top_k(scores, top_k, live)
+        return rows, scores[rows]
+
+    def state(self) -> Optional[dict]:
+        return None
+
+    def restore(self, state: dict, n: int) -> None:
+        pass
+
+
+class IVFIndex:
+    """Inverted-file ANN backend over spherical k-means centroids.
+
+    Rows are bucketed by their nearest centroid; a query scores the centroids and
+    then only the rows in the ``n_probe`` closest buckets. ``n_probe`` trades
+    recall for latency: ``n_probe == n_lists`` is an exact scan.
+
+    Until the store holds ``min_train_size`` rows the index is untrained and
+    search falls back to a brute-force scan. It retrains once the store has grown
+    ``retrain_factor`` times past the size it was trained on.
+    """
+
+    kind = "ivf"
+
+    def __init__(
+        self,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        min_train_size: int = 10_000,
+        retrain_factor: float = 4.0,
+        kmeans_iters: int = 10,
+        max_train_points: int = 65_536,
+        seed: int = 0,
+    ):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.retrain_factor = retrain_factor
+        self.kmeans_iters = kmeans_iters
+        self.max_train_points = max_train_points
+        self._rng = np.random.default_rng(seed)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: Optional[InvertedLists] = None
+        self._trained_size = 0
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def needs_training(self, n: int) -> bool:
+        if not self.trained:
+            return n >= self.min_train_size
+        return n >= self.retrain_factor * self._trained_size
+
+    def reset(self) -> None:
+        self._centroids = None
+        self._lists = None
+        self._trained_size = 0
+
+    def train(self, matrix: np.ndarray) -> None:
+        """Fit centroids on (a sample of) ``matrix`` and bucket every row."""
+        n = matrix.shape[0]
+        if n == 0:
+            self.reset()
+            return
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(n))), n)
+        if n > self.max_train_points:
+            sample = matrix[np.sort(self._rng.choice(n, self.max_train_points, replace=False))]
+        else:
+            sample = np.asarray(matrix)
+        self._centroids = self._kmeans(np.asarray(sample, dtype=np.float32), n_lists)
+        self._lists = InvertedLists.from_assignments(self._assign(matrix), n_lists)
+        self._trained_size = n
+        logger.info(f"IVF index trained: {n} rows in {n_lists} lists")
+
+    def _kmeans(self, data: np.ndarray, k: int) -> np.ndarray:
+        centroids = data[self._rng.choice(data.shape[0], k, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            assignments = self._assign(data, centroids)
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=k)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            non_empty = counts > 0
+            sums = np.add.reduceat(data[order], starts[non_empty], axis=0)
+            centroids[non_empty] = sums
+            empty = np.flatnonzero(~non_empty)
+            if empty.size:
+                centroids[empty] = data[self._rng.choice(data.shape[0], empty.size, replace=False)]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return centroids
+
+    def _assign(self, matrix: np.ndarray, centroids: Optional[np.ndarray] = None, chunk: int = 65_536) -> np.ndarray:
+        if centroids is None:
+            centroids = self._centroids
+        out = np.empty(matrix.shape[0], dtype=np.int32)
+        for start in range(0, matrix.shape[0], chunk):
+            out[start:start + chunk] = np.argmax(matrix[start:start + chunk] @ centroids.T, axis=1)
+        return out
+
+    def add(self, row: int, vector: np.ndarray) -> None:
+        if self.trained:
+            self._lists.append(row, int(np.argmax(self._centroids @ vector)))
+
+    def compact(self, keep: np.ndarray) -> None:
+        """Drop every row not in ``keep`` (sorted) and renumber the rest, as the store does."""
+        if self.trained:
+            self._lists = InvertedLists.from_assignments(self._lists.assignments()[keep], self._lists.n_buckets)
+
+    def view(self):
+        """Searcher pinned to the current centroids and lists; later retraining does not affect it."""
+        if not self.trained:
+            return ExactIndex()
+        return _IVFView(self, self._centroids, self._lists)
+
+    def search(
+        self, matrix: np.ndarray, query_vec: np.ndarray, top_k: int, live: Optional[np.ndarray] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        return self.view().search(matrix, query_vec, top_k, live)
+
+    def state(self) -> Optional[dict]:
+        if not self.trained:
+            return None
+        return {
+            "centroids": self._centroids,
+            "assignments": self._lists.assignments(),
+            "trained_size": np.int64(self._trained_size),
+        }
+
+    def restore(self, state: dict, n: int) -> None:
+        assignments = state["assignments"]
+        if assignments.shape[0] != n:
+            raise ValueError(f"Index covers {assignments.shape[0]} rows but the store has {n}")
+        self._centroids = np.asarray(state["centroids"], dtype=np.float32)
+        self._lists = InvertedLists.from_assignments(assignments, self._centroids.shape[0])
+        self._trained_size = int(state["trained_size"])
+
+
+class _IVFView:
+    """Read side of an IVFIndex at one training state (see IVFIndex.view).
+
+    Rows appended after the view was taken are ignored: only rows below
+    ``matrix.shape[0]`` are scored.
+    """
+
+    def __init__(self, owner: IVFIndex, centroids: np.ndarray, lists: InvertedLists):
+        self._owner = owner
+        self._centroids = centroids
+        self._lists = lists
+
+    def search(
+        self, matrix: np.ndarray, query_vec: np.ndarray, top_k: int, live: Optional[np.ndarray] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        probe = top_k_rows(self._centroids @ query_vec, self._owner.n_probe)
+        candidates = self._lists.gather(probe, limit=matrix.shape[0])
+        if live is not None:
+            candidates = candidates[live[candidates]]
+        scores = matrix[candidates] @ query_vec
+        best = top_k_rows(scores, top_k)
+        return candidates[best], scores[best]
@@ -0,0 +1,567 @@
+"""
+Micro-benchmarks for the vector store.
+
+Run:
+    cd server/API
+    python benchmark.py search --sizes 1000,10000,100000,1000000
+    python benchmark.py persistence --sizes 1000,10000,50000
+    python benchmark.py ann --size 200000 --n-probe 1,4,8,16,32
+    python benchmark.py quantize --size 200000
+    python benchmark.py wal --sizes 1000,10000,100000
+    python benchmark.py shared --sizes 1000,10000,50000
+    python benchmark.py multi --size 100000 --variants 4
+    python benchmark.py rcu --size 100000 --writes 5000
+    python benchmark.py importtime --module main
+    python benchmark.py ingest --sizes 1000,10000,50000
+    python benchmark.py pipeline --embed-ms 40 --expand-ms 400 --deadline-ms 300
+
+Each sub-command prints a plain-text table; numbers are wall-clock medians
+measured on synthetic, L2-normalized random embeddings.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from ann_index import ExactIndex, IVFIndex
+from vector_store import VectorStore, read_legacy_json, resident_bytes
+
+DEFAULT_DIM = 768  # nomic-embed-text
+
+
+def _random_unit_vectors(rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def _clustered_unit_vectors(rng: np.random.Generator, n: int, dim: int, clusters: int,
+                            noise: float = 1.5, chunk: int = 65536) -> np.ndarray:
+    """Gaussian-mixture embeddings; real embeddings cluster by topic, uniform noise does not."""
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    out = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        block = centers[rng.integers(0, clusters, stop - start)]
+        block += noise * rng.standard_normal(block.shape, dtype=np.float32)
+        out[start:stop] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return out
+
+
+def _fill_store(store: VectorStore, n: int, dim: int, rng: np.random.Generator, chunk: int = 65536,
+                vectors: np.ndarray = None):
+    """Populate a store with ``n`` synthetic rows without going through add_case."""
+    if vectors is not None:
+        store._matrix = vectors
+    else:
+        store._matrix = np.empty((n, dim), dtype=np.float32)
+        for start in range(0, n, chunk):
+            stop = min(start + chunk, n)
+            store._matrix[start:stop] = _random_unit_vectors(rng, stop - start, dim)
+    store._meta = [
+        {
+            "case_id": f"case-{i}",
+            "category": "bench",
+            "question": "",
+            "answer": "",
+            "priority": 1,
+            "created_at": "",
+        }
+        for i in range(n)
+    ]
+    store._reindex()
+    store._publish()
+
+
+def _median_ms(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def bench_search(args):
+    rng = np.random.default_rng(args.seed)
+    queries = _random_unit_vectors(rng, args.queries, args.dim)
+    print(f"{'rows':>10} {'matrix ms/query':>16} {'legacy ms/query':>16}")
+    for n in args.sizes:
+        store = VectorStore(persist_path="/dev/null")
+        _fill_store(store, n, args.dim, rng)
+        query_iter = iter(np.tile(queries, (args.repeats + 1, 1)))
+        matrix_ms = _median_ms(
+            lambda: asyncio.run(store.search(next(query_iter), top_k=args.top_k)), args.repeats
+        )
+
+        legacy = "-"
+        if n <= args.legacy_max:
+            # Previous behaviour: rebuild the matrix from per-entry Python lists on every query.
+            entries = [row.tolist() for row in store._matrix[:n]]
+            query = queries[0]
+
+            def legacy_search():
+                matrix = np.array(entries)
+                scores = matrix @ query
+                np.argsort(scores)[::-1][: args.top_k]
+
+            legacy = f"{_median_ms(legacy_search, args.repeats):.3f}"
+
+        print(f"{n:>10} {matrix_ms:>16.3f} {legacy:>16}")
+        del store
+
+
+def bench_persistence(args):
+    rng = np.random.default_rng(args.seed)
+    print(f"{'rows':>8} {'format':>7} {'size MB':>9} {'save ms':>10} {'load ms':>10}")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "vector_store.json")
+            store = VectorStore(persist_path=path)
+            _fill_store(store, n, args.dim, rng)
+
+            # Previous format: one JSON document with every embedding as a list of floats.
+            def legacy_save():
+                data = [{**meta, "embedding": store._matrix[row].tolist()} for row, meta in enumerate(store._meta)]
+                with open(path, "w") as f:
+                    json.dump(data, f)
+
+            legacy_save_ms = _median_ms(legacy_save, args.repeats)
+            legacy_load_ms = _median_ms(lambda: read_legacy_json(path), args.repeats)
+            legacy_mb = os.path.getsize(path) / 1e6
+            os.remove(path)
+
+            binary_save_ms = _median_ms(lambda: asyncio.run(store.save()), args.repeats)
+            binary_load_ms = _median_ms(lambda: asyncio.run(VectorStore(persist_path=path).load()), args.repeats)
+            binary_mb = (os.path.getsize(store._embeddings_path) + os.path.getsize(store._meta_path)) / 1e6
+
+        print(f"{n:>8} {'json':>7} {legacy_mb:>9.1f} {legacy_save_ms:>10.1f} {legacy_load_ms:>10.1f}")
+        print(f"{n:>8} {'binary':>7} {binary_mb:>9.1f} {binary_save_ms:>10.1f} {binary_load_ms:>10.1f}")
+
+
+def bench_ann(args):
+    rng = np.random.default_rng(args.seed)
+    data = _clustered_unit_vectors(rng, args.size + args.queries, args.dim, args.clusters)
+    corpus, queries = data[:args.size], data[args.size:]
+
+    exact = ExactIndex()
+    truth = [set(exact.search(corpus, q, args.top_k)[0].tolist()) for q in queries]
+    query_iter = iter(np.tile(queries, (args.repeats + 1, 1)))
+    exact_ms = _median_ms(lambda: exact.search(corpus, next(query_iter), args.top_k), args.repeats)
+
+    index = IVFIndex(n_lists=args.n_lists, seed=args.seed)
+    start = time.perf_counter()
+    index.train(corpus)
+    train_s = time.perf_counter() - start
+    print(f"rows={args.size} dim={args.dim} lists={index._centroids.shape[0]} train={train_s:.1f}s")
+    print(f"{'backend':>12} {f'recall@{args.top_k}':>10} {'ms/query':>10}")
+    print(f"{'exact':>12} {1.0:>10.3f} {exact_ms:>10.3f}")
+    for n_probe in args.n_probe:
+        index.n_probe = n_probe
+        hits = sum(
+            len(truth[i] & set(index.search(corpus, q, args.top_k)[0].tolist())) for i, q in enumerate(queries)
+        )
+        recall = hits / (len(queries) * args.top_k)
+        query_iter = iter(np.tile(queries, (args.repeats + 1, 1)))
+        ivf_ms = _median_ms(lambda: index.search(corpus, next(query_iter), args.top_k), args.repeats)
+        print(f"{f'ivf/{n_probe}':>12} {recall:>10.3f} {ivf_ms:>10.3f}")
+
+
+def bench_quantize(args):
+    rng = np.random.default_rng(args.seed)
+    data = _clustered_unit_vectors(rng, args.size + args.queries + 1, args.dim, args.clusters)
+    corpus, queries, extra = data[:args.size], data[args.size:-1], data[-1]
+
+    # Previous in-memory representation: one Python list of float64 objects per case.
+    row = corpus[0].tolist()
+    legacy_bytes = sys.getsizeof(row) + sum(sys.getsizeof(x) for x in row)
+    print(f"rows={args.size} dim={args.dim} legacy python-list bytes/case={legacy_bytes}")
+    # Resident: float32 rows and codes held in process memory after a reload and one
+    # add_case; memory-mapped rows are left to the page cache and not counted.
+    print(f"{'mode':>8} {'scan B/case':>12} {'resident MB':>12} {f'recall@{args.top_k}':>10} {'ms/query':>10}")
+
+    truth = None
+    for mode in (None, "float16", "int8"):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "vector_store.json")
+            store = VectorStore(persist_path=path, quantization=mode, rescore_factor=args.rescore_factor)
+            _fill_store(store, args.size, args.dim, rng, vectors=corpus)
+            store._restore_codes(None)
+            asyncio.run(store.save())
+            store = VectorStore(persist_path=path, quantization=mode, rescore_factor=args.rescore_factor)
+            asyncio.run(store.load())
+            asyncio.run(store.add_case({"question": "q", "answer": "a", "category": "bench"}, extra))
+            snap = store.snapshot()
+            results = [snap.top_k_rows(q, args.top_k)[0] for q in queries]
+            if truth is None:
+                truth = [set(r.tolist()) for r in results]
+            hits = sum(len(truth[i] & set(r.tolist())) for i, r in enumerate(results))
+            recall = hits / (len(queries) * args.top_k)
+            query_iter = iter(np.tile(queries, (args.repeats + 1, 1)))
+            ms = _median_ms(lambda: snap.top_k_rows(next(query_iter), args.top_k), args.repeats)
+            resident = (resident_bytes(snap.matrix) + resident_bytes(snap.codes)) / 2**20
+            scanned = np.dtype(store._quantizer.dtype if mode else np.float32).itemsize * args.dim
+            del snap, store
+        print(f"{mode or 'float32':>8} {scanned:>12} {resident:>12.1f} {recall:>10.3f} {ms:>10.3f}")
+
+
+def bench_wal(args):
+    rng = np.random.default_rng(args.seed)
+    print(f"{'rows':>8} {'add+commit ms':>14} {'add+save ms':>12}")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = VectorStore(persist_path=os.path.join(tmp, "vector_store.json"))
+            _fill_store(store, n, args.dim, rng)
+            asyncio.run(store.save())
+            vectors = iter(_random_unit_vectors(rng, 2 * args.repeats, args.dim))
+
+            async def add_commit():
+                await store.add_case({"question": "q", "answer": "a", "category": "bench"}, next(vectors))
+                await store.commit()
+
+            async def add_save():
+                await store.add_case({"question": "q", "answer": "a", "category": "bench"}, next(vectors))
+                await store.save()
+
+            commit_ms = _median_ms(lambda: asyncio.run(add_commit()), args.repeats)
+            save_ms = _median_ms(lambda: asyncio.run(add_save()), args.repeats)
+        print(f"{n:>8} {commit_ms:>14.2f} {save_ms:>12.2f}")
+
+
+def bench_shared(args):
+    rng = np.random.default_rng(args.seed)
+    print(f"{'rows':>8} {'write scope ms':>15} {'reader catch-up ms':>19} {'base reload ms':>15}")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "vector_store.json")
+            seed = VectorStore(persist_path=path)
+            _fill_store(seed, n, args.dim, rng)
+            asyncio.run(seed.save())
+            writer, reader = VectorStore(persist_path=path, shared=True), VectorStore(persist_path=path, shared=True)
+            asyncio.run(writer.load())
+            asyncio.run(reader.load())
+            vectors = iter(_random_unit_vectors(rng, args.repeats, args.dim))
+
+            async def write():
+                async with writer.writing():
+                    await writer.add_case({"question": "q", "answer": "a", "category": "bench"}, next(vectors))
+
+            write_ms, read_ms = [], []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                asyncio.run(write())
+                write_ms.append((time.perf_counter() - start) * 1000)
+                # Applying the new WAL records; this part runs on the reader's event loop.
+                start = time.perf_counter()
+                reader.refresh()
+                read_ms.append((time.perf_counter() - start) * 1000)
+            # What a worker does in a thread after a compaction rewrote the base.
+            reload_ms = _median_ms(reader._load_shared_copy, 3)
+        print(f"{n:>8} {statistics.median(write_ms):>15.2f} {statistics.median(read_ms):>19.3f} {reload_ms:>15.1f}")
+
+
+def bench_multi(args):
+    rng = np.random.default_rng(args.seed)
+    store = VectorStore(persist_path="/dev/null")
+    _fill_store(store, args.size, args.dim, rng)
+    queries = [_random_unit_vectors(rng, args.variants, args.dim) for _ in range(args.repeats + 1)]
+    print(f"{args.size} rows, {args.variants} query variants")
+    query_iter = iter(queries)
+    sequential_ms = _median_ms(
+        lambda: [store.search_sync(q, top_k=args.top_k) for q in next(query_iter)], args.repeats
+    )
+    query_iter = iter(queries)
+    batched_ms = _median_ms(lambda: store.search_many_sync(list(next(query_iter)), top_k=args.top_k), args.repeats)
+    print(f"{'sequential ms':>14} {'batched ms':>11}")
+    print(f"{sequential_ms:>14.3f} {batched_ms:>11.3f}")
+
+
+def bench_rcu(args):
+    rng = np.random.default_rng(args.seed)
+    store = VectorStore(persist_path="/dev/null")
+    _fill_store(store, args.size, args.dim, rng)
+    queries = _random_unit_vectors(rng, 64, args.dim)
+    new_vectors = _random_unit_vectors(rng, args.writes, args.dim)
+
+    def measure(write=None):
+        """Searches/s from a reader thread over ``args.seconds`` (while ``write`` runs, if given)."""
+        stop = threading.Event()
+        count = [0]
+
+        def reader():
+            i = 0
+            while not stop.is_set():
+                store.search_sync(queries[i % len(queries)], top_k=args.top_k)
+                i += 1
+            count[0] = i
+
+        thread = threading.Thread(target=reader)
+        start = time.perf_counter()
+        thread.start()
+        if write is not None:
+            asyncio.run(write())
+        time.sleep(max(0.0, args.seconds - (time.perf_counter() - start)))
+        stop.set()
+        thread.join()
+        return count[0] / (time.perf_counter() - start)
+
+    async def bulk_train():
+        for i, vector in enumerate(new_vectors):
+            await store.add_case({"question": "q", "answer": "a", "category": "bench"}, vector)
+            if i % 10 == 0:
+                await store.delete_case(store.snapshot().meta[i]["case_id"])
+
+    idle = measure()
+    busy = measure(bulk_train)
+    print(f"{args.size} rows; {args.writes} adds (+10% deletes) during the second run")
+    print(f"{'idle searches/s':>16} {'during writes':>14}")
+    print(f"{idle:>16.0f} {busy:>14.0f}")
+
+
+def bench_ingest(args):
+    """Store-side ingest throughput (embedding time excluded): per-case add_case vs one add_cases batch."""
+    rng = np.random.default_rng(args.seed)
+    print(f"{'cases':>8} {'per-case cases/s':>17} {'bulk cases/s':>13}")
+    for n in args.sizes:
+        vectors = _random_unit_vectors(rng, n, args.dim)
+        cases = [{"question": f"question {i}", "answer": f"answer {i}", "category": "bench"} for i in range(n)]
+        rates = []
+        for bulk in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                store = VectorStore(persist_path=os.path.join(tmp, "vector_store.json"))
+
+                async def ingest():
+                    if bulk:
+                        await store.add_cases(cases, vectors)
+                    else:
+                        for case, vector in zip(cases, vectors):
+                            await store.add_case(case, vector)
+                    await store.commit()
+
+                start = time.perf_counter()
+                asyncio.run(ingest())
+                rates.append(n / (time.perf_counter() - start))
+        print(f"{n:>8} {rates[0]:>17.0f} {rates[1]:>13.0f}")
+
+
+def bench_pipeline(args):
+    """Retrieval latency with expansion after the first pass vs overlapped with it, against a simulated Ollama."""
+    import httpx
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("VECTOR_STORE_PATH", os.path.join(tmp, "vector_store.json"))
+    os.environ.setdefault("EMBEDDING_CACHE_PATH", "")
+    os.environ.setdefault("TRAIN_JOBS_DIR", os.path.join(tmp, "train_jobs"))
+    import main
+    from embedding_cache import EmbeddingCache
+    from query_processor import QueryProcessor
+    from stage_timings import StageTimings
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+
+    rng = np.random.default_rng(args.seed)
+    store = VectorStore(persist_path="/dev/null")
+    _fill_store(store, args.size, args.dim, rng)
+    stored = store.snapshot().matrix
+
+    class SimulatedGeneration:
+        """Streamed expansion: three lines spread evenly over ``args.expand_ms``."""
+
+        status_code = 200
+
+        def __init__(self, query):
+            self.lines = [f"{query} {i}" for i in range(3)]
+
+        async def aiter_lines(self):
+            for line in self.lines:
+                await asyncio.sleep(args.expand_ms / 1000 / len(self.lines))
+                yield json.dumps({"response": line + "\n", "done": False})
+            yield json.dumps({"response": "", "done": True})
+
+    class SimulatedOllama:
+        @contextlib.asynccontextmanager
+        async def stream(self, method, path, json=None, timeout=None):
+            yield SimulatedGeneration(json["prompt"].rsplit(": ", 1)[-1])
+
+        async def post(self, path, json=None, timeout=None):
+            await asyncio.sleep(args.embed_ms / 1000)
+
+            def embed(text):
+                # "strong N" queries are stored row N; anything else is a random (weak) match
+                if text.startswith("strong "):
+                    return stored[int(text.split()[1]) % args.size].tolist()
+                return _random_unit_vectors(np.random.default_rng(abs(hash(text))), 1, args.dim)[0].tolist()
+
+            return httpx.Response(200, json={"embeddings": [embed(text) for text in json["input"]]})
+
+    ollama = SimulatedOllama()
+    main.trainer = SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store)
+    main.generate_pool = main.embed_pool = ollama
+    main.QUERY_EXPANSION_DEADLINE_SECONDS = args.deadline_ms / 1000
+
+    print(f"{args.size} rows; embed {args.embed_ms:.0f} ms, expansion {args.expand_ms:.0f} ms per call, "
+          f"deadline {args.deadline_ms:.0f} ms")
+    print(f"{'mode':<12} {'weak ms':>8} {'strong ms':>10}   per-stage avg ms")
+    for speculative in (False, True):
+        main.SPECULATIVE_EXPANSION = speculative
+        main.query_processor = QueryProcessor(embedding_cache=EmbeddingCache())
+        main.pipeline_timings = StageTimings()
+        latencies = {}
+        for kind in ("weak", "strong"):
+            timings = []
+            for i in range(args.repeats):
+                query = f"{kind} {i} {speculative}"
+                start = time.perf_counter()
+                asyncio.run(main.retrieve_with_adaptive_expansion(query, query))
+                timings.append((time.perf_counter() - start) * 1000)
+            latencies[kind] = statistics.median(timings)
+        stages = ", ".join(f"{name} {stat['avg_ms']:.0f}" for name, stat in main.pipeline_timings.stats().items())
+        mode = "overlapped" if speculative else "sequential"
+        print(f"{mode:<12} {latencies['weak']:>8.1f} {latencies['strong']:>10.1f}   {stages}")
+
+
+def bench_importtime(args):
+    """Cold-start cost of importing ``args.module`` in a fresh interpreter, via ``-X importtime``."""
+    totals = []
+    cumulative: dict[str, list[int]] = {}
+    for _ in range(args.repeats):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {args.module}"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        )
+        run: dict[str, int] = {}
+        for line in proc.stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cum_us, name = line[len("import time:"):].split("|")
+            name = name.strip()
+            run[name] = max(run.get(name, 0), int(cum_us))
+            if name == args.module:
+                totals.append(int(cum_us))
+        for name, cum_us in run.items():
+            cumulative.setdefault(name, []).append(cum_us)
+
+    print(f"import {args.module}: {statistics.median(totals) / 1e3:.1f} ms (median of {args.repeats} cold starts)")
+    top = sorted(cumulative.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    print(f"{'module':<40} {'cumulative ms':>14}")
+    for name, times in top[: args.top]:
+        print(f"{name:<40} {statistics.median(times) / 1e3:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    search = sub.add_parser("search", help="per-query search latency by store size")
+    search.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")],
+                        default=[1_000, 10_000, 100_000, 1_000_000])
+    search.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    search.add_argument("--top-k", type=int, default=5)
+    search.add_argument("--queries", type=int, default=20)
+    search.add_argument("--repeats", type=int, default=20)
+    search.add_argument("--legacy-max", type=int, default=10_000,
+                        help="largest size to also time the per-query list rebuild")
+    search.add_argument("--seed", type=int, default=0)
+    search.set_defaults(func=bench_search)
+
+    persistence = sub.add_parser("persistence", help="save/load time and size: legacy JSON vs binary")
+    persistence.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")],
+                             default=[1_000, 10_000, 50_000])
+    persistence.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    persistence.add_argument("--repeats", type=int, default=3)
+    persistence.add_argument("--seed", type=int, default=0)
+    persistence.set_defaults(func=bench_persistence)
+
+    ann = sub.add_parser("ann", help="IVF recall@k and latency against brute force")
+    ann.add_argument("--size", type=int, default=200_000)
+    ann.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    ann.add_argument("--clusters", type=int, default=1_000)
+    ann.add_argument("--n-lists", type=int, default=None)
+    ann.add_argument("--n-probe", type=lambda s: [int(x) for x in s.split(",")], default=[1, 4, 8, 16, 32])
+    ann.add_argument("--top-k", type=int, default=10)
+    ann.add_argument("--queries", type=int, default=100)
+    ann.add_argument("--repeats", type=int, default=50)
+    ann.add_argument("--seed", type=int, default=0)
+    ann.set_defaults(func=bench_ann)
+
+    quantize = sub.add_parser("quantize", help="quantized scan: bytes/case, resident memory, recall loss and latency")
+    quantize.add_argument("--size", type=int, default=200_000)
+    quantize.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    quantize.add_argument("--clusters", type=int, default=1_000)
+    quantize.add_argument("--top-k", type=int, default=10)
+    quantize.add_argument("--rescore-factor", type=int, default=4)
+    quantize.add_argument("--queries", type=int, default=100)
+    quantize.add_argument("--repeats", type=int, default=20)
+    quantize.add_argument("--seed", type=int, default=0)
+    quantize.set_defaults(func=bench_quantize)
+
+    wal = sub.add_parser("wal", help="single-case write latency: WAL commit vs full save")
+    wal.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1_000, 10_000, 100_000])
+    wal.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    wal.add_argument("--repeats", type=int, default=10)
+    wal.add_argument("--seed", type=int, default=0)
+    wal.set_defaults(func=bench_wal)
+
+    shared = sub.add_parser("shared", help="multi-worker store: write scope, reader catch-up and base reload")
+    shared.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1_000, 10_000, 50_000])
+    shared.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    shared.add_argument("--repeats", type=int, default=20)
+    shared.add_argument("--seed", type=int, default=0)
+    shared.set_defaults(func=bench_shared)
+
+    multi = sub.add_parser("multi", help="m query variants: sequential searches vs one batched search")
+    multi.add_argument("--size", type=int, default=100_000)
+    multi.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    multi.add_argument("--variants", type=int, default=4)
+    multi.add_argument("--top-k", type=int, default=5)
+    multi.add_argument("--repeats", type=int, default=20)
+    multi.add_argument("--seed", type=int, default=0)
+    multi.set_defaults(func=bench_multi)
+
+    rcu = sub.add_parser("rcu", help="search throughput from a reader thread, idle vs during bulk writes")
+    rcu.add_argument("--size", type=int, default=100_000)
+    rcu.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    rcu.add_argument("--writes", type=int, default=5_000)
+    rcu.add_argument("--seconds", type=float, default=3.0)
+    rcu.add_argument("--top-k", type=int, default=5)
+    rcu.add_argument("--seed", type=int, default=0)
+    rcu.set_defaults(func=bench_rcu)
+
+    ingest = sub.add_parser("ingest", help="bulk ingest throughput: per-case inserts vs one batched insert")
+    ingest.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1_000, 10_000, 50_000])
+    ingest.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    ingest.add_argument("--seed", type=int, default=0)
+    ingest.set_defaults(func=bench_ingest)
+
+    pipeline = sub.add_parser("pipeline", help="retrieval latency per stage: sequential vs overlapped expansion")
+    pipeline.add_argument("--size", type=int, default=10_000)
+    pipeline.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    pipeline.add_argument("--embed-ms", type=float, default=40.0)
+    pipeline.add_argument("--expand-ms", type=float, default=400.0)
+    pipeline.add_argument("--deadline-ms", type=float, default=0.0, help="0 waits for every alternative")
+    pipeline.add_argument("--repeats", type=int, default=10)
+    pipeline.add_argument("--seed", type=int, default=0)
+    pipeline.set_defaults(func=bench_pipeline)
+
+    importtime = sub.add_parser("importtime", help="cold-start import time and the slowest imported modules")
+    importtime.add_argument("--module", default="main")
+    importtime.add_argument("--repeats", type=int, default=5)
+    importtime.add_argument("--top", type=int, default=15)
+    importtime.set_defaults(func=bench_importtime)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
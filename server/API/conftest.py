@@ -1,5 +1,10 @@
 """Pytest fixtures for the LLM support API test suite."""
+import json
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -7,54 +12,199 @@ from fastapi.testclient import TestClient
 os.environ.setdefault("VECTOR_STORE_PATH", "/tmp/test_vector_store.json")
 os.environ.setdefault("FEEDBACK_FILE", "/tmp/test_feedback.json")
 os.environ.setdefault("QUERY_LOG_FILE", "/tmp/test_query_log.json")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", "/tmp/test_embedding_cache.sqlite3")
+os.environ.setdefault("TRAIN_JOBS_DIR", "/tmp/test_train_jobs")
 os.environ.setdefault("ADMIN_PASSWORD", "testpass")
 
 # Import app AFTER env vars are set
 from main import app  # noqa: E402
 
 
-@pytest.fixture(scope="module")
-def client():
-    """Bare test client — no training data loaded."""
+def wait_for_train_job(client, job_id: str, timeout: float = 120.0) -> dict:
+    """Poll GET /train-jobs/{job_id} until the job finishes."""
+    deadline = time.time() + timeout
+    while True:
+        job = client.get(f"/train-jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed") or time.time() > deadline:
+            return job
+        time.sleep(0.1)
+
+
+class OllamaStandIn:
+    """A local HTTP server answering the Ollama API calls the app makes.
+
+    Embeddings are derived from the text length and generation echoes the
+    prompt (streamed one word per line when asked). Every request sleeps
+    ``delay`` seconds, prompts containing "slow" another ``slow_seconds``, and
+    a ``status`` other than 200 fails every request, health checks included.
+    To inject faults, requests to ``broken_paths`` answer 500, the next
+    ``fail_next`` requests answer 503 and the next ``stall_next`` requests
+    sleep another ``stall_seconds``.
+    Records request paths and the peak number of requests in flight.
+    """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.slow_seconds = 0.5
+        self.status = 200
+        self.broken_paths = set()
+        self.fail_next = 0
+        self.stall_next = 0
+        self.stall_seconds = 2.0
+        self.paths = []
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                standin._handle(self, {})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                standin._handle(self, json.loads(self.rfile.read(length) or b"{}"))
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def requests_to(self, path: str) -> int:
+        return self.paths.count(path)
+
+    def _handle(self, handler, body: dict) -> None:
+        with self._lock:
+            self.paths.append(handler.path)
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            fail, stall = self.fail_next > 0, self.stall_next > 0
+            self.fail_next -= fail
+            self.stall_next -= stall
+        try:
+            prompt = body.get("prompt", "")
+            stalled = self.stall_seconds if stall else 0.0
+            time.sleep(self.delay + (self.slow_seconds if "slow" in prompt else 0.0) + stalled)
+            if fail:
+                self._send(handler, 503, {"error": "unavailable"})
+            elif self.status != 200:
+                self._send(handler, self.status, {"error": "unavailable"})
+            elif handler.path in self.broken_paths:
+                self._send(handler, 500, {"error": "model failed"})
+            elif handler.path == "/api/tags":
+                self._send(handler, 200, {"models": []})
+            elif handler.path == "/api/embed":
+                self._send(handler, 200, {"embeddings": [[float(len(t)), 1.0, 0.5] for t in body["input"]]})
+            elif handler.path == "/api/embeddings":
+                self._send(handler, 200, {"embedding": [float(len(prompt)), 1.0, 0.5]})
+            elif handler.path == "/api/generate" and body.get("stream"):
+                lines = [{"response": f"{word} ", "done": False} for word in prompt.split()] + [{"done": True}]
+                handler.send_response(200)
+                handler.end_headers()
+                for line in lines:
+                    handler.wfile.write((json.dumps(line) + "\n").encode())
+            elif handler.path == "/api/generate":
+                self._send(handler, 200, {"response": f"echo: {prompt}", "done": True})
+            else:
+                self._send(handler, 404, {"error": "not found"})
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @staticmethod
+    def _send(handler, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def ollama_standin():
+    """Returns ``start() -> OllamaStandIn``; servers are shut down after the test."""
+    servers = []
+
+    def start() -> OllamaStandIn:
+        servers.append(OllamaStandIn())
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def train_and_wait():
+    """Returns ``f(client, payload) -> job``: POST /train-support and wait for the job."""
+    def train(client, payload: dict) -> dict:
+        r = client.post("/train-support", json=payload)
+        assert r.status_code == 202, f"Training failed: {r.text}"
+        return wait_for_train_job(client, r.json()["job_id"])
+    return train
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    """The one TestClient (and app lifespan) shared by all tests.
+
+    Background work started by the lifespan, such as the training job worker,
+    runs on this client's event loop, so nested lifespans would strand it.
+    """
     with TestClient(app) as c:
         yield c
 
 
 @pytest.fixture(scope="module")
-def trained_client():
+def client(app_client):
+    """Bare test client — does not load training data."""
+    yield app_client
+
+
+@pytest.fixture(scope="module")
+def trained_client(app_client):
     """Test client pre-loaded with a small set of training cases.
     NOTE: requires a running Ollama instance with nomic-embed-text.
     Skip automatically if Ollama is unreachable.
     """
-    with TestClient(app) as c:
-        # Quick connectivity check
-        r = c.get("/health")
-        if r.status_code == 200 and not r.json().get("ollama_reachable", False):
-            pytest.skip("Ollama not reachable — skipping trained_client fixture")
-
-        cases = {
-            "cases": [
-                {
-                    "question": "Where is my order?",
-                    "answer": "Please provide your order ID and we will track it for you.",
-                    "category": "seguimiento_pedido",
-                    "priority": 1,
-                },
-                {
-                    "question": "I need a refund",
-                    "answer": "Refunds take 5-7 business days. Please share your order ID.",
-                    "category": "reembolsos",
-                    "priority": 2,
-                },
-                {
-                    "question": "How do I pay with PayPal?",
-                    "answer": "Select PayPal as your payment method at checkout.",
-                    "category": "opciones_pago",
-                    "priority": 3,
-                },
-            ],
-            "use_gpu": False,
-        }
-        r = c.post("/train-support", json=cases)
-        assert r.status_code == 200, f"Training failed: {r.text}"
-        yield c
+    c = app_client
+    # Quick connectivity check
+    r = c.get("/health")
+    if r.status_code == 200 and not r.json().get("ollama_reachable", False):
+        pytest.skip("Ollama not reachable — skipping trained_client fixture")
+
+    cases = {
+        "cases": [
+            {
+                "question": "Where is my order?",
+                "answer": "Please provide your order ID and we will track it for you.",
+                "category": "seguimiento_pedido",
+                "priority": 1,
+            },
+            {
+                "question": "I need a refund",
+                "answer": "Refunds take 5-7 business days. Please share your order ID.",
+                "category": "reembolsos",
+                "priority": 2,
+            },
+            {
+                "question": "How do I pay with PayPal?",
+                "answer": "Select PayPal as your payment method at checkout.",
+                "category": "opciones_pago",
+                "priority": 3,
+            },
+        ],
+        "use_gpu": False,
+    }
+    r = c.post("/train-support", json=cases)
+    assert r.status_code == 202, f"Training failed: {r.text}"
+    job = wait_for_train_job(c, r.json()["job_id"])
+    assert job["status"] == "completed", f"Training job failed: {job}"
+    yield c
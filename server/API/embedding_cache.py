@@ -0,0 +1,154 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Cache-key form of a text: Unicode NFC with whitespace runs collapsed.
+
+    Case and punctuation are kept, since the embedding model sees them.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """Two-tier cache of embeddings keyed by (model, normalized text).
+
+    The memory tier is an LRU bounded to ``max_entries`` vectors. Behind it is
+    a SQLite table at ``path`` (``None`` or ``":memory:"`` disables
+    persistence) that survives restarts and is shared by every worker
+    process; a disk hit is promoted into the memory tier. Vectors are stored
+    as float32, so a cached embedding is returned exactly as the first caller
+    saw it.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._memory: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._path = path if path and path != ":memory:" else None
+        self._db = sqlite3.connect(self._path or ":memory:", check_same_thread=False, isolation_level=None)
+        if self._path:
+            # WAL lets several workers read while one writes; NORMAL skips an fsync
+            # per commit (a crash can only lose recently cached vectors).
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL)"
+        )
+
+    @staticmethod
+    def _key(model: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        if self.max_entries <= 0:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old.nbytes
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+        while len(self._memory) > self.max_entries:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def get_many(self, model: str, texts: list[str]) -> list[Optional[list[float]]]:
+        """Cached embedding for each text, or ``None`` where it has not been seen."""
+        keys = [self._key(model, text) for text in texts]
+        found: dict[bytes, np.ndarray] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                elif key not in missing:
+                    missing.append(key)
+            if missing:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", missing
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    found[key] = vector
+            for key in keys:
+                if key not in found:
+                    self.misses += 1
+                elif key in missing:
+                    self.disk_hits += 1
+                else:
+                    self.memory_hits += 1
+        return [found[key].tolist() if key in found else None for key in keys]
+
+    def get(self, model: str, text: str) -> Optional[list[float]]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, items: list[tuple[str, list[float]]]) -> list[list[float]]:
+        """Cache ``(text, embedding)`` pairs in both tiers; returns the embeddings as stored."""
+        if not items:
+            return []
+        rows = []
+        stored = []
+        with self._lock:
+            for text, embedding in items:
+                key = self._key(model, text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, model, vector.tobytes()))
+                stored.append(vector.tolist())
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+        return stored
+
+    def put(self, model: str, text: str, embedding: list[float]) -> list[float]:
+        return self.put_many(model, [(text, embedding)])[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._db.execute("DELETE FROM embeddings")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_entries, disk_vector_bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+            return {
+                "lookups": lookups,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": disk_entries,
+                "disk_bytes": self._file_bytes() if self._path else disk_vector_bytes,
+            }
+
+    def _file_bytes(self) -> int:
+        return sum(
+            os.path.getsize(self._path + suffix)
+            for suffix in ("", "-wal")
+            if os.path.exists(self._path + suffix)
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
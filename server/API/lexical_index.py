@@ -0,0 +1,134 @@
+import math
+import re
+import unicodedata
+from typing import Optional
+
+import numpy as np
+
+from ann_index import top_k_rows
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Function words that carry no retrieval signal in the (Spanish/English) knowledge base.
+STOPWORDS = frozenset(
+    "a al como con de del el en es la las lo los mi me mis no o para por que se su sus un una y "
+    "an and are do does for how i in is it my of on or the to what when where why with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase, strip accents and split into alphanumeric terms, dropping stopwords."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [t for t in TOKEN_PATTERN.findall(text) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 inverted index, row-aligned with the vector store.
+
+    Postings map term -> parallel (rows, term frequencies) lists. Rows are only
+    ever appended, so a reader scoring against an older row count ``n`` (and
+    liveness mask) is unaffected by concurrent appends; document frequencies and
+    the average length are computed for that reader's rows. Removal is done by
+    rebuilding the index.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, tuple[list[int], list[int]]] = {}
+        self._doc_len = np.zeros(1024, dtype=np.float32)
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def append(self, row: int, text: str) -> None:
+        if row != self._n:
+            raise ValueError(f"Rows must be appended in order (expected {self._n}, got {row})")
+        counts: dict[str, int] = {}
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            rows, tfs = self._postings.setdefault(term, ([], []))
+            rows.append(row)
+            tfs.append(tf)
+        if row == self._doc_len.shape[0]:
+            self._doc_len = np.concatenate([self._doc_len, np.zeros_like(self._doc_len)])
+        self._doc_len[row] = sum(counts.values())
+        self._n += 1
+
+    def _term_postings(self, term: str, n: int, live: Optional[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+        postings = self._postings.get(term)
+        if postings is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, tfs = postings
+        # Term frequencies are appended after rows, so their length is the safe bound.
+        m = len(tfs)
+        rows = np.asarray(rows[:m], dtype=np.int64)
+        tfs = np.asarray(tfs[:m], dtype=np.float32)
+        keep = rows < n
+        if live is not None:
+            keep[keep] = live[rows[keep]]
+        return rows[keep], tfs[keep]
+
+    def scores(self, query: str, n: int, live: Optional[np.ndarray] = None) -> tuple[np.ndarray, float]:
+        """BM25 score of rows ``0..n-1`` for ``query``, plus the query's ideal score.
+
+        The ideal score is what a document of average length containing each
+        query term once would get; dividing by it puts scores on a roughly
+        0..1 scale that does not depend on query length. Query terms missing
+        from the index still count towards it, so partial matches score low.
+        """
+        scores, _, _, ideal = self._score(query, n, live)
+        return scores, ideal
+
+    def _score(
+        self, query: str, n: int, live: Optional[np.ndarray]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+        """Scores, matched query terms and matched idf mass per row, and the ideal score."""
+        scores = np.zeros(n, dtype=np.float32)
+        matched = np.zeros(n, dtype=np.int32)
+        idf_mass = np.zeros(n, dtype=np.float32)
+        terms = set(tokenize(query))
+        doc_len = self._doc_len[:n]
+        n_docs = n if live is None else int(np.count_nonzero(live[:n]))
+        if n_docs == 0 or not terms:
+            return scores, matched, idf_mass, 0.0
+        avg_len = max(float(doc_len.sum() if live is None else doc_len[live[:n]].sum()) / n_docs, 1.0)
+        ideal = 0.0
+        for term in terms:
+            rows, tf = self._term_postings(term, n, live)
+            idf = math.log(1.0 + (n_docs - rows.shape[0] + 0.5) / (rows.shape[0] + 0.5))
+            ideal += idf
+            if rows.shape[0]:
+                norm = self.k1 * (1.0 - self.b + self.b * doc_len[rows] / avg_len)
+                scores[rows] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+                matched[rows] += 1
+                idf_mass[rows] += idf
+        return scores, matched, idf_mass, ideal
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        n: Optional[int] = None,
+        rows: Optional[np.ndarray] = None,
+        live: Optional[np.ndarray] = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Top-K rows (optionally restricted to ``rows``) with the evidence for each.
+
+        Returns the rows, their normalized scores (capped at 1), how many
+        distinct query terms each contains and the summed idf of those terms.
+        The normalized score only says how much of the query a row covers, so
+        a one-word or common-word query covers it fully; the term count and
+        idf mass say how much evidence that is. Rows that share no term with
+        the query are never returned.
+        """
+        scores, matched, idf_mass, ideal = self._score(query, self._n if n is None else n, live)
+        if ideal <= 0.0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        candidates = np.flatnonzero(scores) if rows is None else rows[scores[rows] > 0]
+        best = candidates[top_k_rows(scores[candidates], top_k)]
+        return best, np.minimum(scores[best] / ideal, 1.0), matched[best], idf_mass[best]
@@ -1,25 +1,32 @@
+import asyncio
 import os
 import re
 import json
 import time
 import logging
 import uuid
-from contextlib import asynccontextmanager
+from contextlib import aclosing, asynccontextmanager
 from datetime import datetime, timezone
 
-import httpx
-import psutil
-import GPUtil
 from fastapi import FastAPI, HTTPException, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 
 from support_models import SupportCase, SupportEmbeddingInput, SupportConfig
 from support_trainer import SupportTrainer
-from vector_store import VectorStore
-from query_processor import QueryProcessor
+from vector_store import SearchFilter, VectorStore, content_hash
+from ann_index import ExactIndex, IVFIndex
+from query_processor import QueryProcessor, average_embedding
+from embedding_cache import EmbeddingCache, normalize_text
+from ollama_pool import OllamaPool
+from admission import PRIORITY_BACKGROUND, PRIORITY_EXPANSION, AdmissionController, Overloaded, priority
+from resilience import CircuitOpen
+from response_cache import SemanticResponseCache
+from single_flight import SingleFlight
+from stage_timings import StageTimings
+from train_jobs import TrainJobQueue
 from conversation_memory import ConversationStore
 from simulated_orders import OrderDatabase
 from feedback_store import FeedbackStore
@@ -38,53 +45,184 @@ logger = logging.getLogger(__name__)
 # Configuration
 # ---------------------------------------------------------------------------
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+# Comma-separated Ollama servers for generation, and optionally a separate set for embeddings
+OLLAMA_URLS = [url.strip() for url in os.getenv("OLLAMA_URLS", OLLAMA_URL).split(",") if url.strip()]
+OLLAMA_EMBED_URLS = [url.strip() for url in os.getenv("OLLAMA_EMBED_URLS", "").split(",") if url.strip()] or OLLAMA_URLS
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))  # per backend
+OLLAMA_EJECT_AFTER = int(os.getenv("OLLAMA_EJECT_AFTER", "3"))  # consecutive failures before ejection
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))  # seconds; 0 disables checks
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))  # per request, within its timeout
+OLLAMA_RETRY_BACKOFF_SECONDS = float(os.getenv("OLLAMA_RETRY_BACKOFF_SECONDS", "0.1"))  # first backoff ceiling
+OLLAMA_HEDGE_PERCENTILE = float(os.getenv("OLLAMA_HEDGE_PERCENTILE", "0.95"))  # embedding latency to hedge after
+OLLAMA_HEDGE_MIN_SAMPLES = int(os.getenv("OLLAMA_HEDGE_MIN_SAMPLES", "20"))
+OLLAMA_BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "5"))  # consecutive failures that open it
+OLLAMA_BREAKER_RESET_SECONDS = float(os.getenv("OLLAMA_BREAKER_RESET_SECONDS", "30"))
+# Admission control: concurrent Ollama calls per kind, and how many may wait and for how long
+GENERATE_MAX_CONCURRENCY = int(os.getenv("GENERATE_MAX_CONCURRENCY", "4"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "8"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
 LLM_MODEL = "mistral"
 EMBEDDING_MODEL = "nomic-embed-text"
 SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.75"))
 TOP_K = int(os.getenv("TOP_K", "5"))
 MIN_CONFIDENCE = os.getenv("MIN_CONFIDENCE", "media")
+MMR_TOP_N = int(os.getenv("MMR_TOP_N", "3"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+QUERY_FUSION = os.getenv("QUERY_FUSION", "rrf")  # "rrf" or "average"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")  # "dense" or "hybrid" (dense + BM25)
+LEXICAL_FAST_PATH_SCORE = float(os.getenv("LEXICAL_FAST_PATH_SCORE", "0.8"))  # 0 disables
+# Evidence the fast path also needs: matched query terms, their summed idf, and the lead over the runner-up
+LEXICAL_FAST_PATH_MIN_TERMS = int(os.getenv("LEXICAL_FAST_PATH_MIN_TERMS", "2"))
+LEXICAL_FAST_PATH_MIN_IDF = float(os.getenv("LEXICAL_FAST_PATH_MIN_IDF", "2.0"))
+LEXICAL_FAST_PATH_MARGIN = float(os.getenv("LEXICAL_FAST_PATH_MARGIN", "0.2"))
+# First-pass similarity at which query expansion is skipped; above 1 always expands
+QUERY_EXPANSION_SKIP_SCORE = float(os.getenv("QUERY_EXPANSION_SKIP_SCORE", "0.85"))
+QUERY_EXPANSION_CACHE_SIZE = int(os.getenv("QUERY_EXPANSION_CACHE_SIZE", "1024"))
+# Search with the expansion alternatives received by then, without waiting for the rest (0 waits for all)
+QUERY_EXPANSION_DEADLINE_SECONDS = float(os.getenv("QUERY_EXPANSION_DEADLINE_SECONDS", "1.5"))
+# Start query expansion alongside the first-pass search instead of after it
+SPECULATIVE_EXPANSION = os.getenv("SPECULATIVE_EXPANSION", "true").lower() in ("1", "true", "yes")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173").split(",")
 VECTOR_STORE_PATH = os.getenv(
     "VECTOR_STORE_PATH", os.path.join(os.path.dirname(__file__), "vector_store.json")
 )
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "exact")  # "exact" or "ivf"
+IVF_N_LISTS = int(os.getenv("IVF_N_LISTS", "0")) or None  # 0 = sqrt(N) at training time
+IVF_N_PROBE = int(os.getenv("IVF_N_PROBE", "8"))
+IVF_MIN_TRAIN_SIZE = int(os.getenv("IVF_MIN_TRAIN_SIZE", "10000"))
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "") or None  # "", "int8" or "float16"
+VECTOR_STORE_WAL_COMPACT_MB = float(os.getenv("VECTOR_STORE_WAL_COMPACT_MB", "64"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # >1: workers share one memory-mapped vector store
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(__file__), "embedding_cache.sqlite3")
+)  # empty: memory tier only
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))  # in-memory LRU entries
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))  # texts per /api/embed request
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # embedding requests in flight per call
+TRAIN_JOBS_DIR = os.getenv("TRAIN_JOBS_DIR", os.path.join(os.path.dirname(__file__), "train_jobs"))
+TRAIN_CHUNK_SIZE = int(os.getenv("TRAIN_CHUNK_SIZE", "256"))  # cases committed per training job step
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))  # cached answers; 0 disables
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))  # 0: no expiry
+# Cosine distance between query embeddings at which a cached answer is reused
+RESPONSE_CACHE_MAX_DISTANCE = float(os.getenv("RESPONSE_CACHE_MAX_DISTANCE", "0.05"))
 
 # ---------------------------------------------------------------------------
 # Services (module-level singletons)
 # ---------------------------------------------------------------------------
-config = SupportConfig(threshold=SIMILARITY_THRESHOLD, top_k=TOP_K, min_confidence=MIN_CONFIDENCE)
-vector_store = VectorStore(persist_path=VECTOR_STORE_PATH)
+config = SupportConfig(
+    threshold=SIMILARITY_THRESHOLD,
+    top_k=TOP_K,
+    min_confidence=MIN_CONFIDENCE,
+    mmr_top_n=MMR_TOP_N,
+    mmr_lambda=MMR_LAMBDA,
+)
+vector_index = (
+    IVFIndex(n_lists=IVF_N_LISTS, n_probe=IVF_N_PROBE, min_train_size=IVF_MIN_TRAIN_SIZE)
+    if VECTOR_INDEX == "ivf"
+    else ExactIndex()
+)
+vector_store = VectorStore(
+    persist_path=VECTOR_STORE_PATH,
+    index=vector_index,
+    quantization=VECTOR_QUANTIZATION,
+    wal_compact_bytes=int(VECTOR_STORE_WAL_COMPACT_MB * 1024 * 1024),
+    shared=API_WORKERS > 1,
+)
 trainer = SupportTrainer(config=config, vector_store=vector_store)
 order_db = OrderDatabase()
-query_processor = QueryProcessor()
+embedding_cache = EmbeddingCache(path=EMBEDDING_CACHE_PATH or None, max_entries=EMBEDDING_CACHE_SIZE)
+query_processor = QueryProcessor(
+    embedding_cache=embedding_cache,
+    embedding_model=EMBEDDING_MODEL,
+    embed_batch_size=EMBED_BATCH_SIZE,
+    embed_concurrency=EMBED_CONCURRENCY,
+    expansion_cache_size=QUERY_EXPANSION_CACHE_SIZE,
+)
+response_cache = SemanticResponseCache(
+    max_entries=RESPONSE_CACHE_SIZE,
+    ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+    max_distance=RESPONSE_CACHE_MAX_DISTANCE,
+)
+generate_admission = AdmissionController(
+    "generate", GENERATE_MAX_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT_SECONDS
+)
+embed_admission = AdmissionController("embed", EMBED_MAX_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT_SECONDS)
+# Identical concurrent requests share one retrieval / one Ollama generation.
+retrieval_flight = SingleFlight()
+generation_flight = SingleFlight()
+pipeline_timings = StageTimings()
 conversation_store = ConversationStore()
+# Looked up at call time, so the ingest pipeline defined below is used.
+train_jobs = TrainJobQueue(
+    TRAIN_JOBS_DIR,
+    ingest=lambda cases: ingest_cases([SupportCase(**case) for case in cases]),
+    chunk_size=TRAIN_CHUNK_SIZE,
+)
 feedback_store = FeedbackStore()
 analytics_store = AnalyticsStore()
 
-http_client: httpx.AsyncClient = None
+# Created in the lifespan; the same pool when embeddings use the generation servers.
+generate_pool: OllamaPool = None
+embed_pool: OllamaPool = None
 _startup_time: float = time.time()
 
+ORDER_ID_PATTERN = r'ORD\d{6}'
+EMAIL_PATTERN = r'[\w\.-]+@[\w\.-]+\.\w+'
+# Queries carrying an order ID or email only retrieve from these categories
+ORDER_TRACKING_CATEGORIES = frozenset({"seguimiento_pedido", "seguimiento_detallado"})
+
 SUPPORT_SYSTEM_PROMPT = (
     "You are a helpful customer support agent. Use ONLY the provided knowledge base "
     "context to answer accurately and conversationally. If the context does not contain "
     "the answer, say so clearly. Keep your response concise and friendly."
 )
 
-logger.info(json.dumps({"msg": f"LLM model: {LLM_MODEL}", "ollama_url": OLLAMA_URL}))
+logger.info(json.dumps({"msg": f"LLM model: {LLM_MODEL}", "ollama_urls": OLLAMA_URLS, "ollama_embed_urls": OLLAMA_EMBED_URLS}))
+
+def _make_ollama_pool(urls: list[str]) -> OllamaPool:
+    return OllamaPool(
+        urls,
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        eject_after=OLLAMA_EJECT_AFTER,
+        health_interval=OLLAMA_HEALTH_INTERVAL,
+        admission={
+            "/api/generate": generate_admission,
+            "/api/embed": embed_admission,
+            "/api/embeddings": embed_admission,
+        },
+        retries=OLLAMA_RETRIES,
+        retry_backoff=OLLAMA_RETRY_BACKOFF_SECONDS,
+        hedge_paths=("/api/embed", "/api/embeddings"),
+        hedge_percentile=OLLAMA_HEDGE_PERCENTILE,
+        hedge_min_samples=OLLAMA_HEDGE_MIN_SAMPLES,
+        breaker_failures=OLLAMA_BREAKER_FAILURES,
+        breaker_reset=OLLAMA_BREAKER_RESET_SECONDS,
+    )
+
+
+def _ollama_pools() -> list[OllamaPool]:
+    return [generate_pool] if embed_pool is generate_pool else [generate_pool, embed_pool]
 
 # ---------------------------------------------------------------------------
 # Lifespan
 # ---------------------------------------------------------------------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global http_client, _startup_time
+    global generate_pool, embed_pool, _startup_time
     _startup_time = time.time()
-    http_client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0))
+    generate_pool = _make_ollama_pool(OLLAMA_URLS)
+    embed_pool = generate_pool if OLLAMA_EMBED_URLS == OLLAMA_URLS else _make_ollama_pool(OLLAMA_EMBED_URLS)
+    for pool in _ollama_pools():
+        await pool.start()
     await vector_store.load()
+    await train_jobs.start()
     yield
+    await train_jobs.stop()
     await vector_store.save()
-    if http_client:
-        await http_client.aclose()
+    for pool in _ollama_pools():
+        await pool.aclose()
 
 # ---------------------------------------------------------------------------
 # App
@@ -99,6 +237,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    logger.warning(json.dumps({"msg": f"rejected {request.url.path}: {exc}"}))
+    return JSONResponse(
+        status_code=exc.status_code, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # ---------------------------------------------------------------------------
 # Request logging middleware
 # ---------------------------------------------------------------------------
@@ -163,6 +308,11 @@ class FeedbackInput(BaseModel):
 # Helpers
 # ---------------------------------------------------------------------------
 def get_system_info() -> dict:
+    # Monitoring libraries are imported on first use: they are slow to import and
+    # only /system-info needs them.
+    import psutil
+    import GPUtil
+
     cpu_percent = psutil.cpu_percent(interval=1)
     memory = psutil.virtual_memory()
     gpu_info = []
@@ -187,48 +337,61 @@ def get_system_info() -> dict:
 
 
 async def call_ollama_generate(prompt: str, system: str = None) -> str:
+    """Generate a completion; concurrent calls with the same prompt share one Ollama request."""
+    return await generation_flight.run(("generate", prompt, system), lambda: _ollama_generate(prompt, system))
+
+
+async def _ollama_generate(prompt: str, system: str = None) -> str:
     payload = {"model": LLM_MODEL, "prompt": prompt, "stream": False}
     if system:
         payload["system"] = system
-    response = await http_client.post(
-        f"{OLLAMA_URL}/api/generate", json=payload, timeout=60.0
-    )
+    with pipeline_timings.stage("generate"):
+        response = await generate_pool.post("/api/generate", json=payload, timeout=60.0)
     if response.status_code != 200:
         raise Exception(f"Ollama generate failed: {response.status_code}")
     return response.json().get("response", "").strip()
 
 
-async def call_ollama_generate_stream(prompt: str, system: str = None):
-    """Yield tokens from Ollama streaming generate."""
+def call_ollama_generate_stream(prompt: str, system: str = None):
+    """Yield tokens from Ollama streaming generate.
+
+    Concurrent streams of the same prompt are fed from one Ollama stream.
+    """
+    return generation_flight.stream(("stream", prompt, system), lambda: _ollama_generate_stream(prompt, system))
+
+
+async def _ollama_generate_stream(prompt: str, system: str = None):
     payload = {"model": LLM_MODEL, "prompt": prompt, "stream": True}
     if system:
         payload["system"] = system
-    async with http_client.stream(
-        "POST", f"{OLLAMA_URL}/api/generate", json=payload, timeout=60.0
-    ) as response:
-        if response.status_code != 200:
-            raise Exception(f"Ollama stream failed: {response.status_code}")
-        async for line in response.aiter_lines():
-            if line:
-                try:
-                    data = json.loads(line)
-                    token = data.get("response", "")
-                    if token:
-                        yield token
-                    if data.get("done", False):
-                        break
-                except json.JSONDecodeError:
-                    continue
+    with pipeline_timings.stage("generate_stream"):
+        async with generate_pool.stream("POST", "/api/generate", json=payload, timeout=60.0) as response:
+            if response.status_code != 200:
+                raise Exception(f"Ollama stream failed: {response.status_code}")
+            async for line in response.aiter_lines():
+                if line:
+                    try:
+                        data = json.loads(line)
+                        token = data.get("response", "")
+                        if token:
+                            yield token
+                        if data.get("done", False):
+                            break
+                    except json.JSONDecodeError:
+                        continue
+
+
+async def embed_texts(texts: list[str]) -> list[list[float]]:
+    """Embeddings for ``texts``, from the embedding cache where possible; fails if any text fails."""
+    embeddings = await query_processor.embed_cached(texts, embed_pool)
+    failed = sum(embedding is None for embedding in embeddings)
+    if failed:
+        raise Exception(f"Embedding failed for {failed} of {len(texts)} texts")
+    return embeddings
 
 
 async def get_embedding(text: str) -> list[float]:
-    payload = {"model": EMBEDDING_MODEL, "prompt": text}
-    response = await http_client.post(
-        f"{OLLAMA_URL}/api/embeddings", json=payload, timeout=30.0
-    )
-    if response.status_code != 200:
-        raise Exception(f"Embedding failed: {response.status_code}")
-    return response.json()["embedding"]
+    return (await embed_texts([text]))[0]
 
 
 def build_rag_context(cases: list[dict]) -> str:
@@ -244,9 +407,182 @@ def require_admin(x_admin_password: Optional[str]) -> None:
         raise HTTPException(status_code=401, detail="Invalid admin password")
 
 
+def _order_filter(query_text: str) -> Optional[SearchFilter]:
+    """Order-tracking restriction for queries that name an order ID or email, else None."""
+    if re.search(ORDER_ID_PATTERN, query_text) or re.search(EMAIL_PATTERN, query_text):
+        return SearchFilter(categories=ORDER_TRACKING_CATEGORIES)
+    return None
+
+
+def _lexical_query(query_text: str) -> str:
+    """Query text for BM25: order IDs and emails are looked up in the order DB, not the KB."""
+    return re.sub(f"{ORDER_ID_PATTERN}|{EMAIL_PATTERN}", " ", query_text)
+
+
+async def find_cases_for_query(query_embeddings: list[list[float]], query_text: str) -> list[dict]:
+    """Retrieve similar cases, restricted to order tracking when the query names an order or email.
+
+    Several embeddings (query variants) are searched in one batch and fused with
+    reciprocal rank fusion; in hybrid mode the BM25 ranking joins the fusion.
+    Falls back to the full knowledge base when the restricted search finds nothing.
+    """
+    lexical_text = _lexical_query(query_text) if RETRIEVAL_MODE == "hybrid" else None
+
+    async def find(metadata_filter: Optional[SearchFilter] = None) -> list[dict]:
+        if lexical_text is None and len(query_embeddings) == 1:
+            return await trainer.find_similar_cases_async(query_embeddings[0], metadata_filter=metadata_filter)
+        return await trainer.find_similar_cases_multi_async(
+            query_embeddings, metadata_filter=metadata_filter, query_text=lexical_text
+        )
+
+    order_filter = _order_filter(query_text)
+    if order_filter is not None:
+        similar_cases = await find(order_filter)
+        if similar_cases:
+            return similar_cases
+    return await find()
+
+
+async def find_lexical_fast_path(query_text: str) -> Optional[list[dict]]:
+    """Serve strong keyword matches from BM25 alone, skipping expansion and embeddings.
+
+    Returns None unless the best match scores at least LEXICAL_FAST_PATH_SCORE
+    and that score rests on real evidence: at least LEXICAL_FAST_PATH_MIN_TERMS
+    distinct query terms with an idf mass of LEXICAL_FAST_PATH_MIN_IDF, and a
+    lead of LEXICAL_FAST_PATH_MARGIN over the runner-up. One-word, common-word
+    and ambiguous queries are left to dense retrieval. The returned cases have
+    no cosine ``similarity`` (it is None); see find_lexical_cases_async.
+    """
+    if LEXICAL_FAST_PATH_SCORE <= 0:
+        return None
+    lexical_text = _lexical_query(query_text)
+    similar_cases = []
+    order_filter = _order_filter(query_text)
+    if order_filter is not None:
+        similar_cases = await trainer.find_lexical_cases_async(lexical_text, metadata_filter=order_filter)
+    if not similar_cases:
+        similar_cases = await trainer.find_lexical_cases_async(lexical_text)
+    if not similar_cases:
+        return None
+    best = similar_cases[0]
+    runner_up = similar_cases[1]["lexical_score"] if len(similar_cases) > 1 else 0.0
+    if (
+        best["lexical_score"] >= LEXICAL_FAST_PATH_SCORE
+        and best["lexical_terms"] >= LEXICAL_FAST_PATH_MIN_TERMS
+        and best["lexical_idf"] >= LEXICAL_FAST_PATH_MIN_IDF
+        and best["lexical_score"] - runner_up >= LEXICAL_FAST_PATH_MARGIN
+    ):
+        logger.info(json.dumps({
+            "msg": "lexical fast path", "score": best["lexical_score"],
+            "terms": best["lexical_terms"], "idf": round(best["lexical_idf"], 2),
+        }))
+        return similar_cases
+    return None
+
+
+class _StreamedExpansion:
+    """Query expansion running in the background, each alternative embedded as soon as its line arrives."""
+
+    def __init__(self, processed_query: str):
+        self._started = time.perf_counter()
+        self._embeddings: list[asyncio.Task] = []
+        self._llm_called = False
+        self._task = asyncio.create_task(self._run(processed_query))
+
+    async def _run(self, processed_query: str) -> None:
+        # Expansion yields to interactive calls and is skipped when it would wait too long
+        with priority(PRIORITY_EXPANSION):
+            self._llm_called = not query_processor.has_cached_expansion(processed_query)
+            alternatives = query_processor.expand_query_stream(processed_query, generate_pool)
+            async with aclosing(alternatives):
+                async for alternative in alternatives:
+                    self._embeddings.append(asyncio.create_task(get_embedding(alternative)))
+        pipeline_timings.record("expansion", time.perf_counter() - self._started)
+
+    async def wait(self, deadline: float) -> None:
+        """Wait for the last alternative, or until ``deadline`` seconds after the start (0: no deadline)."""
+        timeout = max(0.0, self._started + deadline - time.perf_counter()) if deadline > 0 else None
+        await asyncio.wait({self._task}, timeout=timeout)
+        # Whatever has not arrived by now is not waited for
+        self._task.cancel()
+
+    async def embeddings(self) -> list[list[float]]:
+        """Embeddings of the alternatives that arrived; ones that failed to embed are left out."""
+        results = await asyncio.gather(*self._embeddings, return_exceptions=True)
+        return [embedding for embedding in results if isinstance(embedding, list)]
+
+    def cancel(self) -> None:
+        self._task.cancel()
+        for task in self._embeddings:
+            task.cancel()
+
+    def record(self, used: bool) -> None:
+        """Count the expansion once: used by the search, or started speculatively and not needed."""
+        seconds = time.perf_counter() - self._started
+        if used:
+            query_processor.record_expansion(cache_hit=not self._llm_called, seconds=seconds)
+        elif self._llm_called:
+            query_processor.record_speculative_cancel(seconds)
+        else:
+            query_processor.record_expansion_skipped()
+
+
+async def retrieve_with_adaptive_expansion(processed_query: str, query_text: str) -> tuple[list[dict], list[float]]:
+    """Search with the query alone first; use the LLM query expansion only if that match is weak.
+
+    Returns the cases and the embedding of ``processed_query``.
+
+    The expansion is streamed and every alternative is embedded as soon as
+    its line is complete, so little is left to do when the last one arrives;
+    after QUERY_EXPANSION_DEADLINE_SECONDS the search goes ahead with the
+    alternatives received so far. With SPECULATIVE_EXPANSION, and a
+    generation slot free right now, the expansion starts concurrently with
+    the raw-query embedding and search instead of after them, and is
+    cancelled as soon as the first pass is strong (best similarity at least
+    QUERY_EXPANSION_SKIP_SCORE).
+    """
+    speculate = SPECULATIVE_EXPANSION and generate_admission.free_slots > 0
+    expansion = _StreamedExpansion(processed_query) if speculate else None
+    try:
+        with pipeline_timings.stage("embed_query"):
+            query_embedding = await get_embedding(processed_query)
+        with pipeline_timings.stage("first_search"):
+            first_pass = await find_cases_for_query([query_embedding], query_text)
+    except BaseException:
+        if expansion is not None:
+            expansion.cancel()
+        raise
+    if first_pass and first_pass[0]["similarity"] >= QUERY_EXPANSION_SKIP_SCORE:
+        if expansion is None:
+            query_processor.record_expansion_skipped()
+        else:
+            expansion.cancel()
+            expansion.record(used=False)
+        return first_pass, query_embedding
+
+    if expansion is None:
+        expansion = _StreamedExpansion(processed_query)
+    try:
+        with pipeline_timings.stage("expansion_wait"):
+            await expansion.wait(QUERY_EXPANSION_DEADLINE_SECONDS)
+        expansion.record(used=True)
+        with pipeline_timings.stage("embed_variants"):
+            variant_embeddings = await expansion.embeddings()
+    except BaseException:
+        expansion.cancel()
+        raise
+    if not variant_embeddings:
+        return first_pass, query_embedding
+    query_embeddings = [query_embedding] + variant_embeddings
+    if QUERY_FUSION == "average":
+        query_embeddings = [average_embedding(query_embeddings)]
+    with pipeline_timings.stage("fused_search"):
+        return await find_cases_for_query(query_embeddings, query_text), query_embedding
+
+
 async def _check_ollama() -> bool:
     try:
-        r = await http_client.get(f"{OLLAMA_URL}/api/tags", timeout=5.0)
+        r = await generate_pool.get("/api/tags", timeout=5.0)
         return r.status_code == 200
     except Exception:
         return False
@@ -266,6 +602,7 @@ async def health():
     return {
         "status": "ok",
         "ollama_reachable": ollama_ok,
+        "ollama_backends": {"generate": generate_pool.stats(), "embed": embed_pool.stats()},
         "vector_store_size": vector_store.size,
         "uptime_seconds": round(time.time() - _startup_time, 1),
         "version": "2.0.0",
@@ -290,6 +627,8 @@ async def generate_text(query: GenerateWithContext):
         )
         generated_text = await call_ollama_generate(full_prompt)
         return {"generated_text": generated_text, "system_info": get_system_info()}
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(json.dumps({"msg": f"generate error: {e}"}))
         raise HTTPException(status_code=500, detail=str(e))
@@ -298,60 +637,106 @@ async def generate_text(query: GenerateWithContext):
 @app.post("/embeddings")
 async def get_embeddings(input_data: EmbeddingInput):
     try:
-        results = []
-        for text in input_data.texts:
-            payload = {"model": EMBEDDING_MODEL, "prompt": text}
-            response = await http_client.post(
-                f"{OLLAMA_URL}/api/embeddings", json=payload, timeout=30.0
-            )
-            if response.status_code != 200:
-                raise Exception(f"Embedding failed: {response.status_code}: {response.text}")
-            results.append(response.json())
+        embeddings = await embed_texts(input_data.texts)
+        results = [{"embedding": embedding} for embedding in embeddings]
         return {"embeddings": results, "system_info": get_system_info()}
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(json.dumps({"msg": f"embeddings error: {e}"}))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _support_case_text(case: SupportCase) -> str:
+    """Text a support case is embedded from."""
+    return f"Q: {case.question}\nA: {case.answer}\nCategory: {case.category}"
+
+
 @app.post("/support-embeddings")
 async def get_support_embeddings(input_data: SupportEmbeddingInput):
     try:
-        results = []
-        for case in input_data.cases:
-            combined = f"Q: {case.question}\nA: {case.answer}\nCategory: {case.category}"
-            payload = {"model": EMBEDDING_MODEL, "prompt": combined}
-            response = await http_client.post(
-                f"{OLLAMA_URL}/api/embeddings", json=payload, timeout=30.0
-            )
-            if response.status_code != 200:
-                raise Exception(f"Embedding failed: {response.status_code}")
-            results.append({"case": case.dict(), "embedding": response.json()["embedding"]})
+        embeddings = await embed_texts([_support_case_text(case) for case in input_data.cases])
+        results = [
+            {"case": case.dict(), "embedding": embedding} for case, embedding in zip(input_data.cases, embeddings)
+        ]
         return {
             "message": f"Generated embeddings for {len(results)} support cases",
             "embeddings": results,
         }
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(json.dumps({"msg": f"support-embeddings error: {e}"}))
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/train-support")
+async def ingest_cases(cases: list[SupportCase]) -> dict:
+    """Bulk ingest: embed and store every case whose content is not in the store yet.
+
+    Duplicates (already stored, or repeated in the batch) are dropped before
+    embedding. The rest are embedded in batched, bounded-concurrency requests
+    (cached embeddings are reused), then inserted in one store batch and made
+    durable by one commit. Cases that fail to embed are skipped and counted.
+    """
+    start = time.perf_counter()
+    snapshot = vector_store.snapshot()
+    pending, seen = [], set()
+    for case in cases:
+        key = content_hash(trainer.prepare_case(case.dict()))
+        if key not in seen and snapshot.find_content(key) is None:
+            seen.add(key)
+            pending.append(case)
+    with priority(PRIORITY_BACKGROUND):
+        embeddings = await query_processor.embed_cached([_support_case_text(case) for case in pending], embed_pool)
+    embedded = [
+        {"case": case.dict(), "embedding": embedding}
+        for case, embedding in zip(pending, embeddings)
+        if embedding is not None
+    ]
+    if pending and not embedded:
+        raise Exception(f"Embedding failed for all {len(pending)} new cases")
+    async with vector_store.writing():
+        case_ids = await trainer.add_cases_async(embedded)
+    added = sum(case_id is not None for case_id in case_ids)
+    elapsed = time.perf_counter() - start
+    stats = {
+        "received": len(cases),
+        "added": added,
+        "duplicates": len(cases) - len(pending) + len(embedded) - added,
+        "failed": len(pending) - len(embedded),
+        "elapsed_seconds": round(elapsed, 3),
+        "cases_per_second": round(len(cases) / elapsed, 1) if elapsed > 0 else None,
+    }
+    logger.info(json.dumps({"msg": "bulk ingest", **stats}))
+    return stats
+
+
+@app.post("/train-support", status_code=202)
 async def train_support_system(input_data: SupportEmbeddingInput):
-    embeddings_response = await get_support_embeddings(input_data)
-    await trainer.add_cases_async(embeddings_response["embeddings"])
-    await vector_store.save()
-    return {"message": "Training data added successfully", "cases_count": vector_store.size}
+    """Queue the cases as a background training job; poll GET /train-jobs/{job_id}."""
+    job = await train_jobs.submit([case.dict() for case in input_data.cases])
+    return {"message": "Training job queued", "job_id": job["job_id"], "status": job["status"], "total": job["total"]}
 
 
-async def _run_rag_pipeline(query_text: str, session_id: Optional[str] = None):
-    """Core RAG pipeline shared by /support and /support-stream."""
-    session_id, memory = conversation_store.get_or_create(session_id)
-    memory.add("user", query_text)
+@app.get("/train-jobs/{job_id}")
+async def get_train_job(job_id: str):
+    job = train_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Training job {job_id} not found")
+    return job
+
+
+async def _retrieve_for_query(query_text: str) -> tuple[list[dict], Optional[list[float]]]:
+    """Session-independent half of the RAG pipeline: order lookup and case retrieval.
 
+    Returns the cases and the query embedding retrieval used, None when none was
+    computed (lexical fast path, embedding circuit open). Both may be shared by
+    coalesced requests and must not be modified.
+    """
     processed_query = await query_processor.preprocess(query_text)
 
     # Order lookup
-    order_id_match = re.search(r'ORD\d{6}', query_text)
+    order_id_match = re.search(ORDER_ID_PATTERN, query_text)
     order_info = None
     if order_id_match:
         order_id = order_id_match.group()
@@ -361,22 +746,24 @@ async def _run_rag_pipeline(query_text: str, session_id: Optional[str] = None):
                 f"{processed_query} Orden: {order_id} Estado: {order_info['status']}"
             )
 
-    # Query expansion + multi-embedding
-    expanded = await query_processor.expand_query(processed_query, OLLAMA_URL, http_client)
-    query_embedding = await query_processor.get_multi_embedding(expanded, OLLAMA_URL, http_client)
-
-    # Two-stage retrieval
-    similar_cases = await trainer.find_similar_cases_async(query_embedding)
-
-    top_confidence = similar_cases[0]["similarity"] if similar_cases else 0.0
-    rag_hit = top_confidence >= SIMILARITY_THRESHOLD
-    rag_case_ids = [c.get("case_id", "") for c in similar_cases]
+    # Strong keyword matches skip query expansion and embeddings entirely
+    query_embedding = None
+    with pipeline_timings.stage("lexical_fast_path"):
+        similar_cases = await find_lexical_fast_path(query_text)
+    if similar_cases is None:
+        # Raw-query search, overlapped with query expansion, which is used only if needed
+        try:
+            similar_cases, query_embedding = await retrieve_with_adaptive_expansion(processed_query, query_text)
+        except CircuitOpen as e:
+            # The embedding model is failing: answer without knowledge-base context
+            logger.warning(json.dumps({"msg": f"retrieval skipped: {e}"}))
+            similar_cases = []
 
     # Enrich order data if applicable
     if order_info and similar_cases:
         for case in similar_cases:
             category = case["case"]["category"]
-            if category in ("seguimiento_pedido", "seguimiento_detallado"):
+            if category in ORDER_TRACKING_CATEGORIES:
                 status_details = order_db._get_status_details(order_info)
                 case["case"]["answer"] = case["case"]["answer"].replace(
                     "[Detalles especificos seran insertados dinamicamente]",
@@ -384,6 +771,26 @@ async def _run_rag_pipeline(query_text: str, session_id: Optional[str] = None):
                     f"Fecha de orden: {status_details['order_date']}, "
                     f"Total: ${status_details['total']:.2f}",
                 )
+    return similar_cases, query_embedding
+
+
+async def _run_rag_pipeline(query_text: str, session_id: Optional[str] = None):
+    """Core RAG pipeline shared by /support and /support-stream.
+
+    Concurrent requests for the same query text share one retrieval.
+    """
+    session_id, memory = conversation_store.get_or_create(session_id)
+    memory.add("user", query_text)
+
+    with pipeline_timings.stage("retrieval"):
+        similar_cases, query_embedding = await retrieval_flight.run(
+            (normalize_text(query_text), vector_store.version), lambda: _retrieve_for_query(query_text)
+        )
+    # Keyword fast-path matches carry no cosine similarity; the fast path's own evidence gate made them hits.
+    lexical_hit = bool(similar_cases) and similar_cases[0]["similarity"] is None
+    top_confidence = None if lexical_hit else (similar_cases[0]["similarity"] if similar_cases else 0.0)
+    rag_hit = lexical_hit or top_confidence >= SIMILARITY_THRESHOLD
+    rag_case_ids = [c.get("case_id", "") for c in similar_cases]
 
     # Build LLM prompt
     conversation_context = "\n".join(
@@ -405,18 +812,52 @@ async def _run_rag_pipeline(query_text: str, session_id: Optional[str] = None):
             f"Please provide a helpful customer support response."
         )
 
-    return session_id, prompt, top_confidence, rag_hit, rag_case_ids, similar_cases, memory
+    return session_id, prompt, top_confidence, rag_hit, rag_case_ids, similar_cases, memory, query_embedding
+
+
+def _response_cache_key(
+    query_text: str, query_embedding: Optional[list[float]], rag_hit: bool, rag_case_ids: list[str], memory
+):
+    """(query embedding, case set) to cache the generated answer under, or None.
+
+    Only the first turn of a query without an order ID or email qualifies: later
+    turns depend on the conversation, order lookups on the customer's data.
+    The key reuses the embedding retrieval computed; queries retrieval answered
+    without one (lexical fast path) are not cached, since embedding them just
+    for the key would cost the call the fast path saved. The case set is empty
+    when the prompt carried no knowledge-base context.
+    """
+    if (
+        response_cache.max_entries <= 0
+        or query_embedding is None
+        or len(memory.entries) > 1
+        or _order_filter(query_text) is not None
+    ):
+        return None
+    return query_embedding, rag_case_ids if rag_hit else []
+
+
+def _replay_tokens(text: str) -> list[str]:
+    """Split a cached answer into word tokens for SSE replay; joining them gives back ``text``."""
+    return re.findall(r"\s*\S+|\s+$", text)
 
 
 @app.post("/support")
 async def support_endpoint(query: SupportQuery):
     start_time = time.time()
     try:
-        session_id, prompt, top_confidence, rag_hit, rag_case_ids, similar_cases, memory = (
+        kb_version = vector_store.version
+        session_id, prompt, top_confidence, rag_hit, rag_case_ids, similar_cases, memory, query_embedding = (
             await _run_rag_pipeline(query.text, query.session_id)
         )
 
-        response_text = await call_ollama_generate(prompt, system=SUPPORT_SYSTEM_PROMPT)
+        cache_key = _response_cache_key(query.text, query_embedding, rag_hit, rag_case_ids, memory)
+        response_text = response_cache.lookup(*cache_key, kb_version) if cache_key else None
+        cached = response_text is not None
+        if not cached:
+            response_text = await call_ollama_generate(prompt, system=SUPPORT_SYSTEM_PROMPT)
+            if cache_key:
+                response_cache.store(*cache_key, kb_version, response_text)
         memory.add("assistant", response_text, rag_cases_used=rag_case_ids)
 
         response_time_ms = int((time.time() - start_time) * 1000)
@@ -439,7 +880,10 @@ async def support_endpoint(query: SupportQuery):
             "rag_hit": rag_hit,
             "cases_used": len(similar_cases),
             "response_time_ms": response_time_ms,
+            "cached": cached,
         }
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(json.dumps({"msg": f"support error: {e}"}))
         raise HTTPException(status_code=500, detail=str(e))
@@ -447,13 +891,25 @@ async def support_endpoint(query: SupportQuery):
 
 @app.post("/support-stream")
 async def support_stream_endpoint(query: SupportQuery):
-    """SSE streaming response. First event is metadata, then tokens, then [DONE]."""
+    """SSE streaming response. First event is metadata, then tokens, then [DONE].
+
+    A cached answer is replayed as token events, so clients see the same stream.
+    """
     start_time = time.time()
 
     try:
-        session_id, prompt, top_confidence, rag_hit, rag_case_ids, similar_cases, memory = (
+        kb_version = vector_store.version
+        session_id, prompt, top_confidence, rag_hit, rag_case_ids, similar_cases, memory, query_embedding = (
             await _run_rag_pipeline(query.text, query.session_id)
         )
+        cache_key = _response_cache_key(query.text, query_embedding, rag_hit, rag_case_ids, memory)
+        cached_text = response_cache.lookup(*cache_key, kb_version) if cache_key else None
+        if cached_text is None:
+            # Refuse now rather than inside a stream that has already answered 200
+            generate_admission.check()
+            generate_pool.breaker("/api/generate", LLM_MODEL).check(claim_trial=False)
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(json.dumps({"msg": f"support-stream pipeline error: {e}"}))
         raise HTTPException(status_code=500, detail=str(e))
@@ -464,17 +920,26 @@ async def support_stream_endpoint(query: SupportQuery):
             "session_id": session_id,
             "confidence": top_confidence,
             "rag_hit": rag_hit,
+            "cached": cached_text is not None,
         })
         yield f"data: {metadata}\n\n"
 
         full_response = []
-        try:
-            async for token in call_ollama_generate_stream(prompt, system=SUPPORT_SYSTEM_PROMPT):
+        if cached_text is not None:
+            for token in _replay_tokens(cached_text):
                 full_response.append(token)
                 yield f"data: {json.dumps(token)}\n\n"
-        except Exception as e:
-            logger.error(json.dumps({"msg": f"streaming error: {e}"}))
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        else:
+            try:
+                async for token in call_ollama_generate_stream(prompt, system=SUPPORT_SYSTEM_PROMPT):
+                    full_response.append(token)
+                    yield f"data: {json.dumps(token)}\n\n"
+            except Exception as e:
+                logger.error(json.dumps({"msg": f"streaming error: {e}"}))
+                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            else:
+                if cache_key:
+                    response_cache.store(*cache_key, kb_version, "".join(full_response))
 
         yield "data: [DONE]\n\n"
 
@@ -501,7 +966,7 @@ async def find_similar_cases(query: QueryInput):
     try:
         processed_query = trainer.preprocess_text(query.text)
 
-        order_id_match = re.search(r'ORD\d{6}', query.text)
+        order_id_match = re.search(ORDER_ID_PATTERN, query.text)
         order_info = None
         if order_id_match:
             order_id = order_id_match.group()
@@ -509,12 +974,14 @@ async def find_similar_cases(query: QueryInput):
             if order_info:
                 processed_query = f"{processed_query} Orden: {order_id} Estado: {order_info['status']}"
 
-        query_embedding = await get_embedding(processed_query)
-        similar_cases = await trainer.find_similar_cases_async(query_embedding)
+        similar_cases = await find_lexical_fast_path(query.text)
+        if similar_cases is None:
+            query_embedding = await get_embedding(processed_query)
+            similar_cases = await find_cases_for_query([query_embedding], query.text)
 
         if order_info and similar_cases:
             for case in similar_cases:
-                if case["case"]["category"] in ("seguimiento_pedido", "seguimiento_detallado"):
+                if case["case"]["category"] in ORDER_TRACKING_CATEGORIES:
                     status_details = order_db._get_status_details(order_info)
                     case["case"]["answer"] = case["case"]["answer"].replace(
                         "[Detalles especificos seran insertados dinamicamente]",
@@ -523,7 +990,7 @@ async def find_similar_cases(query: QueryInput):
                         f"Total: ${status_details['total']:.2f}",
                     )
 
-        email_match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', query.text)
+        email_match = re.search(EMAIL_PATTERN, query.text)
         if email_match and similar_cases:
             customer_orders = order_db.get_customer_orders(email_match.group())
             if customer_orders:
@@ -540,6 +1007,8 @@ async def find_similar_cases(query: QueryInput):
             "order_info": order_info,
             "confidence_level": similar_cases[0]["confidence"] if similar_cases else "baja",
         }
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(json.dumps({"msg": f"get-similar-cases error: {e}"}))
         raise HTTPException(status_code=500, detail=str(e))
@@ -572,10 +1041,10 @@ async def delete_knowledge_base_case(
     case_id: str, x_admin_password: Optional[str] = Header(None)
 ):
     require_admin(x_admin_password)
-    deleted = await vector_store.delete_case(case_id)
+    async with vector_store.writing():
+        deleted = await vector_store.delete_case(case_id)
     if not deleted:
         raise HTTPException(status_code=404, detail=f"Case {case_id} not found")
-    await vector_store.save()
     return {"success": True, "deleted_case_id": case_id}
 
 
@@ -603,9 +1072,27 @@ async def get_feedback_stats():
 @app.get("/analytics")
 async def get_analytics():
     ollama_ok = await _check_ollama()
-    return analytics_store.get_stats(ollama_reachable=ollama_ok)
+    stats = analytics_store.get_stats(ollama_reachable=ollama_ok)
+    stats["query_expansion"] = query_processor.expansion_stats()
+    stats["admission"] = {"generate": generate_admission.stats(), "embed": embed_admission.stats()}
+    stats["pipeline_stages"] = pipeline_timings.stats()
+    stats["ollama_resilience"] = {"generate": generate_pool.resilience_stats(), "embed": embed_pool.resilience_stats()}
+    return stats
+
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    return {
+        "embeddings": embedding_cache.stats(),
+        "responses": response_cache.stats(),
+        "coalescing": {"retrieval": retrieval_flight.stats(), "generation": generation_flight.stats()},
+    }
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    if API_WORKERS > 1:
+        # Worker processes import the app themselves, so it is passed by name.
+        uvicorn.run("main:app", host="0.0.0.0", port=8002, workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from admission import PRIORITY_BACKGROUND, AdmissionController, current_priority
+from resilience import CircuitBreaker, LatencyWindow, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# Statuses meaning the backend itself is unavailable or overloaded, not that the
+# request was bad (Ollama answers 503 when its queue is full).
+BACKEND_FAILURE_STATUSES = frozenset({502, 503, 504})
+
+
+class OllamaBackend:
+    """One Ollama server: its own connection pool plus routing and health counters."""
+
+    def __init__(self, url: str, max_connections: int, timeout: httpx.Timeout):
+        self.url = url.rstrip("/")
+        self.client = httpx.AsyncClient(
+            base_url=self.url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.last_error: Optional[str] = None
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaPool:
+    """Client for a set of interchangeable Ollama servers.
+
+    Used like an ``httpx.AsyncClient`` with a base URL (``post``, ``get`` and
+    ``stream`` take paths such as ``/api/generate``). Each request goes to the
+    healthy backend with the fewest requests outstanding; every backend keeps
+    at most ``max_connections`` connections open, further requests queue in
+    its pool. A request that cannot connect is retried on another backend.
+
+    A backend is ejected after ``eject_after`` consecutive failures (transport
+    errors or 502/503/504) or a failed health check, and re-admitted once a
+    health check succeeds; ``start()`` probes every backend's ``/api/tags``
+    each ``health_interval`` seconds. If every backend is ejected, requests
+    are spread over all of them rather than refused.
+
+    ``admission`` maps API paths to the ``AdmissionController`` that must
+    grant a slot before a request to that path is sent (see admission.py).
+
+    Each (path, model) has a ``CircuitBreaker`` (see resilience.py) that
+    refuses requests with ``CircuitOpen`` after ``breaker_failures``
+    consecutive failed requests, for ``breaker_reset`` seconds. A request's
+    ``timeout`` is its whole budget: a failed attempt (transport error or
+    502/503/504) is retried up to ``retries`` times after a jittered
+    exponential backoff, as long as the backoff still fits in the budget.
+    Single-text requests to ``hedge_paths`` are hedged: once
+    ``hedge_min_samples`` of their latencies are known, a request not answered
+    within their ``hedge_percentile`` is sent again, and whichever copy
+    answers first is used. Batches and background-priority calls (training
+    jobs) are never hedged, and their latencies are not counted. Streams only
+    go through the breaker; they are never retried.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        max_connections: int = 8,
+        timeout: httpx.Timeout = httpx.Timeout(60.0, connect=10.0),
+        eject_after: int = 3,
+        health_interval: float = 10.0,
+        health_timeout: float = 5.0,
+        admission: Optional[dict[str, AdmissionController]] = None,
+        retries: int = 2,
+        retry_backoff: float = 0.1,
+        hedge_paths: tuple = (),
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+    ):
+        if not urls:
+            raise ValueError("OllamaPool needs at least one backend URL")
+        self.backends = [OllamaBackend(url, max(1, max_connections), timeout) for url in urls]
+        self.eject_after = max(1, eject_after)
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.admission = admission or {}
+        self.budget = timeout.read
+        self.connect_timeout = timeout.connect
+        self.retries = max(0, retries)
+        self.retry_backoff = retry_backoff
+        self.hedge_paths = frozenset(hedge_paths)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = max(1, hedge_min_samples)
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self._breakers: dict[tuple, CircuitBreaker] = {}
+        self._latencies: dict[tuple, LatencyWindow] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        self._turn = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def urls(self) -> list[str]:
+        return [backend.url for backend in self.backends]
+
+    def _pick(self, exclude: tuple = ()) -> Optional[OllamaBackend]:
+        candidates = [b for b in self.backends if b not in exclude]
+        candidates = [b for b in candidates if b.healthy] or candidates
+        if not candidates:
+            return None
+        least = min(b.outstanding for b in candidates)
+        tied = [b for b in candidates if b.outstanding == least]
+        # Ties rotate, so an idle pool is used round-robin.
+        self._turn += 1
+        return tied[self._turn % len(tied)]
+
+    def _succeeded(self, backend: OllamaBackend) -> None:
+        backend.consecutive_failures = 0
+        if not backend.healthy:
+            backend.healthy = True
+            logger.info(f"Ollama backend {backend.url} re-admitted")
+
+    def _failed(self, backend: OllamaBackend, error: str, eject: bool = False) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.last_error = error
+        if backend.healthy and (eject or backend.consecutive_failures >= self.eject_after):
+            backend.healthy = False
+            logger.warning(f"Ollama backend {backend.url} ejected: {error}")
+
+    def _record(self, backend: OllamaBackend, response: httpx.Response) -> None:
+        if response.status_code in BACKEND_FAILURE_STATUSES:
+            self._failed(backend, f"HTTP {response.status_code}")
+        else:
+            self._succeeded(backend)
+
+    def _admitted(self, path: str):
+        controller = self.admission.get(path)
+        return nullcontext() if controller is None else controller.slot()
+
+    def breaker(self, path: str, model: Optional[str] = None) -> CircuitBreaker:
+        key = (path, model)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            name = f"{path} ({model})" if model else path
+            breaker = self._breakers[key] = CircuitBreaker(name, self.breaker_failures, self.breaker_reset)
+        return breaker
+
+    def hedge_delay(self, path: str, model: Optional[str] = None) -> Optional[float]:
+        """Seconds to wait for an answer before sending a duplicate; None if ``path`` is not hedged (yet)."""
+        window = self._latencies.get((path, model))
+        if path not in self.hedge_paths or window is None or len(window) < self.hedge_min_samples:
+            return None
+        return window.percentile(self.hedge_percentile)
+
+    def _hedgeable(self, path: str, payload: dict) -> bool:
+        texts = payload.get("input")
+        single = texts is None or isinstance(texts, str) or len(texts) <= 1
+        return path in self.hedge_paths and single and current_priority() < PRIORITY_BACKGROUND
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        payload = kwargs.get("json") or {}
+        model = payload.get("model")
+        hedgeable = self._hedgeable(path, payload)
+        breaker = self.breaker(path, model)
+        breaker.check()
+        try:
+            async with self._admitted(path):
+                response = await self._request_within_budget(method, path, model, hedgeable, **kwargs)
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.record_abandoned()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    async def _request_within_budget(
+        self, method: str, path: str, model: Optional[str], hedgeable: bool, **kwargs
+    ) -> httpx.Response:
+        timeout = kwargs.pop("timeout", None)
+        deadline = time.monotonic() + (self.budget if timeout is None else timeout)
+        hedge_delay = self.hedge_delay(path, model) if hedgeable else None
+        attempt = 0
+        while True:
+            remaining = max(0.0, deadline - time.monotonic())
+            kwargs["timeout"] = httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining))
+            response, error = None, None
+            try:
+                if hedge_delay is None:
+                    response = await self._send(method, path, model, timed=hedgeable, **kwargs)
+                else:
+                    response = await self._hedged(hedge_delay, method, path, model, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            if response is not None and response.status_code not in BACKEND_FAILURE_STATUSES:
+                return response
+            attempt += 1
+            pause = backoff_delay(attempt, self.retry_backoff)
+            if attempt > self.retries or time.monotonic() + pause >= deadline:
+                if error is not None:
+                    raise error
+                return response
+            self.retried += 1
+            await asyncio.sleep(pause)
+
+    async def _hedged(self, delay: float, method: str, path: str, model: Optional[str], **kwargs) -> httpx.Response:
+        tasks = [asyncio.ensure_future(self._send(method, path, model, timed=True, **kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            # The duplicate goes to the least busy backend, which is another one if there is one.
+            self.hedged += 1
+            tasks.append(asyncio.ensure_future(self._send(method, path, model, timed=True, **kwargs)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code not in BACKEND_FAILURE_STATUSES:
+                        if task is tasks[1]:
+                            self.hedge_wins += 1
+                        return task.result()
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _send(self, method: str, path: str, model: Optional[str], timed: bool = False, **kwargs) -> httpx.Response:
+        """One attempt, on the least busy backend (or the next one if it refuses the connection).
+
+        ``timed`` attempts add their latency to the (path, model) window hedging is based on.
+        """
+        tried: tuple = ()
+        while True:
+            backend = self._pick(tried)
+            backend.outstanding += 1
+            backend.requests += 1
+            start = time.monotonic()
+            try:
+                response = await backend.client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                self._failed(backend, f"{type(e).__name__}: {e}")
+                tried += (backend,)
+                # Nothing was sent on a failed connect, so another backend can take it.
+                if isinstance(e, httpx.ConnectError) and self._pick(tried) is not None:
+                    continue
+                raise
+            finally:
+                backend.outstanding -= 1
+            self._record(backend, response)
+            if timed and response.status_code < 500:
+                self._latencies.setdefault((path, model), LatencyWindow()).add(time.monotonic() - start)
+            return response
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, path: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Streamed request on one backend; it counts as outstanding until the body is closed."""
+        breaker = self.breaker(path, (kwargs.get("json") or {}).get("model"))
+        breaker.check()
+        outcome_known = False
+        try:
+            async with self._admitted(path):
+                backend = self._pick()
+                backend.outstanding += 1
+                backend.requests += 1
+                try:
+                    async with backend.client.stream(method, path, **kwargs) as response:
+                        self._record(backend, response)
+                        if response.status_code >= 500:
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                        outcome_known = True
+                        yield response
+                except httpx.TransportError as e:
+                    self._failed(backend, f"{type(e).__name__}: {e}")
+                    breaker.record_failure()
+                    outcome_known = True
+                    raise
+                finally:
+                    backend.outstanding -= 1
+        finally:
+            if not outcome_known:
+                breaker.record_abandoned()
+
+    async def check_health(self) -> None:
+        """Probe every backend once, ejecting the ones that fail and re-admitting the ones that answer."""
+        await asyncio.gather(*(self._probe(backend) for backend in self.backends))
+
+    async def _probe(self, backend: OllamaBackend) -> None:
+        try:
+            response = await backend.client.get("/api/tags", timeout=self.health_timeout)
+        except httpx.HTTPError as e:
+            self._failed(backend, f"health check: {type(e).__name__}: {e}", eject=True)
+            return
+        if response.status_code == 200:
+            self._succeeded(backend)
+        else:
+            self._failed(backend, f"health check: HTTP {response.status_code}", eject=True)
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Ollama health check failed: {e}")
+
+    async def start(self) -> None:
+        """Start the periodic health checks."""
+        if self.health_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        await asyncio.gather(*(backend.client.aclose() for backend in self.backends))
+
+    def stats(self) -> list[dict]:
+        return [backend.stats() for backend in self.backends]
+
+    def resilience_stats(self) -> dict:
+        latencies = {}
+        for (path, model), window in self._latencies.items():
+            name = f"{path} ({model})" if model else path
+            latencies[name] = round(1000 * window.percentile(self.hedge_percentile), 1)
+        return {
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "breakers": {breaker.name: breaker.stats() for breaker in self._breakers.values()},
+            "latency_percentile": self.hedge_percentile,
+            "latency_ms": latencies,
+        }
@@ -0,0 +1,102 @@
+from typing import Optional
+
+import numpy as np
+
+# Rows converted back to float32 per block while scanning; keeps the
+# temporary small enough to stay in cache.
+SCAN_BLOCK_ROWS = 4096
+
+
+class Float16Quantizer:
+    """Half-precision codes: 2 bytes per dimension, no calibration needed."""
+
+    kind = "float16"
+    dtype = np.float16
+
+    def needs_fit(self, n: int) -> bool:
+        return False
+
+    def fit(self, matrix: np.ndarray) -> None:
+        pass
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float16)
+
+    def _query(self, query_vec: np.ndarray) -> np.ndarray:
+        return query_vec
+
+    def scores(self, codes: np.ndarray, query_vec: np.ndarray) -> np.ndarray:
+        """Approximate dot products of every code row with ``query_vec``."""
+        query = self._query(query_vec).astype(np.float32)
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], SCAN_BLOCK_ROWS):
+            block = codes[start:start + SCAN_BLOCK_ROWS]
+            out[start:start + block.shape[0]] = block.astype(np.float32) @ query
+        return out
+
+    def state(self) -> dict:
+        return {}
+
+    def restore(self, state: dict) -> None:
+        pass
+
+
+class Int8Quantizer(Float16Quantizer):
+    """Per-dimension symmetric scalar quantization: 1 byte per dimension.
+
+    ``x[d] ~= code[d] * scale[d]`` with ``scale[d] = max|x[d]| / 127`` fitted on
+    the stored rows. Before the first fit every scale is ``1 / 127``, which is
+    always in range for unit vectors; later inserts outside the fitted range
+    are clipped, and exact re-scoring absorbs the error. The owner refits (and
+    re-encodes) whenever the row count doubles, so the cost stays amortized O(1).
+    """
+
+    kind = "int8"
+    dtype = np.int8
+    min_fit_rows = 256
+
+    def __init__(self):
+        self.scale: Optional[np.ndarray] = None
+        self._fit_size = 0
+
+    def needs_fit(self, n: int) -> bool:
+        return n >= max(2 * self._fit_size, self.min_fit_rows)
+
+    def fit(self, matrix: np.ndarray) -> None:
+        if matrix.shape[0] == 0:
+            return
+        # Block by block, so a memory-mapped matrix is never copied whole.
+        max_abs = np.zeros(matrix.shape[1], dtype=np.float32)
+        for start in range(0, matrix.shape[0], SCAN_BLOCK_ROWS):
+            np.maximum(max_abs, np.abs(np.asarray(matrix[start:start + SCAN_BLOCK_ROWS])).max(axis=0), out=max_abs)
+        self.scale = (np.maximum(max_abs, 1e-6) / 127.0).astype(np.float32)
+        self._fit_size = matrix.shape[0]
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.scale is None:
+            self.scale = np.full(vectors.shape[-1], 1.0 / 127.0, dtype=np.float32)
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def _query(self, query_vec: np.ndarray) -> np.ndarray:
+        # Fold the per-dimension scale into the query: codes @ (q * scale).
+        return query_vec * self.scale
+
+    def state(self) -> dict:
+        return {"scale": None if self.scale is None else self.scale.tolist(), "fit_size": self._fit_size}
+
+    def restore(self, state: dict) -> None:
+        scale = state.get("scale")
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+        self._fit_size = state.get("fit_size", 0)
+
+
+def make_quantizer(kind: Optional[str]):
+    """Return a quantizer for ``"int8"`` / ``"float16"``, or None for full precision."""
+    if not kind:
+        return None
+    if kind == "int8":
+        return Int8Quantizer()
+    if kind == "float16":
+        return Float16Quantizer()
+    raise ValueError(f"Unknown quantization mode: {kind!r} (expected 'int8' or 'float16')")
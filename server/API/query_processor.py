@@ -1,10 +1,17 @@
+import asyncio
 import re
 import logging
 import json
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
 
 import httpx
-import numpy as np
-from sklearn.preprocessing import normalize
+
+from admission import Overloaded
+from embedding_cache import EmbeddingCache, normalize_text
+from ollama_pool import OllamaPool
+from vector_store import mean_direction
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +63,30 @@ ABBREVIATIONS = {
 class QueryProcessor:
     """Handles query preprocessing and expansion for improved RAG retrieval."""
 
+    def __init__(
+        self,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        embedding_model: str = "nomic-embed-text",
+        embed_batch_size: int = 64,
+        embed_concurrency: int = 4,
+        expansion_cache_size: int = 1024,
+    ):
+        self.embedding_cache = embedding_cache
+        self.embedding_model = embedding_model
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        # Cleared the first time Ollama turns out to predate the batch /api/embed endpoint
+        self._batch_endpoint = True
+        # Successful expansions by normalized query, least recently used first.
+        self.expansion_cache_size = expansion_cache_size
+        self._expansions: OrderedDict[str, list[str]] = OrderedDict()
+        self.expansion_llm_calls = 0
+        self.expansion_cache_hits = 0
+        self.expansion_skipped = 0
+        self.expansion_speculative_cancelled = 0
+        self._expansion_seconds = 0.0
+        self._speculative_seconds = 0.0
+
     async def preprocess(self, query: str) -> str:
         """Lowercase, strip punctuation, expand abbreviations."""
         text = query.lower().strip()
@@ -68,60 +99,230 @@ class QueryProcessor:
         text = ' '.join(text.split())
         return text
 
-    async def expand_query(self, query: str, ollama_url: str, http_client: httpx.AsyncClient) -> list[str]:
+    async def expand_query(self, query: str, ollama: OllamaPool) -> list[str]:
         """Call LLM to generate 3 alternative phrasings. Returns [original, alt1, alt2, alt3]."""
+        cache_hit = self.has_cached_expansion(query)
+        start = time.perf_counter()
+        alternatives = [alternative async for alternative in self.expand_query_stream(query, ollama)]
+        self.record_expansion(cache_hit, time.perf_counter() - start)
+        return [query] + alternatives
+
+    async def expand_query_stream(self, query: str, ollama: OllamaPool) -> AsyncIterator[str]:
+        """Yield up to 3 alternative phrasings of ``query``, each as soon as the LLM finishes its line.
+
+        The generation is streamed, so the first alternative is available
+        after one line rather than all three. Expansions the LLM completed are
+        cached per normalized query; a consumer that stops early gets nothing
+        cached, and the generation is abandoned. The consumer counts the
+        outcome (``record_expansion`` and friends) once it knows whether the
+        expansion was used.
+        """
+        key = normalize_text(query)
+        cached = self._expansions.get(key)
+        if cached is not None:
+            self._expansions.move_to_end(key)
+            for alternative in cached:
+                yield alternative
+            return
+        alternatives = []
+        async for alternative in self._stream_expansions(query, ollama):
+            alternatives.append(alternative)
+            yield alternative
+        if alternatives and self.expansion_cache_size > 0:
+            self._expansions[key] = alternatives
+            while len(self._expansions) > self.expansion_cache_size:
+                self._expansions.popitem(last=False)
+
+    def has_cached_expansion(self, query: str) -> bool:
+        return normalize_text(query) in self._expansions
+
+    def record_expansion(self, cache_hit: bool, seconds: float = 0.0) -> None:
+        """Count a query searched with its expansion, from the cache or from an LLM call of ``seconds``."""
+        if cache_hit:
+            self.expansion_cache_hits += 1
+        else:
+            self.expansion_llm_calls += 1
+            self._expansion_seconds += seconds
+
+    def record_expansion_skipped(self) -> None:
+        """Count a query answered from the first-pass search without expansion."""
+        self.expansion_skipped += 1
+
+    def record_speculative_cancel(self, seconds: float) -> None:
+        """Count a query whose speculative LLM expansion ran ``seconds`` and was then not needed."""
+        self.expansion_speculative_cancelled += 1
+        self._speculative_seconds += seconds
+
+    def expansion_stats(self) -> dict:
+        """How often expansion was avoided, and the LLM time that saved (at the average expansion latency).
+
+        Each query counts once. Speculative expansions cancelled because the
+        first pass was strong spent LLM time rather than saving it, so they are
+        neither skips nor savings.
+        """
+        decisions = (
+            self.expansion_skipped + self.expansion_cache_hits + self.expansion_llm_calls
+            + self.expansion_speculative_cancelled
+        )
+        avg_ms = 1000 * self._expansion_seconds / self.expansion_llm_calls if self.expansion_llm_calls else 0.0
+        return {
+            "queries": decisions,
+            "skipped": self.expansion_skipped,
+            "cache_hits": self.expansion_cache_hits,
+            "llm_calls": self.expansion_llm_calls,
+            "speculative_cancelled": self.expansion_speculative_cancelled,
+            "speculative_spent_ms": round(1000 * self._speculative_seconds, 1),
+            "skip_rate": round(self.expansion_skipped / decisions, 4) if decisions else 0.0,
+            "avg_expansion_ms": round(avg_ms, 1),
+            "estimated_saved_ms": round(avg_ms * (self.expansion_skipped + self.expansion_cache_hits), 1),
+            "cached_expansions": len(self._expansions),
+        }
+
+    async def _stream_expansions(self, query: str, ollama: OllamaPool) -> AsyncIterator[str]:
+        prompt = f"Generate 3 alternative phrasings of this customer support query. Return only the phrasings, one per line, no numbering: {query}"
+        payload = {
+            "model": "mistral",
+            "prompt": prompt,
+            "stream": True,
+        }
+        produced = 0
         try:
-            prompt = f"Generate 3 alternative phrasings of this customer support query. Return only the phrasings, one per line, no numbering: {query}"
-            payload = {
-                "model": "mistral",
-                "prompt": prompt,
-                "stream": False,
-            }
-            response = await http_client.post(
-                f"{ollama_url}/api/generate",
-                json=payload,
-                timeout=30.0,
-            )
-            if response.status_code != 200:
-                logger.warning(f"Query expansion LLM call failed: {response.status_code}")
-                return [query]
-
-            data = response.json()
-            text = data.get("response", "")
-            alternatives = [line.strip() for line in text.strip().split("\n") if line.strip()]
-            # Take at most 3 alternatives
-            alternatives = alternatives[:3]
-            return [query] + alternatives
+            async with ollama.stream("POST", "/api/generate", json=payload, timeout=30.0) as response:
+                if response.status_code != 200:
+                    logger.warning(f"Query expansion LLM call failed: {response.status_code}")
+                    return
+                pending = ""
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    pending += data.get("response", "")
+                    done = data.get("done", False)
+                    *complete, pending = pending.split("\n")
+                    if done:
+                        complete.append(pending)
+                    for alternative in (text.strip() for text in complete):
+                        if alternative:
+                            yield alternative
+                            produced += 1
+                            # Take at most 3 alternatives; stop the generation there
+                            if produced == 3:
+                                return
+                    if done:
+                        return
         except Exception as e:
             logger.warning(f"Query expansion failed: {e}")
-            return [query]
 
-    async def get_multi_embedding(
-        self, queries: list[str], ollama_url: str, http_client: httpx.AsyncClient
-    ) -> list[float]:
-        """Embed all queries and return the averaged embedding."""
-        embeddings = []
-        for q in queries:
+    async def fetch_embeddings(
+        self, texts: list[str], ollama: OllamaPool
+    ) -> list[Optional[list[float]]]:
+        """Embed ``texts`` with the model, bypassing the cache; ``None`` where a text failed.
+
+        Texts are sent in chunks of ``embed_batch_size`` to Ollama's batch
+        ``/api/embed`` endpoint. A chunk the batch call fails for is retried one
+        text per ``/api/embeddings`` request, at most ``embed_concurrency``
+        requests in flight, so one bad text does not fail its neighbours.
+        """
+        semaphore = asyncio.Semaphore(self.embed_concurrency)
+        size = max(1, self.embed_batch_size)
+        chunks = await asyncio.gather(*(
+            self._fetch_chunk(texts[i:i + size], ollama, semaphore)
+            for i in range(0, len(texts), size)
+        ))
+        return [embedding for chunk in chunks for embedding in chunk]
+
+    async def _fetch_chunk(
+        self, texts: list[str], ollama: OllamaPool, semaphore: asyncio.Semaphore
+    ) -> list[Optional[list[float]]]:
+        if self._batch_endpoint:
             try:
-                payload = {
-                    "model": "nomic-embed-text",
-                    "prompt": q,
-                }
-                response = await http_client.post(
-                    f"{ollama_url}/api/embeddings",
-                    json=payload,
-                    timeout=30.0,
-                )
+                async with semaphore:
+                    response = await ollama.post(
+                        "/api/embed",
+                        json={"model": self.embedding_model, "input": texts},
+                        timeout=30.0,
+                    )
                 if response.status_code == 200:
-                    data = response.json()
-                    embeddings.append(np.array(data["embedding"]))
+                    embeddings = response.json().get("embeddings") or []
+                    if len(embeddings) == len(texts):
+                        return embeddings
+                    logger.warning(f"Batch embedding returned {len(embeddings)} vectors for {len(texts)} texts")
+                elif response.status_code == 404 and "model" not in response.text:
+                    logger.info("Ollama has no /api/embed endpoint; embedding one text per request")
+                    self._batch_endpoint = False
+                else:
+                    logger.warning(f"Batch embedding failed: {response.status_code}")
+            except Overloaded:
+                raise
+            except httpx.TimeoutException as e:
+                # Per-text requests would only wait out the same timeout again
+                logger.warning(f"Batch embedding timed out: {e}")
+                return [None] * len(texts)
             except Exception as e:
-                logger.warning(f"Failed to embed query '{q[:50]}...': {e}")
-                continue
+                logger.warning(f"Batch embedding failed: {e}")
+        return list(await asyncio.gather(*(
+            self._fetch_one(text, ollama, semaphore) for text in texts
+        )))
+
+    async def _fetch_one(
+        self, text: str, ollama: OllamaPool, semaphore: asyncio.Semaphore
+    ) -> Optional[list[float]]:
+        try:
+            async with semaphore:
+                response = await ollama.post(
+                    "/api/embeddings",
+                    json={"model": self.embedding_model, "prompt": text},
+                    timeout=30.0,
+                )
+            if response.status_code == 200:
+                return response.json()["embedding"]
+            logger.warning(f"Failed to embed '{text[:50]}...': {response.status_code}")
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to embed '{text[:50]}...': {e}")
+        return None
 
+    async def embed_queries(
+        self, queries: list[str], ollama: OllamaPool
+    ) -> list[list[float]]:
+        """Embed each query; variants that fail to embed are skipped.
+
+        Variants found in the embedding cache are not sent to the model; the
+        rest are embedded together in one batch request.
+        """
+        embeddings = await self.embed_cached(queries, ollama)
+        embeddings = [embedding for embedding in embeddings if embedding is not None]
         if not embeddings:
             raise ValueError("Could not generate any embeddings for query expansion")
+        return embeddings
+
+    async def embed_cached(
+        self, texts: list[str], ollama: OllamaPool
+    ) -> list[Optional[list[float]]]:
+        """Like ``fetch_embeddings``, but served from and stored into the embedding cache."""
+        if self.embedding_cache is None:
+            return await self.fetch_embeddings(texts, ollama)
+        embeddings = self.embedding_cache.get_many(self.embedding_model, texts)
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if misses:
+            fetched = await self.fetch_embeddings([texts[i] for i in misses], ollama)
+            done = [(i, embedding) for i, embedding in zip(misses, fetched) if embedding is not None]
+            stored = self.embedding_cache.put_many(self.embedding_model, [(texts[i], e) for i, e in done])
+            for (i, _), embedding in zip(done, stored):
+                embeddings[i] = embedding
+        return embeddings
+
+    async def get_multi_embedding(
+        self, queries: list[str], ollama: OllamaPool
+    ) -> list[float]:
+        """Embed all queries and return the averaged embedding."""
+        return average_embedding(await self.embed_queries(queries, ollama))
+
 
-        avg_embedding = np.mean(embeddings, axis=0)
-        normalized = normalize(avg_embedding.reshape(1, -1))[0]
-        return normalized.tolist()
+def average_embedding(embeddings: list[list[float]]) -> list[float]:
+    """Normalized mean of several query embeddings, each normalized first."""
+    return mean_direction(embeddings).tolist()
@@ -0,0 +1,110 @@
+import math
+import random
+import time
+from collections import deque
+from typing import Optional
+
+from admission import Overloaded
+
+
+class CircuitOpen(Overloaded):
+    """A call was refused without being sent because its circuit breaker is open."""
+
+    status_code = 503
+
+
+class LatencyWindow:
+    """The last ``size`` latencies of one kind of call, for percentile estimates."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Fails calls fast once the thing they call has failed ``failure_threshold`` times in a row.
+
+    Closed: calls go through and consecutive failures are counted. Open: for
+    ``reset_seconds`` every call is refused with ``CircuitOpen``. Half-open:
+    after that, one trial call goes through; its success closes the circuit,
+    its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def check(self, claim_trial: bool = True) -> None:
+        """Raise ``CircuitOpen`` unless a call may go through now (in half-open, only the trial call).
+
+        With ``claim_trial=False`` this only asks, and a half-open circuit's trial stays unclaimed.
+        """
+        state = self.state
+        if state == "closed":
+            return
+        if state == "open":
+            remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+            self._refuse(f"{self.name} circuit is open", remaining)
+        if self._trial_in_flight:
+            self._refuse(f"{self.name} circuit is half-open, trial call in flight", 1.0)
+        if claim_trial:
+            self._trial_in_flight = True
+
+    def _refuse(self, message: str, wait: float) -> None:
+        self.rejected += 1
+        raise CircuitOpen(message, retry_after=max(1, math.ceil(wait)))
+
+    def record_success(self) -> None:
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._consecutive_failures += 1
+        trial_failed = self._trial_in_flight
+        self._trial_in_flight = False
+        if trial_failed or (self._opened_at is None and self._consecutive_failures >= self.failure_threshold):
+            self._opened_at = time.monotonic()
+            self.opened += 1
+
+    def record_abandoned(self) -> None:
+        """The call was cancelled before it succeeded or failed; a trial slot it held is freed."""
+        self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+def backoff_delay(attempt: int, base: float, cap: float = 2.0) -> float:
+    """Seconds to wait before retry number ``attempt`` (1-based): full jitter over an exponential ceiling."""
+    return random.uniform(0.0, min(cap, base * 2 ** (attempt - 1)))
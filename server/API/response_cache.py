@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from vector_store import l2_normalize
+
+
+@dataclass
+class _CachedAnswer:
+    query_vec: np.ndarray
+    case_key: tuple
+    answer: str
+    created: float
+
+
+class SemanticResponseCache:
+    """Generated answers, replayed for later queries that mean the same thing.
+
+    A cached answer is reused when the new query's embedding is within
+    ``max_distance`` cosine distance of the original one, retrieval picked the
+    same set of knowledge-base cases, and the entry is younger than
+    ``ttl_seconds`` (0: no expiry). Entries belong to one knowledge-base
+    version: seeing a newer version drops them all. At most ``max_entries``
+    answers are kept, least recently used evicted first.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600.0, max_distance: float = 0.05):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._entries: OrderedDict[int, _CachedAnswer] = OrderedDict()
+        self._by_cases: dict[tuple, set[int]] = {}
+        self._next_id = 0
+        self._version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def case_key(case_ids: list[str]) -> tuple:
+        return tuple(sorted(case_ids))
+
+    def _drop(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        ids = self._by_cases[entry.case_key]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_cases[entry.case_key]
+
+    def _current(self, kb_version: int) -> bool:
+        """Move to ``kb_version`` if it is newer; False if it is older than the cached answers."""
+        if self._version is not None and kb_version < self._version:
+            return False
+        if kb_version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._by_cases.clear()
+            self._version = kb_version
+        return True
+
+    def _expired(self, entry: _CachedAnswer, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.created > self.ttl_seconds
+
+    def lookup(self, query_embedding, case_ids: list[str], kb_version: int) -> Optional[str]:
+        """A cached answer for this query and retrieved case set, or None."""
+        if self.max_entries <= 0 or not self._current(kb_version):
+            return None
+        now = time.monotonic()
+        candidates = []
+        for entry_id in list(self._by_cases.get(self.case_key(case_ids), ())):
+            if self._expired(self._entries[entry_id], now):
+                self._drop(entry_id)
+            else:
+                candidates.append(entry_id)
+        if candidates:
+            query_vec = l2_normalize(query_embedding)
+            sims = np.stack([self._entries[i].query_vec for i in candidates]) @ query_vec
+            best = int(np.argmax(sims))
+            if sims[best] >= 1.0 - self.max_distance:
+                entry_id = candidates[best]
+                self._entries.move_to_end(entry_id)
+                self.hits += 1
+                return self._entries[entry_id].answer
+        self.misses += 1
+        return None
+
+    def store(self, query_embedding, case_ids: list[str], kb_version: int, answer: str) -> None:
+        """Cache ``answer``; ignored if the knowledge base changed since ``kb_version``."""
+        if self.max_entries <= 0 or not answer or not self._current(kb_version):
+            return
+        entry = _CachedAnswer(l2_normalize(query_embedding), self.case_key(case_ids), answer, time.monotonic())
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._by_cases.setdefault(entry.case_key, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "lookups": lookups,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "kb_version": self._version,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,82 @@
+import fcntl
+import os
+
+import numpy as np
+
+
+class StoreSharing:
+    """Cross-process coordination for one VectorStore served by several worker processes.
+
+    The base files (``<base>.npy`` etc.) are the shared copy: every worker
+    memory-maps them read-only, so the OS page cache holds one copy of the
+    embeddings however many workers run. Two small files next to them
+    coordinate the workers:
+
+    * ``<base>.lock``: ``flock`` lock. A writer holds it exclusively while it
+      catches up, mutates, and publishes; a reader holds it shared while it
+      reads the WAL tail or loads the base, so it never sees a half-written
+      version.
+    * ``<base>.gen``: two memory-mapped int64 counters. The generation is
+      bumped after every published write; the base epoch only when that write
+      also compacted the WAL into new base files. Readers compare both with
+      what they loaded: a new generation on the same base means new WAL
+      records to apply, a new base epoch means the base must be re-loaded.
+    """
+
+    def __init__(self, base_path: str):
+        self._lock_path = base_path + ".lock"
+        self._gen_path = base_path + ".gen"
+        # Separate open file descriptions: flock locks taken through one do not
+        # convert (or release) locks held through the other.
+        self._write_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._read_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._write_fd, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(self._gen_path) or os.path.getsize(self._gen_path) < 16:
+                with open(self._gen_path, "wb") as f:
+                    f.write(np.zeros(2, dtype=np.int64).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+        finally:
+            fcntl.flock(self._write_fd, fcntl.LOCK_UN)
+        self._generation = np.memmap(self._gen_path, dtype=np.int64, mode="r+", shape=(2,))
+
+    def generation(self) -> int:
+        return int(self._generation[0])
+
+    def base_epoch(self) -> int:
+        return int(self._generation[1])
+
+    def bump(self, rebased: bool = False) -> int:
+        """Advance the generation (and the base epoch if the base files were rewritten).
+
+        Call while holding the write lock.
+        """
+        if rebased:
+            self._generation[1] += 1
+        self._generation[0] += 1
+        self._generation.flush()
+        return int(self._generation[0])
+
+    def lock(self) -> None:
+        """Block until this process is the only writer (and no reader is re-mapping)."""
+        fcntl.flock(self._write_fd, fcntl.LOCK_EX)
+
+    def unlock(self) -> None:
+        fcntl.flock(self._write_fd, fcntl.LOCK_UN)
+
+    def try_lock_shared(self) -> bool:
+        """Take the lock shared without waiting; False while a writer is publishing."""
+        try:
+            fcntl.flock(self._read_fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def unlock_shared(self) -> None:
+        fcntl.flock(self._read_fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        del self._generation
+        os.close(self._write_fd)
+        os.close(self._read_fd)
@@ -0,0 +1,109 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Broadcast:
+    """Tokens of one in-flight stream, kept so late subscribers can replay them."""
+
+    def __init__(self):
+        self.tokens: list[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls: one runs, the others share its outcome.
+
+    ``run(key, fn)`` awaits ``fn()`` unless a call with the same key is already
+    in flight, in which case it waits for that call's result (or exception).
+    The call runs as its own task, so a caller that goes away does not cancel
+    it for the others. ``stream(key, source)`` does the same for token
+    streams: one ``source()`` iterator feeds every subscriber, a subscriber
+    joining late first gets the tokens produced so far, and the source is
+    closed once the last subscriber leaves. Nothing is kept after a call ends.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self._streams: dict[Hashable, _Broadcast] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every caller has gone
+
+    async def stream(self, key: Hashable, source: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.calls += 1
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.create_task(self._pump(key, broadcast, source))
+        else:
+            self.coalesced += 1
+        broadcast.subscribers += 1
+        try:
+            sent = 0
+            while True:
+                changed = broadcast.changed
+                while sent < len(broadcast.tokens):
+                    yield broadcast.tokens[sent]
+                    sent += 1
+                if broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                await changed.wait()
+        finally:
+            broadcast.subscribers -= 1
+            if not broadcast.subscribers and not broadcast.done:
+                # New requests must not join a stream that is being torn down.
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+                broadcast.task.cancel()
+
+    async def _pump(self, key: Hashable, broadcast: _Broadcast, source: Callable[[], AsyncIterator[str]]) -> None:
+        try:
+            async for token in source():
+                broadcast.tokens.append(token)
+                broadcast.notify()
+        except asyncio.CancelledError:
+            broadcast.error = ConnectionAbortedError("stream abandoned by all subscribers")
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            broadcast.notify()
+
+    def stats(self) -> dict:
+        total = self.calls + self.coalesced
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesce_rate": round(self.coalesced / total, 4) if total else 0.0,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
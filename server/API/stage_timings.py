@@ -0,0 +1,44 @@
+import time
+from contextlib import contextmanager
+
+
+class StageTimings:
+    """Running latency totals per named pipeline stage.
+
+    Stages may overlap (one can run while another waits on it), so the stage
+    averages need not add up to the end-to-end latency.
+    """
+
+    def __init__(self):
+        self._totals: dict[str, float] = {}
+        self._counts: dict[str, int] = {}
+        self._max: dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+        self._counts[stage] = self._counts.get(stage, 0) + 1
+        self._max[stage] = max(self._max.get(stage, 0.0), seconds)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Time the block as one run of ``stage`` (recorded even if it raises or is cancelled)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def reset(self) -> None:
+        self._totals.clear()
+        self._counts.clear()
+        self._max.clear()
+
+    def stats(self) -> dict:
+        return {
+            stage: {
+                "count": self._counts[stage],
+                "avg_ms": round(1000 * self._totals[stage] / self._counts[stage], 1),
+                "max_ms": round(1000 * self._max[stage], 1),
+            }
+            for stage in self._totals
+        }
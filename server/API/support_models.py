@@ -16,4 +16,6 @@ class SupportConfig(BaseModel):
     top_k: int = 5
     max_context_length: int = 10
     preprocess_text: bool = True
-    min_confidence: str = "media"
\ No newline at end of file
+    min_confidence: str = "media"
+    mmr_top_n: int = 3
+    mmr_lambda: float = 0.7
\ No newline at end of file
@@ -1,8 +1,9 @@
 import re
 import logging
+from typing import Optional
 
 from support_models import SupportConfig
-from vector_store import VectorStore
+from vector_store import SearchFilter, VectorStore, mean_direction, reciprocal_rank_fusion
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +14,8 @@ class SupportTrainer:
             config = SupportConfig()
         self.threshold = config.threshold
         self.top_k = config.top_k
+        self.mmr_top_n = config.mmr_top_n
+        self.mmr_lambda = config.mmr_lambda
         self.vector_store = vector_store or VectorStore()
         # Keep a simple count accessible
         self._case_count = 0
@@ -52,18 +55,28 @@ class SupportTrainer:
                 logger.error(f"Error adding case: {e}")
                 continue
 
-    async def add_cases_async(self, cases_with_embeddings):
-        """Async version of add_cases."""
-        for case_data in cases_with_embeddings:
-            try:
-                case_data["case"]["question"] = self.preprocess_text(case_data["case"]["question"])
-                await self.vector_store.add_case(case_data["case"], case_data["embedding"])
-                self._case_count += 1
-            except Exception as e:
-                logger.error(f"Error adding case: {e}")
-                continue
+    def prepare_case(self, case: dict) -> dict:
+        """The case as it is stored: a copy with the question preprocessed."""
+        return {**case, "question": self.preprocess_text(case["question"])}
+
+    async def add_cases_async(self, cases_with_embeddings) -> list[Optional[str]]:
+        """Async version of add_cases: one bulk insert into the vector store.
+
+        Returns the new case_id of each case; None where the store already held
+        the same content (or the batch could not be added).
+        """
+        cases = [self.prepare_case(case_data["case"]) for case_data in cases_with_embeddings]
+        try:
+            case_ids = await self.vector_store.add_cases(
+                cases, [case_data["embedding"] for case_data in cases_with_embeddings]
+            )
+        except Exception as e:
+            logger.error(f"Error adding cases: {e}")
+            return [None] * len(cases)
+        self._case_count += sum(case_id is not None for case_id in case_ids)
+        return case_ids
 
-    async def find_similar_cases_async(self, query_embedding, top_k=None):
+    async def find_similar_cases_async(self, query_embedding, top_k=None, metadata_filter: SearchFilter = None):
         """Async two-stage retrieval: top-K search + MMR reranking."""
         if top_k is None:
             top_k = self.top_k
@@ -74,35 +87,103 @@ class SupportTrainer:
 
         try:
             # Stage 1: top-K retrieval
-            candidates = await self.vector_store.search(query_embedding, top_k=top_k)
+            candidates = await self.vector_store.search(
+                query_embedding, top_k=top_k, metadata_filter=metadata_filter
+            )
 
             if not candidates:
                 return []
 
-            # Stage 2: MMR reranking to get top-3
+            # Stage 2: MMR reranking down to the configured top-N
             reranked = await self.vector_store.mmr_rerank(
-                candidates, query_embedding, top_n=3, lambda_=0.7
+                candidates, query_embedding, top_n=self.mmr_top_n, lambda_=self.mmr_lambda
             )
 
-            # Format results for backward compat
+            return self._format_results(reranked)
+        except Exception as e:
+            logger.error(f"Error finding similar cases: {e}")
+            return []
+
+    async def find_similar_cases_multi_async(
+        self, query_embeddings, top_k=None, metadata_filter: SearchFilter = None, query_text: str = None
+    ):
+        """Multi-vector retrieval: per-variant top-K in one batched search, fused with RRF, then MMR.
+
+        With ``query_text`` the BM25 ranking joins the fusion (hybrid retrieval).
+        MMR relevance is measured against the centroid of the query variants.
+        """
+        if top_k is None:
+            top_k = self.top_k
+
+        if self.vector_store.size == 0:
+            logger.warning("No embeddings available for similarity search")
+            return []
+
+        try:
+            per_variant = await self.vector_store.search_many(
+                query_embeddings, top_k=top_k, metadata_filter=metadata_filter
+            )
+            if query_text:
+                per_variant.append(await self.vector_store.lexical_search(
+                    query_text, top_k=top_k, metadata_filter=metadata_filter, query_embeddings=query_embeddings
+                ))
+            candidates = reciprocal_rank_fusion(per_variant, top_k=top_k)
+            if not candidates:
+                return []
+
+            centroid = mean_direction(query_embeddings)
+            reranked = await self.vector_store.mmr_rerank(
+                candidates, centroid, top_n=self.mmr_top_n, lambda_=self.mmr_lambda
+            )
+            return self._format_results(reranked)
+        except Exception as e:
+            logger.error(f"Error finding similar cases: {e}")
+            return []
+
+    async def find_lexical_cases_async(self, query_text, top_k=None, metadata_filter: SearchFilter = None):
+        """Keyword-only retrieval (BM25), no embedding needed.
+
+        BM25 scores are not cosine similarities, so ``similarity`` and the
+        ``confidence`` label graded from it are None; the match is described by
+        ``lexical_score``, ``lexical_terms`` and ``lexical_idf`` instead (see
+        VectorStore.lexical_search_sync).
+        """
+        if top_k is None:
+            top_k = self.top_k
+        try:
+            results = await self.vector_store.lexical_search(query_text, top_k=top_k, metadata_filter=metadata_filter)
             return [
                 {
-                    "case": {
-                        "question": r["question"],
-                        "answer": r["answer"],
-                        "category": r["category"],
-                        "priority": r.get("priority", 1),
-                    },
-                    "case_id": r["case_id"],
-                    "similarity": r["score"],
-                    "confidence": self._calculate_confidence(r["score"]),
+                    **case,
+                    "similarity": None,
+                    "confidence": None,
+                    "lexical_score": r["lexical_score"],
+                    "lexical_terms": r["lexical_terms"],
+                    "lexical_idf": r["lexical_idf"],
                 }
-                for r in reranked
+                for case, r in zip(self._format_results(results[:self.mmr_top_n]), results)
             ]
         except Exception as e:
-            logger.error(f"Error finding similar cases: {e}")
+            logger.error(f"Error finding lexical matches: {e}")
             return []
 
+    def _format_results(self, results):
+        """Shape store results the way the API has always returned them."""
+        return [
+            {
+                "case": {
+                    "question": r["question"],
+                    "answer": r["answer"],
+                    "category": r["category"],
+                    "priority": r.get("priority", 1),
+                },
+                "case_id": r["case_id"],
+                "similarity": r["score"],
+                "confidence": self._calculate_confidence(r["score"]),
+            }
+            for r in results
+        ]
+
     def find_similar_cases(self, query_embedding, top_k=None):
         """Sync wrapper for backward compat (used by /get-similar-cases endpoint)."""
         import asyncio
@@ -122,10 +203,6 @@ class SupportTrainer:
 
     def _find_similar_sync(self, query_embedding, top_k=None):
         """Direct sync computation as fallback."""
-        import numpy as np
-        from sklearn.metrics.pairwise import cosine_similarity
-        from sklearn.preprocessing import normalize
-
         if top_k is None:
             top_k = self.top_k
 
@@ -133,29 +210,7 @@ class SupportTrainer:
             return []
 
         try:
-            entries = self.vector_store._entries
-            query_vec = normalize(np.array(query_embedding).reshape(1, -1))
-            embeddings_matrix = np.array([e["embedding"] for e in entries])
-            similarities = cosine_similarity(query_vec, embeddings_matrix)[0]
-
-            top_k_actual = min(top_k, len(entries))
-            top_indices = np.argsort(similarities)[::-1][:top_k_actual]
-
-            results = []
-            for idx in top_indices:
-                entry = entries[idx]
-                results.append({
-                    "case": {
-                        "question": entry["question"],
-                        "answer": entry["answer"],
-                        "category": entry["category"],
-                        "priority": entry.get("priority", 1),
-                    },
-                    "case_id": entry["case_id"],
-                    "similarity": float(similarities[idx]),
-                    "confidence": self._calculate_confidence(float(similarities[idx])),
-                })
-            return results
+            return self._format_results(self.vector_store.search_sync(query_embedding, top_k=top_k))
         except Exception as e:
             logger.error(f"Error in sync similar cases: {e}")
             return []
@@ -29,6 +29,7 @@ def test_health_fields(client):
     body = r.json()
     assert "status" in body
     assert "ollama_reachable" in body
+    assert {"url", "healthy", "outstanding"} <= set(body["ollama_backends"]["generate"][0])
     assert "vector_store_size" in body
     assert "uptime_seconds" in body
     assert "version" in body
@@ -97,6 +98,7 @@ def test_analytics_fields(client):
     assert "avg_confidence" in body
     assert "top_categories" in body
     assert "ollama_reachable" in body
+    assert "skip_rate" in body["query_expansion"]
 
 
 # ---------------------------------------------------------------------------
@@ -142,7 +144,7 @@ def test_delete_requires_auth(client):
 @pytest.mark.usefixtures("trained_client")
 class TestWithTraining:
 
-    def test_train_support_returns_count(self, trained_client):
+    def test_train_support_job_completes(self, trained_client, train_and_wait):
         cases = {
             "cases": [{
                 "question": "How do I cancel my order?",
@@ -152,9 +154,9 @@ class TestWithTraining:
             }],
             "use_gpu": False,
         }
-        r = trained_client.post("/train-support", json=cases)
-        assert r.status_code == 200
-        assert r.json()["cases_count"] >= 1
+        job = train_and_wait(trained_client, cases)
+        assert job["status"] == "completed"
+        assert job["processed"] == 1 and job["added"] + job["duplicates"] == 1
 
     def test_knowledge_base_returns_cases_after_training(self, trained_client):
         r = trained_client.get(
@@ -223,3 +225,1164 @@ class TestWithTraining:
         embedding = r.json()["embeddings"][0]["embedding"]
         assert isinstance(embedding, list)
         assert all(isinstance(x, float) for x in embedding[:5])
+
+
+# ---------------------------------------------------------------------------
+# Startup
+# ---------------------------------------------------------------------------
+
+def test_import_does_not_load_heavy_optional_modules():
+    import subprocess
+    import sys
+
+    code = "import sys, main; print(','.join(m for m in ('sklearn', 'psutil', 'GPUtil') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == ""
+
+
+# ---------------------------------------------------------------------------
+# Embedding cache (no Ollama needed)
+# ---------------------------------------------------------------------------
+
+class _FakeEmbeddingClient:
+    """Stands in for httpx.AsyncClient against Ollama's embedding endpoints.
+
+    ``batch=False`` mimics an Ollama without /api/embed; prompts containing
+    "boom" fail. Records every embedded text and the peak number of requests
+    in flight.
+    """
+
+    def __init__(self, batch=True, delay=0.0):
+        self.batch = batch
+        self.delay = delay
+        self.prompts = []
+        self.urls = []
+        self.in_flight = 0
+        self.peak = 0
+
+    @staticmethod
+    def _vector(text):
+        return [float(len(text)), 1.0, 0.5]
+
+    async def post(self, url, json=None, timeout=None):
+        import asyncio
+        import httpx
+        self.urls.append(url.rsplit("/", 1)[-1])
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if url.endswith("/api/embed"):
+            if not self.batch:
+                return httpx.Response(404, text="404 page not found")
+            if any("boom" in text for text in json["input"]):
+                return httpx.Response(500, json={"error": "failed"})
+            self.prompts.extend(json["input"])
+            return httpx.Response(200, json={"embeddings": [self._vector(t) for t in json["input"]]})
+        if "boom" in json["prompt"]:
+            return httpx.Response(500, json={"error": "failed"})
+        self.prompts.append(json["prompt"])
+        return httpx.Response(200, json={"embedding": self._vector(json["prompt"])})
+
+
+def test_embedding_cache_lru_and_disk_tiers(tmp_path):
+    from embedding_cache import EmbeddingCache
+
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path=path, max_entries=2)
+    for i in range(3):
+        cache.put("m", f"text {i}", [float(i), 0.1])
+    assert cache.stats()["memory_entries"] == 2
+    assert cache.get("m", "  text   0 ") == pytest.approx([0.0, 0.1])  # evicted from memory, read from disk
+    assert cache.get("m", "text 0") == pytest.approx([0.0, 0.1])
+    assert cache.get("other-model", "text 0") is None
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["disk_entries"] == 3 and stats["disk_bytes"] > 0
+    assert stats["memory_bytes"] == 2 * 2 * 4
+    cache.close()
+
+    reopened = EmbeddingCache(path=path, max_entries=2)
+    assert reopened.get_many("m", ["text 1", "text 9"]) == [pytest.approx([1.0, 0.1]), None]
+    reopened.close()
+
+
+def test_embeddings_served_from_cache(monkeypatch):
+    import asyncio
+    import main
+    from embedding_cache import EmbeddingCache
+    from query_processor import QueryProcessor
+
+    fake = _FakeEmbeddingClient()
+    cache = EmbeddingCache()
+    processor = QueryProcessor(embedding_cache=cache, embedding_model=main.EMBEDDING_MODEL)
+    monkeypatch.setattr(main, "generate_pool", fake)
+    monkeypatch.setattr(main, "embed_pool", fake)
+    monkeypatch.setattr(main, "query_processor", processor)
+
+    first = asyncio.run(main.get_embedding("where is my order"))
+    assert asyncio.run(main.embed_texts(["where is my order", "refund"])) == [first, pytest.approx([6.0, 1.0, 0.5])]
+    assert fake.prompts == ["where is my order", "refund"]
+
+    asyncio.run(processor.embed_queries(["refund", "cancel my order"], fake))
+    assert fake.prompts == ["where is my order", "refund", "cancel my order"]
+    assert cache.stats()["hit_rate"] == pytest.approx(2 / 5)
+
+
+def test_query_variants_embedded_in_one_batch_request():
+    import asyncio
+    from query_processor import QueryProcessor
+
+    fake = _FakeEmbeddingClient()
+    variants = ["where is my order", "track my package", "order status", "shipping update"]
+    embeddings = asyncio.run(QueryProcessor().embed_queries(variants, fake))
+    assert fake.urls == ["embed"]
+    assert embeddings == [fake._vector(v) for v in variants]
+
+    # A batch that fails is retried per text, skipping only the text that fails.
+    fake = _FakeEmbeddingClient()
+    embeddings = asyncio.run(QueryProcessor().embed_queries(["refund", "boom", "cancel"], fake))
+    assert fake.urls == ["embed", "embeddings", "embeddings", "embeddings"]
+    assert embeddings == [fake._vector("refund"), fake._vector("cancel")]
+
+
+def test_embedding_falls_back_to_bounded_concurrent_requests():
+    import asyncio
+    from query_processor import QueryProcessor
+
+    fake = _FakeEmbeddingClient(batch=False, delay=0.01)
+    processor = QueryProcessor(embed_concurrency=2)
+    texts = [f"question {i}" for i in range(6)]
+    assert asyncio.run(processor.fetch_embeddings(texts, fake)) == [fake._vector(t) for t in texts]
+    assert fake.peak == 2
+    # The missing batch endpoint is remembered: the next call goes straight to per-text requests.
+    fake.urls.clear()
+    asyncio.run(processor.fetch_embeddings(["again"], fake))
+    assert fake.urls == ["embeddings"]
+
+
+def test_bulk_ingest_skips_known_content_and_reports_throughput(monkeypatch, tmp_path):
+    import asyncio
+    import main
+    from embedding_cache import EmbeddingCache
+    from query_processor import QueryProcessor
+    from support_models import SupportCase, SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    fake = _FakeEmbeddingClient()
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(), vector_store=store))
+    monkeypatch.setattr(main, "query_processor", QueryProcessor(embedding_cache=EmbeddingCache(), embed_batch_size=4))
+    monkeypatch.setattr(main, "generate_pool", fake)
+    monkeypatch.setattr(main, "embed_pool", fake)
+
+    cases = [SupportCase(question=f"Question {i}?", answer=f"Answer number {i}", category="general") for i in range(10)]
+    stats = asyncio.run(main.ingest_cases(cases + cases[:2]))
+    assert (stats["received"], stats["added"], stats["duplicates"], stats["failed"]) == (12, 10, 2, 0)
+    assert stats["cases_per_second"] > 0
+    assert fake.urls == ["embed"] * 3 and store.size == 10
+
+    # Same content again (the question only differs before preprocessing): nothing is embedded.
+    again = [SupportCase(question="question 3", answer="Answer number 3", category="general")]
+    boom = SupportCase(question="boom", answer="x", category="general")
+    new = SupportCase(question="Question 10?", answer="Answer number 10", category="general")
+    stats = asyncio.run(main.ingest_cases(again + [boom, new]))
+    assert (stats["added"], stats["duplicates"], stats["failed"]) == (1, 1, 1)
+    assert len(fake.prompts) == 11 and store.size == 11
+
+
+def test_cache_stats_endpoint(client):
+    r = client.get("/cache-stats")
+    assert r.status_code == 200
+    assert {"hit_rate", "memory_bytes", "disk_bytes"} <= set(r.json()["embeddings"])
+    assert {"hit_rate", "entries", "kb_version"} <= set(r.json()["responses"])
+
+
+# ---------------------------------------------------------------------------
+# Semantic response cache (no Ollama needed)
+# ---------------------------------------------------------------------------
+
+def test_response_cache_matches_by_distance_case_set_and_version(monkeypatch):
+    import response_cache
+    from response_cache import SemanticResponseCache
+
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticResponseCache(max_entries=2, ttl_seconds=60, max_distance=0.05)
+    cache.store([1.0, 0.0], ["b", "a"], 1, "answer")
+    assert cache.lookup([1.0, 0.1], ["a", "b"], 1) == "answer"  # cosine 0.995
+    assert cache.lookup([1.0, 0.5], ["a", "b"], 1) is None  # cosine 0.894
+    assert cache.lookup([1.0, 0.0], ["a"], 1) is None  # different cases retrieved
+
+    now[0] += 61
+    assert cache.lookup([1.0, 0.0], ["a", "b"], 1) is None  # expired
+    for i in range(3):
+        cache.store([1.0, float(i)], [], 1, f"answer {i}")
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup([1.0, 0.0], [], 1) is None  # least recently used, evicted
+
+    # A knowledge-base change drops everything; answers from before it are not cached.
+    assert cache.lookup([1.0, 2.0], [], 2) is None
+    cache.store([1.0, 2.0], [], 1, "stale")
+    assert cache.lookup([1.0, 2.0], [], 2) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["entries"], stats["kb_version"], stats["invalidations"]) == (1, 0, 2, 1)
+
+
+def test_support_replays_cached_answer_until_kb_changes(client, monkeypatch, tmp_path):
+    import asyncio
+    import json
+    import httpx
+    import numpy as np
+    import main
+    from embedding_cache import EmbeddingCache
+    from query_processor import QueryProcessor
+    from response_cache import SemanticResponseCache
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    refund = np.random.default_rng(0).standard_normal(8)
+
+    class FakeOllama:
+        generations = 0
+
+        async def post(self, url, json=None, timeout=None):
+            if url.endswith("/api/generate"):
+                self.generations += 1
+                return httpx.Response(200, json={"response": "Solicita el reembolso desde tu cuenta."})
+            # Paraphrases of the refund question land a hair apart.
+            embed = lambda text: refund + 0.01 * len(text) if "reembolso" in text else -refund
+            return httpx.Response(200, json={"embeddings": [embed(text).tolist() for text in json["input"]]})
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(store.add_case({"question": "como pido un reembolso", "answer": "a", "category": "reembolsos"}, refund.tolist()))
+    fake = FakeOllama()
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+    monkeypatch.setattr(main, "query_processor", QueryProcessor(embedding_cache=EmbeddingCache()))
+    monkeypatch.setattr(main, "response_cache", SemanticResponseCache())
+    monkeypatch.setattr(main, "generate_pool", fake)
+    monkeypatch.setattr(main, "embed_pool", fake)
+    monkeypatch.setattr(main, "SPECULATIVE_EXPANSION", False)
+    embedded = []
+    get_embedding = main.get_embedding
+
+    async def recording_get_embedding(text):
+        embedded.append(text)
+        return await get_embedding(text)
+
+    monkeypatch.setattr(main, "get_embedding", recording_get_embedding)
+
+    first = client.post("/support", json={"text": "¿Cómo pido un reembolso?"}).json()
+    again = client.post("/support", json={"text": "como pido un reembolso!!"}).json()
+    assert (first["cached"], again["cached"]) == (False, True)
+    assert again["response"] == first["response"] and fake.generations == 1
+    # The cache key reuses the retrieval embedding instead of embedding the query again.
+    assert len(embedded) == 2
+
+    # Lexical fast-path hits have no query embedding and are not cached.
+    _, memory = main.conversation_store.get_or_create(None)
+    memory.add("user", "garantia smartphone xyz")
+    assert main._response_cache_key("garantia smartphone xyz", None, True, ["case"], memory) is None
+
+    r = client.post("/support-stream", json={"text": "Cómo pido un reembolso"})
+    events = [line[len("data: "):] for line in r.text.splitlines() if line.startswith("data: ")]
+    assert json.loads(events[0])["cached"] is True and events[-1] == "[DONE]"
+    tokens = [json.loads(event) for event in events[1:-1]]
+    assert len(tokens) > 1 and "".join(tokens) == first["response"]
+
+    asyncio.run(store.add_case({"question": "otra", "answer": "b", "category": "general"}, (-refund).tolist()))
+    assert client.post("/support", json={"text": "como pido un reembolso"}).json()["cached"] is False
+    assert fake.generations == 2
+
+
+# ---------------------------------------------------------------------------
+# Request coalescing (no Ollama needed)
+# ---------------------------------------------------------------------------
+
+def test_single_flight_shares_one_call_per_key():
+    import asyncio
+    from single_flight import SingleFlight
+
+    flight = SingleFlight()
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        if key == "bad":
+            raise ValueError("boom")
+        return [key]
+
+    async def run():
+        results = await asyncio.gather(
+            *(flight.run(key, lambda key=key: work(key)) for key in ("a", "a", "b", "a", "bad", "bad")),
+            return_exceptions=True,
+        )
+        again = await flight.run("a", lambda: work("a"))  # the first call is over, so this runs anew
+        return results, again
+
+    results, again = asyncio.run(run())
+    assert results[:4] == [["a"], ["a"], ["b"], ["a"]] and results[0] is results[1]
+    assert all(isinstance(r, ValueError) for r in results[4:])
+    assert again == ["a"] and calls == ["a", "b", "bad", "a"]
+    assert flight.stats() == {"calls": 4, "coalesced": 3, "coalesce_rate": 0.4286, "in_flight": 0}
+
+
+def test_single_flight_fans_out_one_token_stream():
+    import asyncio
+    from single_flight import SingleFlight
+
+    flight = SingleFlight()
+    sources = []
+
+    async def tokens():
+        sources.append(1)
+        for token in ("one ", "two ", "three"):
+            await asyncio.sleep(0.02)
+            yield token
+
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return [token async for token in flight.stream("k", tokens)]
+
+    async def abandon():
+        stream = flight.stream("k", tokens)
+        first = await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0.1)
+        return first
+
+    async def run():
+        streams = await asyncio.gather(collect(0), collect(0.03))  # the second joins mid-stream
+        first = await abandon()
+        return streams, first
+
+    streams, first = asyncio.run(run())
+    assert streams == [["one ", "two ", "three"]] * 2 and first == "one "
+    assert len(sources) == 2 and flight.stats()["coalesced"] == 1 and flight.stats()["in_flight"] == 0
+
+
+def test_concurrent_identical_support_queries_share_pipeline_and_generation(monkeypatch, tmp_path):
+    import asyncio
+    from contextlib import asynccontextmanager
+    import httpx
+    import numpy as np
+    import main
+    from embedding_cache import EmbeddingCache
+    from query_processor import QueryProcessor
+    from response_cache import SemanticResponseCache
+    from single_flight import SingleFlight
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    class SlowOllama:
+        def __init__(self):
+            self.expansions = 0
+            self.generations = 0
+            self.embedded = []
+
+        @asynccontextmanager
+        async def stream(self, method, path, json=None, timeout=None):
+            self.expansions += 1
+            yield _StreamedGeneration(["alt one\n", "alt two"], line_delay=0.025)
+
+        async def post(self, path, json=None, timeout=None):
+            await asyncio.sleep(0.05)
+            if path == "/api/generate":
+                self.generations += 1
+                return httpx.Response(200, json={"response": "Te ayudamos con eso."})
+            self.embedded.extend(json["input"])
+            return httpx.Response(200, json={"embeddings": [[1.0, float(len(t)), 0.0] for t in json["input"]]})
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(store.add_case({"question": "envios", "answer": "a", "category": "envios"}, [0.0, 0.0, 1.0]))
+    fake = SlowOllama()
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+    monkeypatch.setattr(main, "query_processor", QueryProcessor(embedding_cache=EmbeddingCache()))
+    monkeypatch.setattr(main, "response_cache", SemanticResponseCache(max_entries=0))
+    monkeypatch.setattr(main, "retrieval_flight", SingleFlight())
+    monkeypatch.setattr(main, "generation_flight", SingleFlight())
+    monkeypatch.setattr(main, "generate_pool", fake)
+    monkeypatch.setattr(main, "embed_pool", fake)
+
+    async def run():
+        queries = [main.SupportQuery(text="¿Por qué se retrasó mi envío?") for _ in range(5)]
+        return await asyncio.gather(*(main.support_endpoint(query) for query in queries))
+
+    responses = asyncio.run(run())
+    assert {r["response"] for r in responses} == {"Te ayudamos con eso."}
+    assert len({r["session_id"] for r in responses}) == 5
+    assert (fake.expansions, fake.generations) == (1, 1)
+    assert len(fake.embedded) == len(set(fake.embedded))
+    assert main.retrieval_flight.stats()["coalesced"] == 4
+    assert main.generation_flight.stats()["coalesced"] == 4
+
+
+# ---------------------------------------------------------------------------
+# Background training jobs (no Ollama needed)
+# ---------------------------------------------------------------------------
+
+def _recording_ingest(calls, block_after=None):
+    """Fake ingest that records each chunk; hangs on chunks past ``block_after``."""
+    import asyncio
+
+    async def ingest(cases):
+        if block_after is not None and len(calls) >= block_after:
+            await asyncio.Event().wait()
+        calls.append([c["question"] for c in cases])
+        return {"added": len(cases), "duplicates": 0, "failed": 0}
+    return ingest
+
+
+def test_train_job_runs_in_chunks_and_resumes_after_restart(tmp_path):
+    import asyncio
+    from train_jobs import TrainJobQueue
+
+    cases = [{"question": f"q{i}", "answer": "a", "category": "c"} for i in range(10)]
+    first_calls, resumed_calls = [], []
+
+    async def interrupted():
+        jobs = TrainJobQueue(str(tmp_path), _recording_ingest(first_calls, block_after=1), chunk_size=4)
+        await jobs.start()
+        job = await jobs.submit(cases)
+        while jobs.get(job["job_id"])["processed"] < 4:
+            await asyncio.sleep(0.01)
+        await jobs.stop()  # "restart" with the second chunk in flight
+        return job["job_id"]
+
+    async def resumed(job_id):
+        jobs = TrainJobQueue(str(tmp_path), _recording_ingest(resumed_calls), chunk_size=4)
+        await jobs.start()
+        while jobs.get(job_id)["status"] == "running" or jobs.get(job_id)["status"] == "queued":
+            await asyncio.sleep(0.01)
+        await jobs.stop()
+        return jobs.get(job_id)
+
+    job_id = asyncio.run(interrupted())
+    assert first_calls == [["q0", "q1", "q2", "q3"]]
+    job = asyncio.run(resumed(job_id))
+    assert resumed_calls == [["q4", "q5", "q6", "q7"], ["q8", "q9"]]
+    assert (job["status"], job["processed"], job["added"], job["progress"]) == ("completed", 10, 10, 1.0)
+    assert job["cases_per_second"] > 0
+    assert not os.path.exists(tmp_path / f"{job_id}.cases.json")
+
+
+def test_train_support_queues_job(client, monkeypatch, train_and_wait):
+    import main
+
+    calls = []
+    monkeypatch.setattr(main, "ingest_cases", lambda cases: _recording_ingest(calls)([c.dict() for c in cases]))
+    payload = {"cases": [{"question": f"Q{i}", "answer": "A", "category": "c"} for i in range(3)], "use_gpu": False}
+    job = train_and_wait(client, payload)
+    assert job["status"] == "completed" and job["added"] == 3
+    assert calls == [["Q0", "Q1", "Q2"]]
+    assert client.get("/train-jobs/" + "0" * 32).status_code == 404
+    assert client.get("/train-jobs/not-a-job").status_code == 404
+
+
+# ---------------------------------------------------------------------------
+# Retrieval routing (no Ollama needed)
+# ---------------------------------------------------------------------------
+
+def test_order_queries_restricted_to_tracking_categories(monkeypatch, tmp_path):
+    import asyncio
+    import numpy as np
+    import main
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    rng = np.random.default_rng(0)
+    refund, tracking = rng.standard_normal(8), rng.standard_normal(8)
+    asyncio.run(store.add_case({"question": "refund", "answer": "a", "category": "reembolsos"}, refund.tolist()))
+    asyncio.run(store.add_case({"question": "where", "answer": "b", "category": "seguimiento_pedido"}, tracking.tolist()))
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+
+    plain = asyncio.run(main.find_cases_for_query([refund.tolist()], "I want my money back"))
+    assert plain[0]["case"]["category"] == "reembolsos"
+
+    for text in ("Status of ORD123456?", "orders for ana@example.com"):
+        restricted = asyncio.run(main.find_cases_for_query([refund.tolist()], text))
+        assert [c["case"]["category"] for c in restricted] == ["seguimiento_pedido"]
+
+
+class _StreamedGeneration:
+    """What ``OllamaPool.stream`` yields for a streamed /api/generate: one NDJSON line per chunk.
+
+    ``line_delay`` seconds pass before each chunk; ``sent`` counts the chunks read.
+    """
+
+    status_code = 200
+
+    def __init__(self, chunks, line_delay=0.0):
+        self.chunks = chunks
+        self.line_delay = line_delay
+        self.sent = 0
+
+    async def aiter_lines(self):
+        import asyncio
+        import json
+        for chunk in self.chunks:
+            await asyncio.sleep(self.line_delay)
+            self.sent += 1
+            yield json.dumps({"response": chunk, "done": False})
+        yield json.dumps({"response": "", "done": True})
+
+
+def test_expansion_stream_parses_lines_across_chunks():
+    import asyncio
+    from contextlib import asynccontextmanager
+    from query_processor import QueryProcessor
+
+    generation = _StreamedGeneration(["alt ", "one\n\nalt", " two\n", "alt three\nalt four", "\nalt five"])
+
+    class FakeOllama:
+        @asynccontextmanager
+        async def stream(self, method, path, json=None, timeout=None):
+            assert json["stream"] is True
+            yield generation
+
+    processor = QueryProcessor()
+
+    async def collect():
+        return [alternative async for alternative in processor.expand_query_stream("refund", FakeOllama())]
+
+    assert asyncio.run(collect()) == ["alt one", "alt two", "alt three"]
+    assert generation.sent == 4  # the generation is abandoned after the third line
+    assert asyncio.run(processor.expand_query("refund", None)) == ["refund", "alt one", "alt two", "alt three"]
+
+
+def test_query_expansion_only_runs_for_weak_first_pass(monkeypatch, tmp_path):
+    import asyncio
+    from contextlib import asynccontextmanager
+    import zlib
+    import httpx
+    import numpy as np
+    import main
+    from embedding_cache import EmbeddingCache
+    from query_processor import QueryProcessor
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    rng = np.random.default_rng(0)
+    refund = rng.standard_normal(8)
+    vectors = {"i want my money back": refund}
+
+    class FakeOllama:
+        generations = 0
+
+        @asynccontextmanager
+        async def stream(self, method, path, json=None, timeout=None):
+            self.generations += 1
+            yield _StreamedGeneration(["alt one\n", "alt two"])
+
+        async def post(self, url, json=None, timeout=None):
+            embed = lambda text: vectors.get(text, np.random.default_rng(zlib.crc32(text.encode())).standard_normal(8))
+            return httpx.Response(200, json={"embeddings": [embed(text).tolist() for text in json["input"]]})
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(store.add_case({"question": "refund", "answer": "a", "category": "reembolsos"}, refund.tolist()))
+    fake = FakeOllama()
+    processor = QueryProcessor(embedding_cache=EmbeddingCache())
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+    monkeypatch.setattr(main, "query_processor", processor)
+    monkeypatch.setattr(main, "generate_pool", fake)
+    monkeypatch.setattr(main, "embed_pool", fake)
+    monkeypatch.setattr(main, "SPECULATIVE_EXPANSION", False)
+
+    strong, _ = asyncio.run(main.retrieve_with_adaptive_expansion("i want my money back", "I want my money back"))
+    assert strong[0]["similarity"] == pytest.approx(1.0, abs=1e-5) and fake.generations == 0
+
+    for _ in range(2):
+        asyncio.run(main.retrieve_with_adaptive_expansion("something vague", "Something vague"))
+    assert fake.generations == 1  # the second weak query reuses the cached expansion
+    stats = processor.expansion_stats()
+    assert (stats["skipped"], stats["cache_hits"], stats["llm_calls"]) == (1, 1, 1)
+    assert stats["skip_rate"] == pytest.approx(1 / 3, abs=1e-3)
+
+
+def _delayed_ollama(line_delay, embed_delay):
+    """Fake pool whose expansion streams "alt one".."alt three" ``line_delay`` apart; embeddings take ``embed_delay``.
+
+    "envio retrasado" embeds onto the stored case, anything else far from it.
+    """
+    import asyncio
+    import httpx
+    from contextlib import asynccontextmanager
+
+    class DelayedOllama:
+        def __init__(self):
+            self.expansions_finished = 0
+            self.embed_inputs = []
+
+        @asynccontextmanager
+        async def stream(self, method, path, json=None, timeout=None):
+            generation = _StreamedGeneration(["alt one\n", "alt two\n", "alt three"], line_delay=line_delay)
+            yield generation
+            self.expansions_finished += generation.sent == 3
+
+        async def post(self, path, json=None, timeout=None):
+            self.embed_inputs.append(json["input"])
+            await asyncio.sleep(embed_delay)
+            embed = lambda text: [1.0, 0.0, 0.0] if text == "envio retrasado" else [0.0, 1.0, float(len(text))]
+            return httpx.Response(200, json={"embeddings": [embed(text) for text in json["input"]]})
+
+    return DelayedOllama()
+
+
+def _patch_retrieval(monkeypatch, tmp_path, fake):
+    import asyncio
+    import main
+    from embedding_cache import EmbeddingCache
+    from query_processor import QueryProcessor
+    from stage_timings import StageTimings
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(store.add_case({"question": "envios", "answer": "a", "category": "envios"}, [1.0, 0.0, 0.0]))
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+    monkeypatch.setattr(main, "query_processor", QueryProcessor(embedding_cache=EmbeddingCache()))
+    monkeypatch.setattr(main, "pipeline_timings", StageTimings())
+    monkeypatch.setattr(main, "generate_pool", fake)
+    monkeypatch.setattr(main, "embed_pool", fake)
+    monkeypatch.setattr(main, "SPECULATIVE_EXPANSION", True)
+
+
+def _timed_retrieval(query, settle=0.0):
+    """Seconds ``retrieve_with_adaptive_expansion`` took; the loop then runs ``settle`` seconds longer."""
+    import asyncio
+    import time
+    import main
+
+    async def timed():
+        start = time.perf_counter()
+        await main.retrieve_with_adaptive_expansion(query, query)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(settle)
+        return elapsed
+    return asyncio.run(timed())
+
+
+def test_speculative_expansion_overlaps_first_pass(monkeypatch, tmp_path):
+    import main
+
+    fake = _delayed_ollama(line_delay=0.1, embed_delay=0.2)
+    _patch_retrieval(monkeypatch, tmp_path, fake)
+    monkeypatch.setattr(main, "QUERY_EXPANSION_DEADLINE_SECONDS", 0)
+
+    # Strong first pass: answered after the query embedding; the expansion is cancelled.
+    assert _timed_retrieval("envio retrasado", settle=0.4) < 0.3
+    assert fake.expansions_finished == 0
+    # Weak first pass: the expansion (lines at 0.1/0.2/0.3s) ran under the query embedding
+    # (0.2s), and each line was embedded on arrival: done at 0.3 + 0.2s, not 0.2 + 0.3 + 0.2s.
+    assert 0.5 <= _timed_retrieval("algo vago") < 0.65
+    assert fake.expansions_finished == 1
+    assert ["alt one"] in fake.embed_inputs and ["alt three"] in fake.embed_inputs
+
+    stages = main.pipeline_timings.stats()
+    assert stages["embed_query"]["count"] == 2 and stages["expansion"]["count"] == 1
+    # Each query is counted once; the cancelled expansion is time spent, not a skip.
+    stats = main.query_processor.expansion_stats()
+    assert (stats["queries"], stats["skipped"], stats["speculative_cancelled"], stats["llm_calls"]) == (2, 0, 1, 1)
+    assert stats["skip_rate"] == 0.0 and stats["estimated_saved_ms"] == 0.0
+    assert stages["expansion_wait"]["avg_ms"] < 150
+
+
+def test_expansion_deadline_searches_with_alternatives_received(monkeypatch, tmp_path):
+    import main
+
+    fake = _delayed_ollama(line_delay=0.15, embed_delay=0.05)
+    _patch_retrieval(monkeypatch, tmp_path, fake)
+    monkeypatch.setattr(main, "QUERY_EXPANSION_DEADLINE_SECONDS", 0.35)
+
+    # Lines arrive at 0.15/0.30/0.45s: the search goes ahead at the deadline with two.
+    assert 0.35 <= _timed_retrieval("algo vago", settle=0.3) < 0.45
+    assert ["alt two"] in fake.embed_inputs and ["alt three"] not in fake.embed_inputs
+    assert fake.expansions_finished == 0
+    assert main.query_processor.expansion_stats()["cached_expansions"] == 0  # a partial expansion is not cached
+
+
+def test_lexical_fast_path_skips_embeddings(monkeypatch, tmp_path):
+    import asyncio
+    import numpy as np
+    import main
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    rng = np.random.default_rng(0)
+    cases = [
+        ("garantia del smartphone xyz", "El Smartphone XYZ tiene 12 meses de garantia.", "productos"),
+        ("como pido un reembolso", "Solicita el reembolso desde tu cuenta.", "reembolsos"),
+        ("donde esta mi pedido", "Revisa el estado en seguimiento.", "seguimiento_pedido"),
+    ]
+    for question, answer, category in cases:
+        case = {"question": question, "answer": answer, "category": category}
+        asyncio.run(store.add_case(case, rng.standard_normal(8).tolist()))
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+
+    hit = asyncio.run(main.find_lexical_fast_path("¿Garantía del Smartphone XYZ?"))
+    assert hit[0]["case"]["category"] == "productos"
+    assert hit[0]["lexical_score"] >= main.LEXICAL_FAST_PATH_SCORE and hit[0]["lexical_terms"] == 3
+    # BM25 is not reported as a cosine similarity, nor graded on the cosine thresholds.
+    assert hit[0]["similarity"] is None and hit[0]["confidence"] is None
+
+    # The order ID is a DB lookup, not a keyword; the rest restricts to tracking cases.
+    hit = asyncio.run(main.find_lexical_fast_path("donde esta mi pedido ORD123456"))
+    assert [c["case"]["category"] for c in hit] == ["seguimiento_pedido"]
+
+    # Weak or partial matches fall through to embedding retrieval.
+    assert asyncio.run(main.find_lexical_fast_path("quiero cambiar la direccion de envio")) is None
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_SCORE", 0.0)
+    assert asyncio.run(main.find_lexical_fast_path("Smartphone XYZ")) is None
+
+
+def test_one_word_and_ambiguous_queries_fall_through_to_dense_retrieval(monkeypatch, tmp_path):
+    import asyncio
+    import httpx
+    import numpy as np
+    import main
+    from embedding_cache import EmbeddingCache
+    from query_processor import QueryProcessor
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    rng = np.random.default_rng(0)
+    cases = [
+        ("olvide mi contrasena", "Restablece la contrasena desde tu cuenta.", "cuenta"),
+        ("como pido un reembolso", "Solicita el reembolso de tus pedidos desde tu cuenta.", "reembolsos"),
+        ("reembolso de un pedido cancelado", "El reembolso de pedidos cancelados es automatico.", "reembolsos"),
+        ("garantia del smartphone xyz", "El Smartphone XYZ tiene 12 meses de garantia.", "productos"),
+    ]
+    for question, answer, category in cases:
+        case = {"question": question, "answer": answer, "category": category}
+        asyncio.run(store.add_case(case, rng.standard_normal(3).tolist()))
+
+    class FakeOllama:
+        embedded = []
+
+        async def post(self, path, json=None, timeout=None):
+            self.embedded.extend(json["input"])
+            return httpx.Response(200, json={"embeddings": [[1.0, 0.0, 0.0] for _ in json["input"]]})
+
+    fake = FakeOllama()
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+    monkeypatch.setattr(main, "query_processor", QueryProcessor(embedding_cache=EmbeddingCache()))
+    monkeypatch.setattr(main, "embed_pool", fake)
+    monkeypatch.setattr(main, "QUERY_EXPANSION_SKIP_SCORE", -1.0)
+
+    # A single term covers the whole query (normalized score ~1) but is little evidence.
+    for query in ("cuenta", "pedidos"):
+        lexical = asyncio.run(main.trainer.find_lexical_cases_async(query))
+        assert lexical[0]["lexical_score"] > main.LEXICAL_FAST_PATH_SCORE
+        assert asyncio.run(main.find_lexical_fast_path(query)) is None
+    assert asyncio.run(main.find_lexical_fast_path("garantia smartphone xyz")) is not None
+
+    # Each guard refuses on its own: too few terms, too little idf mass, no clear winner.
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_MIN_IDF", 0.0)
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_MARGIN", 0.0)
+    assert asyncio.run(main.find_lexical_fast_path("cuenta")) is None
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_MIN_TERMS", 1)
+    assert asyncio.run(main.find_lexical_fast_path("cuenta")) is not None
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_MIN_IDF", 2.0)
+    assert asyncio.run(main.find_lexical_fast_path("cuenta")) is None
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_MIN_IDF", 0.0)
+    assert asyncio.run(main.find_lexical_fast_path("reembolso pedidos")) is not None
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_MARGIN", 0.2)
+    assert asyncio.run(main.find_lexical_fast_path("reembolso pedidos")) is None
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_MIN_IDF", 2.0)
+    monkeypatch.setattr(main, "LEXICAL_FAST_PATH_MIN_TERMS", 2)
+
+    cases, query_embedding = asyncio.run(main._retrieve_for_query("cuenta"))
+    assert fake.embedded == ["cuenta"] and isinstance(cases[0]["similarity"], float)
+    assert query_embedding is not None
+
+
+# ---------------------------------------------------------------------------
+# Ollama backend pool (local stand-in servers, no Ollama needed)
+# ---------------------------------------------------------------------------
+
+def test_pool_routes_to_least_outstanding_backend(ollama_standin):
+    import asyncio
+    import json
+    from ollama_pool import OllamaPool
+
+    a, b = ollama_standin(), ollama_standin()
+    pool = OllamaPool([a.url, b.url], health_interval=0)
+
+    async def run():
+        slow = asyncio.create_task(pool.post("/api/generate", json={"prompt": "slow", "stream": False}))
+        await asyncio.sleep(0.2)
+        for _ in range(4):
+            assert (await pool.post("/api/embed", json={"input": ["x"]})).status_code == 200
+        assert (await slow).json()["response"] == "echo: slow"
+        async with pool.stream("POST", "/api/generate", json={"prompt": "two words", "stream": True}) as r:
+            tokens = [json.loads(line).get("response", "") async for line in r.aiter_lines() if line]
+        await pool.aclose()
+        return tokens
+
+    assert "".join(asyncio.run(run())) == "two words "
+    busy, idle = (a, b) if a.paths[:1] == ["/api/generate"] else (b, a)
+    assert busy.requests_to("/api/embed") == 0 and idle.requests_to("/api/embed") == 4
+    assert [backend["outstanding"] for backend in pool.stats()] == [0, 0]
+
+
+def test_pool_limits_connections_per_backend(ollama_standin):
+    import asyncio
+    from ollama_pool import OllamaPool
+
+    server = ollama_standin()
+    server.slow_seconds = 0.2
+    pool = OllamaPool([server.url], max_connections=1, health_interval=0)
+
+    async def run():
+        payload = {"prompt": "slow", "stream": False}
+        responses = await asyncio.gather(*(pool.post("/api/generate", json=payload) for _ in range(3)))
+        await pool.aclose()
+        return responses
+
+    assert all(r.status_code == 200 for r in asyncio.run(run()))
+    assert server.peak == 1
+
+
+def test_pool_ejects_failing_backend_and_readmits_after_health_check(ollama_standin):
+    import asyncio
+    from ollama_pool import OllamaPool
+
+    bad, good = ollama_standin(), ollama_standin()
+    bad.status = 503
+    pool = OllamaPool([bad.url, good.url], eject_after=2, health_interval=0, retries=0)
+
+    async def embed(n):
+        return [(await pool.post("/api/embed", json={"input": ["x"]})).status_code for _ in range(n)]
+
+    async def run():
+        statuses = await embed(6)
+        assert statuses.count(503) == 2 and not pool.stats()[0]["healthy"]
+        await pool.check_health()
+        assert not pool.stats()[0]["healthy"]
+        bad.status = 200
+        await pool.check_health()
+        assert pool.stats()[0]["healthy"]
+        assert await embed(2) == [200, 200]
+        await pool.aclose()
+
+    asyncio.run(run())
+    assert bad.requests_to("/api/embed") == 3  # two failures, then one once re-admitted
+    assert good.requests_to("/api/embed") == 5
+
+
+def test_pool_fails_over_when_backend_refuses_connections(ollama_standin):
+    import asyncio
+    import socket
+    from ollama_pool import OllamaPool
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    server = ollama_standin()
+    pool = OllamaPool([dead_url, server.url], eject_after=2, health_interval=0)
+
+    async def run():
+        statuses = [(await pool.post("/api/embed", json={"input": ["x"]})).status_code for _ in range(4)]
+        await pool.aclose()
+        return statuses
+
+    assert asyncio.run(run()) == [200] * 4
+    dead, alive = pool.stats()
+    assert (dead["healthy"], dead["failures"]) == (False, 2)
+    assert "ConnectError" in dead["last_error"]
+    assert server.requests_to("/api/embed") == 4
+
+
+# ---------------------------------------------------------------------------
+# Admission control (no Ollama needed)
+# ---------------------------------------------------------------------------
+
+def test_admission_admits_waiters_by_priority():
+    import asyncio
+    from admission import PRIORITY_BACKGROUND, PRIORITY_EXPANSION, PRIORITY_INTERACTIVE, AdmissionController, priority
+
+    controller = AdmissionController("generate", max_concurrency=1, max_queue=8, max_wait_seconds=5)
+    order = []
+
+    async def call(name, level):
+        with priority(level):
+            async with controller.slot():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+    async def run():
+        async with controller.slot():
+            tasks = []
+            for name, level in (("train", PRIORITY_BACKGROUND), ("expand", PRIORITY_EXPANSION),
+                                ("chat", PRIORITY_INTERACTIVE), ("chat2", PRIORITY_INTERACTIVE)):
+                tasks.append(asyncio.create_task(call(name, level)))
+                await asyncio.sleep(0)
+            await asyncio.sleep(0.01)
+            assert controller.stats()["queued"] == 4
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["chat", "chat2", "expand", "train"]
+    stats = controller.stats()
+    assert (stats["admitted"], stats["rejected"], stats["peak_queued"], stats["active"]) == (5, 0, 4, 0)
+    assert stats["max_wait_ms"] > 0
+
+
+def test_admission_rejects_calls_that_would_wait_too_long():
+    import asyncio
+    from admission import PRIORITY_BACKGROUND, AdmissionController, Overloaded, priority
+
+    async def run():
+        controller = AdmissionController("generate", max_concurrency=1, max_queue=1, max_wait_seconds=0.1)
+        results = {}
+
+        async def attempt(name):
+            try:
+                async with controller.slot():
+                    results[name] = "ok"
+            except Overloaded as e:
+                results[name] = e.retry_after
+
+        async def background():
+            with priority(PRIORITY_BACKGROUND):
+                await attempt("background")
+
+        async with controller.slot():
+            waiting = asyncio.create_task(attempt("waits"))
+            await asyncio.sleep(0)
+            await attempt("queue full")  # refused at once: the one queue place is taken
+            queued_background = asyncio.create_task(background())  # background work always queues
+            await asyncio.sleep(0.3)
+            assert results == {"queue full": 1, "waits": 1}  # waited past the budget
+        await queued_background
+        assert results["background"] == "ok"
+
+        # Once calls are known to take longer than the budget, a busy slot refuses without waiting.
+        async with controller.slot():
+            await asyncio.sleep(0.3)
+        async with controller.slot():
+            start = asyncio.get_running_loop().time()
+            await attempt("estimated")
+            assert asyncio.get_running_loop().time() - start < 0.05
+        return controller.stats(), results
+
+    stats, results = asyncio.run(run())
+    assert results["estimated"] == 1 and stats["rejected"] == 3
+
+
+def test_overloaded_generation_answers_429_with_retry_after(client, monkeypatch, tmp_path, ollama_standin):
+    import asyncio
+    import main
+    from admission import AdmissionController
+    from embedding_cache import EmbeddingCache
+    from ollama_pool import OllamaPool
+    from query_processor import QueryProcessor
+    from response_cache import SemanticResponseCache
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    server = ollama_standin()
+    generate = AdmissionController("generate", max_concurrency=1, max_queue=0, max_wait_seconds=1)
+    embed = AdmissionController("embed", max_concurrency=4)
+    pool = OllamaPool([server.url], health_interval=0, admission={"/api/generate": generate, "/api/embed": embed})
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(store.add_case({"question": "envios", "answer": "a", "category": "envios"}, [20.0, 1.0, 0.5]))
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+    monkeypatch.setattr(main, "query_processor", QueryProcessor(embedding_cache=EmbeddingCache()))
+    monkeypatch.setattr(main, "response_cache", SemanticResponseCache(max_entries=0))
+    monkeypatch.setattr(main, "generate_pool", pool)
+    monkeypatch.setattr(main, "embed_pool", pool)
+    monkeypatch.setattr(main, "generate_admission", generate)
+    monkeypatch.setattr(main, "embed_admission", embed)
+
+    generate._active = 1  # every generation slot busy, no queueing allowed
+    for path in ("/support", "/support-stream"):
+        r = client.post(path, json={"text": "mi pedido no ha llegado"})
+        assert r.status_code == 429 and int(r.headers["Retry-After"]) >= 1
+    generate._active = 0
+    r = client.post("/support", json={"text": "mi pedido no ha llegado"})
+    assert r.status_code == 200 and r.json()["response"].startswith("echo:")
+    admission = client.get("/analytics").json()["admission"]
+    assert (admission["generate"]["rejected"], admission["generate"]["admitted"]) == (2, 1)
+    assert admission["embed"]["admitted"] >= 1
+
+
+# ---------------------------------------------------------------------------
+# Resilient Ollama client (local stand-in injecting latency and errors)
+# ---------------------------------------------------------------------------
+
+def test_circuit_breaker_opens_then_lets_one_trial_through():
+    import time
+    from resilience import CircuitBreaker, CircuitOpen
+
+    breaker = CircuitBreaker("embed", failure_threshold=2, reset_seconds=0.1)
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpen) as refused:
+        breaker.check()
+    assert refused.value.status_code == 503 and refused.value.retry_after == 1
+    time.sleep(0.12)
+    breaker.check(claim_trial=False)
+    breaker.check()  # the trial call
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.record_failure()  # a failed trial reopens at once
+    assert breaker.state == "open"
+    time.sleep(0.12)
+    breaker.check()
+    breaker.record_success()
+    assert breaker.stats() == {"state": "closed", "consecutive_failures": 0, "opened": 2, "rejected": 2}
+
+
+def test_pool_retries_with_jittered_backoff_within_budget(ollama_standin):
+    import asyncio
+    import time
+    from ollama_pool import OllamaPool
+
+    server = ollama_standin()
+    pool = OllamaPool([server.url], health_interval=0, eject_after=10, retries=3, retry_backoff=0.05)
+
+    async def run():
+        server.fail_next = 2
+        recovered = await pool.post("/api/embed", json={"input": ["x"]})
+        server.status = 503
+        start = time.perf_counter()
+        # Backoff ceilings of 0.2s and up no longer fit in the 0.3s budget
+        pool.retry_backoff = 0.2
+        exhausted = await pool.post("/api/embed", json={"input": ["x"]}, timeout=0.3)
+        elapsed = time.perf_counter() - start
+        await pool.aclose()
+        return recovered, exhausted, elapsed
+
+    recovered, exhausted, elapsed = asyncio.run(run())
+    assert recovered.status_code == 200 and server.requests_to("/api/embed") >= 3
+    assert exhausted.status_code == 503 and elapsed < 0.35
+    assert pool.resilience_stats()["retried"] >= 2
+
+
+def test_pool_hedges_embedding_slower_than_its_p95(ollama_standin):
+    import asyncio
+    import time
+    from ollama_pool import OllamaPool
+
+    server = ollama_standin()
+    pool = OllamaPool([server.url], health_interval=0, hedge_paths=("/api/embed",), hedge_min_samples=5)
+
+    async def run():
+        for _ in range(5):
+            await pool.post("/api/embed", json={"model": "m", "input": ["x"]})
+        assert pool.hedge_delay("/api/generate") is None and pool.hedge_delay("/api/embed", "m") < 0.2
+        server.stall_next = 1  # this one wedges for 2s; its duplicate does not
+        start = time.perf_counter()
+        response = await pool.post("/api/embed", json={"model": "m", "input": ["x"]})
+        elapsed = time.perf_counter() - start
+        await pool.aclose()
+        return response, elapsed
+
+    response, elapsed = asyncio.run(run())
+    assert response.json()["embeddings"] == [[1.0, 1.0, 0.5]] and elapsed < 1.0
+    stats = pool.resilience_stats()
+    assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+    assert server.requests_to("/api/embed") == 7
+
+
+def test_pool_never_hedges_batches_or_background_embeddings(ollama_standin):
+    import asyncio
+    from admission import PRIORITY_BACKGROUND, priority
+    from ollama_pool import OllamaPool
+
+    server = ollama_standin()
+    server.stall_seconds = 0.3
+    pool = OllamaPool([server.url], health_interval=0, hedge_paths=("/api/embed",), hedge_min_samples=5)
+
+    async def run():
+        for _ in range(5):
+            await pool.post("/api/embed", json={"model": "m", "input": ["x"]})
+        delay = pool.hedge_delay("/api/embed", "m")
+        server.stall_next = 1
+        await pool.post("/api/embed", json={"model": "m", "input": ["x"] * 64})
+        with priority(PRIORITY_BACKGROUND):
+            server.stall_next = 1
+            await pool.post("/api/embed", json={"model": "m", "input": ["x"]})
+        await pool.aclose()
+        return delay
+
+    delay = asyncio.run(run())
+    assert pool.resilience_stats()["hedged"] == 0 and server.requests_to("/api/embed") == 7
+    assert pool.hedge_delay("/api/embed", "m") == delay  # the slow calls are not in the window
+
+
+def test_open_circuits_fail_fast_to_non_rag_or_cached_answers(client, monkeypatch, tmp_path, ollama_standin):
+    import asyncio
+    import time
+    import main
+    from embedding_cache import EmbeddingCache
+    from ollama_pool import OllamaPool
+    from query_processor import QueryProcessor
+    from response_cache import SemanticResponseCache
+    from single_flight import SingleFlight
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+    from vector_store import VectorStore
+
+    server = ollama_standin()
+    pool = OllamaPool([server.url], health_interval=0, breaker_failures=2, breaker_reset=0.5)
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(store.add_case({"question": "envios", "answer": "a", "category": "envios"}, [20.0, 1.0, 0.5]))
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(main, "trainer", SupportTrainer(config=SupportConfig(threshold=0.0), vector_store=store))
+    monkeypatch.setattr(main, "query_processor", QueryProcessor(embedding_cache=EmbeddingCache()))
+    # Stand-in embeddings only encode the text length: match cached answers exactly
+    monkeypatch.setattr(main, "response_cache", SemanticResponseCache(max_distance=1e-6))
+    monkeypatch.setattr(main, "generation_flight", SingleFlight())
+    monkeypatch.setattr(main, "SPECULATIVE_EXPANSION", False)
+    monkeypatch.setattr(main, "generate_pool", pool)
+    monkeypatch.setattr(main, "embed_pool", pool)
+    ask = lambda text, path="/support": client.post(path, json={"text": text})
+
+    assert not ask("mi pedido no ha llegado").json()["cached"]
+
+    # Generation keeps failing: its circuit opens, and only cached answers are still given.
+    server.broken_paths = {"/api/generate"}
+    assert [ask(f"otra pregunta {i}").status_code for i in range(2)] == [500, 500]
+    generations = server.requests_to("/api/generate")
+    start = time.perf_counter()
+    for path in ("/support", "/support-stream"):
+        r = ask("otra pregunta 3", path)
+        assert r.status_code == 503 and int(r.headers["Retry-After"]) >= 1
+    assert time.perf_counter() - start < 0.4
+    assert server.requests_to("/api/generate") == generations
+    assert ask("mi pedido no ha llegado").json()["cached"]
+
+    # Embeddings keep failing: once their circuit opens, answers come without RAG context.
+    server.broken_paths = {"/api/embed", "/api/embeddings"}
+    time.sleep(0.5)  # the generation circuit half-opens; its trial call succeeds
+    assert [ask(f"consulta {i}").status_code for i in range(2)] == [500, 500]
+    embeds = server.requests_to("/api/embed")
+    r = ask("consulta 3")
+    assert r.status_code == 200 and not r.json()["rag_hit"]
+    assert server.requests_to("/api/embed") == embeds
+    resilience = client.get("/analytics").json()["ollama_resilience"]["generate"]["breakers"]
+    assert resilience["/api/generate (mistral)"]["state"] == "closed"
+    assert resilience["/api/embed (nomic-embed-text)"]["state"] == "open"
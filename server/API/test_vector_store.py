@@ -0,0 +1,1053 @@
+"""
+Unit tests for VectorStore. These run without Ollama.
+
+Run:
+    cd server/API
+    pytest test_vector_store.py -v
+"""
+import asyncio
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import vector_store as vs
+from ann_index import IVFIndex
+from vector_store import VectorStore
+
+
+def _case(i: int, category: str = "general") -> dict:
+    return {"question": f"question {i}", "answer": f"answer {i}", "category": category, "priority": 1}
+
+
+def _unit(rng, dim: int = 16) -> np.ndarray:
+    v = rng.standard_normal(dim)
+    return v / np.linalg.norm(v)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(42)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+
+
+def _fill(store, rng, n, dim=16):
+    vectors = [_unit(rng, dim) for _ in range(n)]
+    ids = [asyncio.run(store.add_case(_case(i), v.tolist())) for i, v in enumerate(vectors)]
+    return ids, vectors
+
+
+# ---------------------------------------------------------------------------
+# Matrix storage
+# ---------------------------------------------------------------------------
+
+def test_search_returns_exact_top_k(store, rng):
+    ids, vectors = _fill(store, rng, 50)
+    query = _unit(rng)
+    expected = np.argsort(-np.array([v @ query for v in vectors]))[:5]
+    results = asyncio.run(store.search(query.tolist(), top_k=5))
+    assert [r["case_id"] for r in results] == [ids[i] for i in expected]
+    scores = [r["score"] for r in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_matrix_grows_past_initial_capacity(monkeypatch, store, rng):
+    monkeypatch.setattr(vs, "INITIAL_CAPACITY", 4)
+    ids, vectors = _fill(store, rng, 11)
+    assert store.size == 11
+    assert store._matrix.shape[0] >= 11
+    assert store._matrix.dtype == np.float32
+    top = asyncio.run(store.search(vectors[9].tolist(), top_k=1))[0]
+    assert top["case_id"] == ids[9]
+    assert top["score"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_delete_hides_row_and_keeps_rows_aligned(store, rng):
+    ids, vectors = _fill(store, rng, 5)
+    assert asyncio.run(store.delete_case(ids[1]))
+    assert not asyncio.run(store.delete_case(ids[1]))
+    assert store.size == 4
+    remaining = {c["case_id"] for c in asyncio.run(store.get_all_cases())}
+    assert remaining == set(ids) - {ids[1]}
+    # The deleted row is never returned; every survivor still matches its own vector.
+    assert ids[1] not in [r["case_id"] for r in asyncio.run(store.search(vectors[1].tolist(), top_k=5))]
+    for i in (0, 2, 3, 4):
+        top = asyncio.run(store.search(vectors[i].tolist(), top_k=1))[0]
+        assert top["case_id"] == ids[i]
+        assert top["score"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_delete_stamps_one_row_instead_of_copying_the_mask(store, rng):
+    ids, vectors = _fill(store, rng, 20)
+    asyncio.run(store.delete_case(ids[0]))
+    deleted_at, before = store._deleted_at, store.snapshot()
+    asyncio.run(store.delete_case(ids[1]))
+    assert store._deleted_at is deleted_at
+    assert before.find_row(ids[1]) is not None and before.size == 19
+    assert store.snapshot().find_row(ids[1]) is None and store.size == 18
+    assert _search_snapshot(before, vectors[1])[0] == ids[1]
+
+
+def test_dimension_mismatch_rejected(store, rng):
+    _fill(store, rng, 1, dim=16)
+    with pytest.raises(ValueError):
+        asyncio.run(store.add_case(_case(99), _unit(rng, 8).tolist()))
+
+
+def test_l2_normalize_rows_and_zero_vector():
+    rows = vs.l2_normalize([[3.0, 4.0], [0.0, 0.0]])
+    assert rows.dtype == np.float32
+    np.testing.assert_allclose(rows, [[0.6, 0.8], [0.0, 0.0]])
+    np.testing.assert_allclose(vs.l2_normalize([0.0, 2.0]), [0.0, 1.0])
+
+
+def test_mean_direction_weighs_rows_equally_whatever_their_norm():
+    # A raw mean would point almost along the long first row.
+    np.testing.assert_allclose(vs.mean_direction([[10.0, 0.0], [0.0, 1.0]]), [np.sqrt(0.5), np.sqrt(0.5)], rtol=1e-6)
+
+
+def test_save_load_round_trip(store, rng, tmp_path):
+    ids, vectors = _fill(store, rng, 7)
+    asyncio.run(store.save())
+    reloaded = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(reloaded.load())
+    assert reloaded.size == 7
+    top = asyncio.run(reloaded.search(vectors[3].tolist(), top_k=1))[0]
+    assert top["case_id"] == ids[3]
+
+
+# ---------------------------------------------------------------------------
+# Binary persistence
+# ---------------------------------------------------------------------------
+
+def test_save_writes_binary_files(store, rng, tmp_path):
+    _fill(store, rng, 3)
+    asyncio.run(store.save())
+    assert (tmp_path / "vector_store.npy").exists()
+    assert (tmp_path / "vector_store.meta.json").exists()
+    assert not (tmp_path / "vector_store.json").exists()
+    assert np.load(tmp_path / "vector_store.npy").dtype == np.float32
+
+
+def test_load_memory_maps_and_copies_on_write(store, rng, tmp_path):
+    ids, vectors = _fill(store, rng, 4)
+    asyncio.run(store.save())
+    reloaded = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(reloaded.load())
+    assert isinstance(reloaded._matrix, np.memmap)
+    assert asyncio.run(reloaded.delete_case(ids[0]))
+    asyncio.run(reloaded.add_case(_case(9), _unit(rng).tolist()))
+    assert reloaded.size == 4
+    top = asyncio.run(reloaded.search(vectors[3].tolist(), top_k=1))[0]
+    assert top["case_id"] == ids[3]
+
+
+def test_legacy_json_is_migrated_once(rng, tmp_path):
+    legacy_path = tmp_path / "vector_store.json"
+    vectors = [_unit(rng) for _ in range(3)]
+    legacy = [
+        {"case_id": f"id-{i}", "category": "general", "question": f"q{i}", "answer": f"a{i}",
+         "created_at": "2024-01-01T00:00:00", "embedding": v.tolist()}
+        for i, v in enumerate(vectors)
+    ]
+    legacy_path.write_text(json.dumps(legacy))
+
+    store = VectorStore(persist_path=str(legacy_path))
+    asyncio.run(store.load())
+    assert store.size == 3
+    assert not legacy_path.exists()
+    assert os.path.exists(str(legacy_path) + ".migrated")
+    assert (tmp_path / "vector_store.npy").exists()
+
+    again = VectorStore(persist_path=str(legacy_path))
+    asyncio.run(again.load())
+    top = asyncio.run(again.search(vectors[2].tolist(), top_k=1))[0]
+    assert top["case_id"] == "id-2"
+    assert top["priority"] == 1
+
+
+# ---------------------------------------------------------------------------
+# IVF index backend
+# ---------------------------------------------------------------------------
+
+def _clustered(rng, n, dim=16, clusters=8, noise=0.1):
+    centers = rng.standard_normal((clusters, dim))
+    data = centers[rng.integers(0, clusters, n)] + noise * rng.standard_normal((n, dim))
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def _ivf_store(tmp_path, **kwargs):
+    kwargs.setdefault("n_lists", 8)
+    kwargs.setdefault("min_train_size", 64)
+    return VectorStore(persist_path=str(tmp_path / "vector_store.json"), index=IVFIndex(**kwargs))
+
+
+def test_ivf_trains_once_threshold_reached(rng, tmp_path):
+    store = _ivf_store(tmp_path)
+    data = _clustered(rng, 100)
+    for i, v in enumerate(data[:63]):
+        asyncio.run(store.add_case(_case(i), v.tolist()))
+    assert not store.index.trained
+    asyncio.run(store.add_case(_case(63), data[63].tolist()))
+    assert store.index.trained
+    assert len(store.index._lists) == 64
+
+
+def test_ivf_full_probe_matches_exact(rng, tmp_path):
+    store = _ivf_store(tmp_path, n_probe=8)
+    data = _clustered(rng, 200)
+    ids = [asyncio.run(store.add_case(_case(i), v.tolist())) for i, v in enumerate(data)]
+    query = data[17]
+    expected = [ids[i] for i in np.argsort(-(data @ query))[:5]]
+    assert [r["case_id"] for r in asyncio.run(store.search(query.tolist(), top_k=5))] == expected
+
+
+def test_ivf_delete_and_purge_keep_lists_consistent(rng, tmp_path):
+    store = _ivf_store(tmp_path, n_probe=8)
+    data = _clustered(rng, 120)
+    ids = [asyncio.run(store.add_case(_case(i), v.tolist())) for i, v in enumerate(data)]
+    deleted = set(ids[::3])
+    for case_id in ids[::3]:
+        assert asyncio.run(store.delete_case(case_id))
+        # Tombstoned rows are skipped even before they are purged.
+        assert case_id not in [r["case_id"] for r in asyncio.run(store.search(data[0].tolist(), top_k=120))]
+    store._purge()
+    lists = store.index._lists
+    assert len(lists) == store.size == 80
+    members = sorted(row for b in range(lists.n_buckets) for row in lists.rows(b))
+    assert members == list(range(store.size))
+    for i, case_id in enumerate(ids):
+        if case_id not in deleted:
+            top = asyncio.run(store.search(data[i].tolist(), top_k=1))[0]
+            assert top["case_id"] == case_id
+
+
+def test_ivf_index_persisted_with_store(rng, tmp_path):
+    store = _ivf_store(tmp_path)
+    data = _clustered(rng, 100)
+    ids = [asyncio.run(store.add_case(_case(i), v.tolist())) for i, v in enumerate(data)]
+    asyncio.run(store.save())
+    assert (tmp_path / "vector_store.index.npz").exists()
+
+    reloaded = _ivf_store(tmp_path)
+    asyncio.run(reloaded.load())
+    assert reloaded.index.trained
+    np.testing.assert_array_equal(reloaded.index._centroids, store.index._centroids)
+    top = asyncio.run(reloaded.search(data[42].tolist(), top_k=1))[0]
+    assert top["case_id"] == ids[42]
+
+
+# ---------------------------------------------------------------------------
+# Quantized scan
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("mode", ["int8", "float16"])
+def test_quantized_search_rescored_exactly(mode, rng, tmp_path):
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"), quantization=mode)
+    data = _clustered(rng, 300)
+    ids = [asyncio.run(store.add_case(_case(i), v.tolist())) for i, v in enumerate(data)]
+    assert store._codes.dtype == np.dtype(mode)
+    query = data[5]
+    expected = np.argsort(-(data @ query))[:5]
+    results = asyncio.run(store.search(query.tolist(), top_k=5))
+    assert [r["case_id"] for r in results] == [ids[i] for i in expected]
+    # Scores come from the float32 re-scoring pass, not the codes.
+    assert results[0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_int8_refits_scale_as_store_grows(rng, tmp_path):
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"), quantization="int8")
+    data = _clustered(rng, 600)
+    for i, v in enumerate(data):
+        asyncio.run(store.add_case(_case(i), v.tolist()))
+    assert store._quantizer._fit_size == 512
+    # Rows seen by the last fit round-trip within half a quantization step per dimension.
+    scale = store._quantizer.scale
+    decoded = store._codes[:512].astype(np.float32) * scale
+    assert np.all(np.abs(decoded - store._matrix[:512]) <= 0.5 * scale + 1e-6)
+
+
+def test_quantized_codes_persisted(rng, tmp_path):
+    path = str(tmp_path / "vector_store.json")
+    store = VectorStore(persist_path=path, quantization="int8")
+    data = _clustered(rng, 300)
+    ids = [asyncio.run(store.add_case(_case(i), v.tolist())) for i, v in enumerate(data)]
+    asyncio.run(store.save())
+    assert (tmp_path / "vector_store.codes.npy").exists()
+
+    reloaded = VectorStore(persist_path=path, quantization="int8")
+    asyncio.run(reloaded.load())
+    assert isinstance(reloaded._codes, np.memmap)
+    np.testing.assert_array_equal(reloaded._quantizer.scale, store._quantizer.scale)
+    assert asyncio.run(reloaded.search(data[7].tolist(), top_k=1))[0]["case_id"] == ids[7]
+
+    # Reopening without quantization ignores and then drops the codes file.
+    plain = VectorStore(persist_path=path)
+    asyncio.run(plain.load())
+    assert asyncio.run(plain.search(data[7].tolist(), top_k=1))[0]["case_id"] == ids[7]
+    asyncio.run(plain.save())
+    assert not (tmp_path / "vector_store.codes.npy").exists()
+
+
+def test_quantized_store_keeps_loaded_rows_on_disk(rng, tmp_path):
+    path = str(tmp_path / "vector_store.json")
+    store = VectorStore(persist_path=path, quantization="int8")
+    data = _clustered(rng, 300)
+    ids = [asyncio.run(store.add_case(_case(i), v.tolist())) for i, v in enumerate(data)]
+    asyncio.run(store.save())
+
+    reloaded = VectorStore(persist_path=path, quantization="int8")
+    asyncio.run(reloaded.load())
+    extra = _clustered(rng, 3)
+    ids += [asyncio.run(reloaded.add_case(_case(300 + i), v.tolist())) for i, v in enumerate(extra)]
+    # Appending did not copy the base into memory: only the new rows are resident.
+    matrix = reloaded.snapshot().matrix
+    assert isinstance(matrix, vs.TailedMatrix) and isinstance(matrix.base, np.memmap)
+    assert vs.resident_bytes(matrix) == matrix.tail.nbytes
+    for i in (7, 301):
+        query = np.concatenate([data, extra])[i]
+        assert asyncio.run(reloaded.search(query.tolist(), top_k=1))[0]["case_id"] == ids[i]
+    np.testing.assert_allclose(matrix[[7, 301]], np.stack([data[7], extra[1]]), atol=1e-6)
+
+    # Compaction moves the appended rows into the new base file.
+    asyncio.run(reloaded.save())
+    matrix = reloaded.snapshot().matrix
+    assert isinstance(matrix, np.memmap) and matrix.shape[0] == 303
+    again = VectorStore(persist_path=path, quantization="int8")
+    asyncio.run(again.load())
+    assert [c["case_id"] for c in asyncio.run(again.get_all_cases())] == ids
+
+
+def test_purge_of_mapped_store_compacts_instead_of_reading_base(rng, tmp_path):
+    path = str(tmp_path / "vector_store.json")
+    store = VectorStore(persist_path=path, quantization="int8")
+    data = _clustered(rng, 300)
+    ids = [asyncio.run(store.add_case(_case(i), v.tolist())) for i, v in enumerate(data)]
+    asyncio.run(store.save())
+
+    async def run():
+        reloaded = VectorStore(persist_path=path, quantization="int8")
+        await reloaded.load()
+        extra = await reloaded.add_case(_case(300), _unit(rng).tolist())
+        for case_id in ids[:100]:
+            await reloaded.delete_case(case_id)
+            # Deletes never read the memory-mapped base into RAM.
+            assert isinstance(reloaded._matrix, vs.TailedMatrix)
+        await reloaded.commit()
+        await reloaded._compaction_task
+        return reloaded, extra
+
+    reloaded, extra = asyncio.run(run())
+    ids = ids[100:] + [extra]
+    matrix = reloaded.snapshot().matrix
+    assert isinstance(matrix, np.memmap) and matrix.shape[0] == 201
+    assert reloaded._dead == 0 and reloaded.size == 201
+    assert [c["case_id"] for c in asyncio.run(reloaded.get_all_cases())] == ids
+    top = asyncio.run(reloaded.search(data[150].tolist(), top_k=1))[0]
+    assert top["case_id"] == ids[50]
+    again = VectorStore(persist_path=path, quantization="int8")
+    asyncio.run(again.load())
+    assert [c["case_id"] for c in asyncio.run(again.get_all_cases())] == ids
+    np.testing.assert_allclose(again.snapshot().matrix[50], data[150], atol=1e-6)
+
+
+# ---------------------------------------------------------------------------
+# case_id index
+# ---------------------------------------------------------------------------
+
+def _assert_id_index_consistent(store):
+    snap = store.snapshot()
+    rows = list(snap.rows())
+    assert len(rows) == store.size
+    for row in rows:
+        assert snap.find_row(snap.meta[row]["case_id"]) == row
+
+
+def test_id_index_tracks_add_delete_and_load(store, rng, tmp_path):
+    ids, _ = _fill(store, rng, 10)
+    _assert_id_index_consistent(store)
+    for case_id in (ids[0], ids[9], ids[4]):
+        asyncio.run(store.delete_case(case_id))
+        _assert_id_index_consistent(store)
+    assert store._find_row(ids[0]) is None
+    assert store._get_entry_by_id(ids[5])["question"] == "question 5"
+
+    asyncio.run(store.save())
+    reloaded = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(reloaded.load())
+    _assert_id_index_consistent(reloaded)
+    assert asyncio.run(reloaded.delete_case(ids[5]))
+    _assert_id_index_consistent(reloaded)
+
+
+def test_version_bumps_only_when_contents_change(store, rng):
+    ids, vectors = _fill(store, rng, 3)
+    version = store.version
+    asyncio.run(store.search(vectors[0].tolist(), top_k=2))
+    asyncio.run(store.save())
+    assert store.version == version
+    assert not asyncio.run(store.delete_case("missing"))
+    assert store.version == version
+    assert asyncio.run(store.delete_case(ids[0]))
+    assert store.version == version + 1
+    asyncio.run(store.add_cases([_case(9)], [vectors[1].tolist()]))
+    assert store.version == version + 2
+
+
+def test_mmr_uses_embeddings_from_search_results(monkeypatch, store, rng):
+    ids, vectors = _fill(store, rng, 20)
+    query = vectors[0].tolist()
+    candidates = asyncio.run(store.search(query, top_k=8))
+    assert all(c["embedding"].dtype == np.float32 for c in candidates)
+
+    lookups = []
+    monkeypatch.setattr(store, "_find_row", lookups.append)
+    reranked = asyncio.run(store.mmr_rerank(candidates, query, top_n=3))
+    assert lookups == []
+    assert len(reranked) == 3
+    assert reranked[0]["case_id"] == ids[0]
+
+
+# ---------------------------------------------------------------------------
+# MMR
+# ---------------------------------------------------------------------------
+
+def _reference_mmr(embeddings, query, top_n, lambda_):
+    """The original nested-loop MMR, kept here as an oracle."""
+    query_sims = embeddings @ query
+    pairwise = embeddings @ embeddings.T
+    selected, remaining = [], list(range(len(embeddings)))
+    for _ in range(top_n):
+        best_score, best_idx = -float("inf"), -1
+        for idx in remaining:
+            redundancy = max(pairwise[idx][s] for s in selected) if selected else 0.0
+            score = lambda_ * query_sims[idx] - (1 - lambda_) * redundancy
+            if score > best_score:
+                best_score, best_idx = score, idx
+        selected.append(best_idx)
+        remaining.remove(best_idx)
+    return selected
+
+
+@pytest.mark.parametrize("lambda_", [0.0, 0.3, 0.7, 1.0])
+def test_mmr_select_matches_reference(rng, lambda_):
+    embeddings = _clustered(rng, 120, clusters=4).astype(np.float32)
+    query = embeddings[3]
+    assert vs.mmr_select(embeddings, query, 10, lambda_) == _reference_mmr(embeddings, query, 10, lambda_)
+
+
+def test_mmr_rerank_batch_matches_single(store, rng):
+    _, vectors = _fill(store, rng, 60)
+    queries = [vectors[i].tolist() for i in (0, 7, 21)]
+    candidate_lists = [asyncio.run(store.search(q, top_k=k)) for q, k in zip(queries, (12, 6, 9))]
+    batched = asyncio.run(store.mmr_rerank_batch(candidate_lists, queries, top_n=4, lambda_=0.5))
+    for candidates, query, result in zip(candidate_lists, queries, batched):
+        single = asyncio.run(store.mmr_rerank(candidates, query, top_n=4, lambda_=0.5))
+        assert [c["case_id"] for c in result] == [c["case_id"] for c in single]
+
+
+def test_trainer_uses_configured_mmr_top_n(store, rng):
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+
+    _, vectors = _fill(store, rng, 30)
+    trainer = SupportTrainer(config=SupportConfig(top_k=10, mmr_top_n=5, mmr_lambda=0.5), vector_store=store)
+    results = asyncio.run(trainer.find_similar_cases_async(vectors[0].tolist()))
+    assert len(results) == 5
+    assert "embedding" not in results[0]
+
+
+# ---------------------------------------------------------------------------
+# Metadata-filtered search
+# ---------------------------------------------------------------------------
+
+def test_category_filter_scans_only_matching_partition(store, rng):
+    categories = ["reembolsos", "seguimiento_pedido", "opciones_pago"]
+    vectors = [_unit(rng) for _ in range(30)]
+    ids = [
+        asyncio.run(store.add_case(_case(i, categories[i % 3]), v.tolist()))
+        for i, v in enumerate(vectors)
+    ]
+    only_tracking = vs.SearchFilter(categories=frozenset({"seguimiento_pedido"}))
+    results = asyncio.run(store.search(vectors[0].tolist(), top_k=30, metadata_filter=only_tracking))
+    assert len(results) == 10
+    assert {r["category"] for r in results} == {"seguimiento_pedido"}
+    scores = [r["score"] for r in results]
+    assert scores == sorted(scores, reverse=True)
+
+    unknown = vs.SearchFilter(categories=frozenset({"does_not_exist"}))
+    assert asyncio.run(store.search(vectors[0].tolist(), metadata_filter=unknown)) == []
+
+    # Partitions follow swap-remove deletes.
+    for case_id in ids[:9]:
+        asyncio.run(store.delete_case(case_id))
+    results = asyncio.run(store.search(vectors[0].tolist(), top_k=30, metadata_filter=only_tracking))
+    assert {r["case_id"] for r in results} == {ids[i] for i in range(10, 30) if i % 3 == 1}
+
+
+def test_priority_and_created_at_filters(store, rng, tmp_path):
+    vectors = [_unit(rng) for _ in range(6)]
+    ids = []
+    for i, v in enumerate(vectors):
+        case = {**_case(i), "priority": i % 3 + 1}
+        ids.append(asyncio.run(store.add_case(case, v.tolist())))
+    store._meta[0]["created_at"] = "2020-01-01T00:00:00"
+    store._reindex()
+    store._publish()
+
+    mid_priority = vs.SearchFilter(min_priority=2, max_priority=2)
+    results = asyncio.run(store.search(vectors[0].tolist(), top_k=10, metadata_filter=mid_priority))
+    assert {r["case_id"] for r in results} == {ids[1], ids[4]}
+
+    old = vs.SearchFilter(created_before="2021-01-01T00:00:00")
+    results = asyncio.run(store.search(vectors[3].tolist(), top_k=10, metadata_filter=old))
+    assert [r["case_id"] for r in results] == [ids[0]]
+
+    recent = vs.SearchFilter(created_after="2021-01-01T00:00:00")
+    results = asyncio.run(store.search(vectors[3].tolist(), top_k=10, metadata_filter=recent))
+    assert len(results) == 5
+
+
+# ---------------------------------------------------------------------------
+# Write-ahead log and compaction
+# ---------------------------------------------------------------------------
+
+def test_commit_appends_to_wal_without_rewriting_base(store, rng, tmp_path):
+    ids, _ = _fill(store, rng, 3)
+    asyncio.run(store.save())
+    base_mtime = os.path.getmtime(tmp_path / "vector_store.npy")
+    assert not (tmp_path / "vector_store.wal").exists()
+
+    new_id = asyncio.run(store.add_case(_case(3), _unit(rng).tolist()))
+    asyncio.run(store.delete_case(ids[0]))
+    asyncio.run(store.commit())
+    records = [json.loads(line) for line in (tmp_path / "vector_store.wal").read_text().splitlines()]
+    assert [r["op"] for r in records] == ["add", "delete"]
+    assert records[0]["meta"]["case_id"] == new_id
+    assert os.path.getmtime(tmp_path / "vector_store.npy") == base_mtime
+
+
+def test_recovery_replays_base_plus_wal(rng, tmp_path):
+    path = str(tmp_path / "vector_store.json")
+
+    async def write():
+        store = VectorStore(persist_path=path)
+        vectors = [_unit(rng) for _ in range(5)]
+        ids = [await store.add_case(_case(i), v.tolist()) for i, v in enumerate(vectors)]
+        await store.save()
+        ids.append(await store.add_case(_case(5), vectors[0].tolist()))
+        await store.delete_case(ids[1])
+        await store.commit()
+        return ids, vectors
+
+    ids, vectors = asyncio.run(write())
+    # Simulate a crash mid-append: a torn trailing record must be ignored.
+    with open(tmp_path / "vector_store.wal", "a") as f:
+        f.write('{"op": "add", "meta": {"case_')
+
+    recovered = VectorStore(persist_path=path)
+    asyncio.run(recovered.load())
+    assert {c["case_id"] for c in asyncio.run(recovered.get_all_cases())} == set(ids) - {ids[1]}
+    top = asyncio.run(recovered.search(vectors[3].tolist(), top_k=1))[0]
+    assert top["case_id"] == ids[3]
+
+
+def test_background_compaction_folds_wal_into_base(rng, tmp_path):
+    path = str(tmp_path / "vector_store.json")
+
+    async def run():
+        store = VectorStore(persist_path=path, wal_compact_bytes=1)
+        ids = [await store.add_case(_case(i), _unit(rng).tolist()) for i in range(4)]
+        await store.commit()
+        await store._compaction_task
+        return ids
+
+    ids = asyncio.run(run())
+    assert not (tmp_path / "vector_store.wal").exists()
+    assert not (tmp_path / "vector_store.wal.old").exists()
+    header = json.loads((tmp_path / "vector_store.meta.json").read_text())
+    assert [c["case_id"] for c in header["cases"]] == ids
+
+
+def test_replay_is_idempotent_after_interrupted_compaction(rng, tmp_path):
+    path = str(tmp_path / "vector_store.json")
+
+    async def write():
+        store = VectorStore(persist_path=path)
+        ids = [await store.add_case(_case(i), _unit(rng).tolist()) for i in range(3)]
+        await store.commit()
+        # Base written but the retired segment was never removed.
+        store._rotate_wal()
+        store._write_binary(store._checkpoint())
+        return ids
+
+    ids = asyncio.run(write())
+    assert (tmp_path / "vector_store.wal.old").exists()
+    recovered = VectorStore(persist_path=path)
+    asyncio.run(recovered.load())
+    assert recovered.size == 3
+    assert sorted(c["case_id"] for c in asyncio.run(recovered.get_all_cases())) == sorted(ids)
+
+
+# ---------------------------------------------------------------------------
+# Bulk ingest
+# ---------------------------------------------------------------------------
+
+def test_add_cases_appends_block_and_skips_duplicate_content(monkeypatch, store, rng):
+    monkeypatch.setattr(vs, "INITIAL_CAPACITY", 4)
+    existing, _ = _fill(store, rng, 2)
+    vectors = [_unit(rng) for _ in range(12)]
+    cases = [_case(i) for i in range(10)] + [_case(5), _case(1)]  # 0, 1 stored already; 5 repeats
+    ids = asyncio.run(store.add_cases(cases, [v.tolist() for v in vectors]))
+    assert ids[0] is None and ids[1] is None and ids[10] is None and ids[11] is None
+    assert all(ids[2:10])
+    assert store.size == 10
+    for i in range(2, 10):
+        top = asyncio.run(store.search(vectors[i].tolist(), top_k=1))[0]
+        assert top["case_id"] == ids[i]
+        assert top["score"] == pytest.approx(1.0, abs=1e-5)
+    # Deleted content can be ingested again.
+    asyncio.run(store.delete_case(existing[0]))
+    assert asyncio.run(store.add_cases([_case(0)], [vectors[0].tolist()]))[0] is not None
+
+
+def test_duplicate_content_stays_found_when_one_copy_is_deleted(store, rng, tmp_path):
+    _fill(store, rng, 8)
+    first = asyncio.run(store.add_case(_case(100), _unit(rng).tolist()))
+    second = asyncio.run(store.add_case(_case(100), _unit(rng).tolist()))
+    key = vs.content_hash(_case(100))
+    asyncio.run(store.delete_case(second))
+    assert store.snapshot().find_content(key) == 8
+    assert asyncio.run(store.add_cases([_case(100)], [_unit(rng).tolist()])) == [None]
+    asyncio.run(store.save())
+
+    reloaded = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    asyncio.run(reloaded.load())
+    assert reloaded.snapshot().find_content(key) == 8
+    asyncio.run(reloaded.delete_case(first))
+    assert reloaded.snapshot().find_content(key) is None
+
+
+def test_add_cases_is_durable_through_wal(rng, tmp_path):
+    path = str(tmp_path / "vector_store.json")
+    vectors = [_unit(rng) for _ in range(20)]
+
+    async def write():
+        store = VectorStore(persist_path=path, quantization="int8")
+        ids = await store.add_cases([_case(i) for i in range(20)], [v.tolist() for v in vectors])
+        await store.commit()
+        return ids
+
+    ids = asyncio.run(write())
+    recovered = VectorStore(persist_path=path, quantization="int8")
+    asyncio.run(recovered.load())
+    assert recovered.size == 20
+    assert recovered.snapshot().find_content(vs.content_hash(_case(7))) == 7
+    top = asyncio.run(recovered.search(vectors[7].tolist(), top_k=1))[0]
+    assert top["case_id"] == ids[7]
+
+
+# ---------------------------------------------------------------------------
+# Multi-vector search + rank fusion
+# ---------------------------------------------------------------------------
+
+def test_search_many_matches_per_query_search(store, rng):
+    _fill(store, rng, 60)
+    queries = [_unit(rng).tolist() for _ in range(4)]
+    batched = asyncio.run(store.search_many(queries, top_k=7))
+    for query, results in zip(queries, batched):
+        single = asyncio.run(store.search(query, top_k=7))
+        assert [r["case_id"] for r in results] == [r["case_id"] for r in single]
+        assert [r["score"] for r in results] == pytest.approx([r["score"] for r in single], abs=1e-6)
+
+
+def test_search_many_with_filter_and_approximate_backends(rng, tmp_path):
+    from vector_store import SearchFilter
+
+    data = _clustered(rng, 200)
+    queries = [data[3].tolist(), data[50].tolist()]
+    order_filter = SearchFilter(categories=frozenset({"b"}))
+    for store in (_ivf_store(tmp_path), VectorStore(persist_path=str(tmp_path / "q.json"), quantization="int8")):
+        for i, v in enumerate(data):
+            asyncio.run(store.add_case(_case(i, "a" if i % 2 else "b"), v.tolist()))
+        for metadata_filter in (None, order_filter):
+            batched = asyncio.run(store.search_many(queries, top_k=5, metadata_filter=metadata_filter))
+            for query, results in zip(queries, batched):
+                single = asyncio.run(store.search(query, top_k=5, metadata_filter=metadata_filter))
+                assert [r["case_id"] for r in results] == [r["case_id"] for r in single]
+
+
+def test_reciprocal_rank_fusion_orders_by_summed_reciprocal_rank():
+    def hit(case_id, score):
+        return {"case_id": case_id, "score": score}
+
+    fused = vs.reciprocal_rank_fusion(
+        [[hit("a", 0.9), hit("b", 0.8)], [hit("b", 0.95), hit("c", 0.7)], [hit("b", 0.6), hit("a", 0.5)]],
+        k=60,
+    )
+    assert [r["case_id"] for r in fused] == ["b", "a", "c"]
+    assert fused[0]["rrf_score"] == pytest.approx(1 / 62 + 1 / 61 + 1 / 61)
+    # The cosine score kept is the best the case reached in any list.
+    assert fused[0]["score"] == 0.95
+    assert len(vs.reciprocal_rank_fusion([[hit("a", 1.0), hit("b", 0.5)]], top_k=1)) == 1
+
+
+def test_trainer_multi_vector_retrieval(store, rng):
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+
+    ids, vectors = _fill(store, rng, 40)
+    trainer = SupportTrainer(config=SupportConfig(top_k=8, mmr_top_n=3, mmr_lambda=1.0), vector_store=store)
+    variants = [vectors[7].tolist(), (vectors[7] + 0.05 * _unit(rng)).tolist()]
+    results = asyncio.run(trainer.find_similar_cases_multi_async(variants))
+    assert len(results) == 3
+    assert results[0]["case_id"] == ids[7]
+    assert results[0]["similarity"] == pytest.approx(1.0, abs=1e-5)
+
+
+# ---------------------------------------------------------------------------
+# BM25 lexical index
+# ---------------------------------------------------------------------------
+
+def _kb_case(question, answer, category="general"):
+    return {"question": question, "answer": answer, "category": category, "priority": 1}
+
+
+def test_tokenize_strips_accents_case_and_stopwords():
+    from lexical_index import tokenize
+
+    assert tokenize("¿Cuál es la política de DEVOLUCIÓN del Smartphone XYZ?") == [
+        "cual", "politica", "devolucion", "smartphone", "xyz",
+    ]
+
+
+def test_bm25_tombstones_match_rebuild(rng):
+    from lexical_index import BM25Index
+
+    words = ["envio", "reembolso", "garantia", "smartphone", "xyz", "laptop", "pedido", "factura"]
+    docs = [" ".join(rng.choice(words, size=rng.integers(2, 8))) for _ in range(40)]
+    index = BM25Index()
+    for row, doc in enumerate(docs):
+        index.append(row, doc)
+    live = np.ones(len(docs), dtype=bool)
+    live[[0, 17, 36, 5]] = False
+    # Rows appended after a reader's row count are invisible to it.
+    index.append(len(docs), "smartphone xyz reembolso")
+
+    survivors = np.flatnonzero(live)
+    rebuilt = BM25Index()
+    for row, old in enumerate(survivors):
+        rebuilt.append(row, docs[old])
+    for query in ("smartphone xyz", "reembolso de pedido", "garantia laptop factura"):
+        got, got_ideal = index.scores(query, len(docs), live)
+        want, want_ideal = rebuilt.scores(query, len(survivors))
+        np.testing.assert_allclose(got[survivors], want, rtol=1e-5)
+        assert not got[~live].any()
+        assert got_ideal == pytest.approx(want_ideal)
+
+
+def test_lexical_search_tracks_adds_deletes_filters_and_load(rng, tmp_path):
+    from vector_store import SearchFilter
+
+    path = str(tmp_path / "vector_store.json")
+    store = VectorStore(persist_path=path)
+
+    async def build():
+        phone = await store.add_case(
+            _kb_case("garantia del smartphone xyz", "El Smartphone XYZ tiene 12 meses de garantia.", "productos"),
+            _unit(rng).tolist(),
+        )
+        gone = await store.add_case(_kb_case("smartphone xyz agotado", "Sin stock.", "productos"), _unit(rng).tolist())
+        await store.add_case(_kb_case("donde esta mi pedido", "Revisa el seguimiento.", "seguimiento_pedido"),
+                             _unit(rng).tolist())
+        await store.delete_case(gone)
+        await store.save()
+        return phone
+
+    phone = asyncio.run(build())
+    results = asyncio.run(store.lexical_search("Garantía smartphone XYZ", top_k=3))
+    assert [r["case_id"] for r in results] == [phone]
+    assert results[0]["score"] == results[0]["lexical_score"] > 0.5
+
+    tracking = SearchFilter(categories=frozenset({"seguimiento_pedido"}))
+    assert asyncio.run(store.lexical_search("smartphone xyz", metadata_filter=tracking)) == []
+    assert asyncio.run(store.lexical_search("pedido", metadata_filter=tracking))[0]["category"] == "seguimiento_pedido"
+
+    reloaded = VectorStore(persist_path=path)
+    asyncio.run(reloaded.load())
+    assert [r["case_id"] for r in asyncio.run(reloaded.lexical_search("smartphone xyz"))] == [phone]
+
+
+def test_hybrid_fusion_rescues_keyword_match(store, rng):
+    from support_models import SupportConfig
+    from support_trainer import SupportTrainer
+
+    ids, vectors = _fill(store, rng, 30)
+    target = asyncio.run(store.add_case(_kb_case("smartphone xyz", "12 meses de garantia"), _unit(rng).tolist()))
+    trainer = SupportTrainer(config=SupportConfig(top_k=5, mmr_top_n=5, mmr_lambda=1.0), vector_store=store)
+
+    query = [vectors[0].tolist()]
+    dense = asyncio.run(trainer.find_similar_cases_multi_async(query))
+    hybrid = asyncio.run(trainer.find_similar_cases_multi_async(query, query_text="smartphone xyz"))
+    assert target not in [c["case_id"] for c in dense]
+    assert target in [c["case_id"] for c in hybrid]
+    # Lexical hits are re-scored with cosine similarity, so thresholds keep their meaning.
+    hit = next(c for c in hybrid if c["case_id"] == target)
+    assert hit["similarity"] == pytest.approx(float(vectors[0] @ store._matrix[store._find_row(target)]), abs=1e-5)
+
+
+# ---------------------------------------------------------------------------
+# Lock-free snapshots
+# ---------------------------------------------------------------------------
+
+def _search_snapshot(snap, query, top_k=5):
+    rows, scores = snap.top_k_rows(query, top_k)
+    return [r["case_id"] for r in snap.results(rows, scores)]
+
+
+@pytest.mark.parametrize("quantization", [None, "int8"])
+def test_published_snapshot_is_unaffected_by_later_writes(quantization, rng, tmp_path):
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"), quantization=quantization)
+    ids, vectors = _fill(store, rng, 200)
+    snap = store.snapshot()
+    query = vectors[10]
+    before = _search_snapshot(snap, query)
+    cases_before = [snap.meta[row]["case_id"] for row in snap.rows()]
+
+    async def write():
+        # Appends past capacity, an int8 refit, tombstones and a purge.
+        for i in range(300):
+            await store.add_case(_case(1000 + i), _unit(rng).tolist())
+        for case_id in ids[:150]:
+            await store.delete_case(case_id)
+
+    asyncio.run(write())
+    assert store.size == 350
+    assert _search_snapshot(snap, query) == before
+    assert [snap.meta[row]["case_id"] for row in snap.rows()] == cases_before
+    assert snap.find_row(ids[10]) is not None
+    assert store.snapshot().find_row(ids[10]) is None
+
+
+def test_concurrent_readers_never_see_shifted_rows(rng, tmp_path):
+    import threading
+
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"))
+    vectors = {}
+
+    async def add(i):
+        v = _unit(rng)
+        vectors[await store.add_case(_case(i), v.tolist())] = v
+
+    for i in range(100):
+        asyncio.run(add(i))
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        queries = [_unit(np.random.default_rng(7)) for _ in range(8)]
+        while not stop.is_set():
+            for query in queries:
+                try:
+                    for r in store.search_sync(query.tolist(), top_k=10):
+                        # Every result must be the case's own row, not a neighbour shifted into place.
+                        np.testing.assert_allclose(r["embedding"], vectors[r["case_id"]], atol=1e-6)
+                        assert r["score"] == pytest.approx(float(vectors[r["case_id"]] @ query), abs=1e-5)
+                except Exception as e:  # noqa: BLE001 - reported below
+                    errors.append(e)
+                    return
+
+    threads = [threading.Thread(target=reader) for _ in range(2)]
+    for t in threads:
+        t.start()
+
+    async def churn():
+        for i in range(400):
+            await add(100 + i)
+            if i % 2:
+                snap = store.snapshot()
+                assert await store.delete_case(snap.meta[next(iter(snap.rows()))]["case_id"])
+
+    try:
+        asyncio.run(churn())
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    assert not errors, errors[0]
+
+
+# ---------------------------------------------------------------------------
+# Multi-worker sharing
+# ---------------------------------------------------------------------------
+
+def _worker(tmp_path, **kwargs):
+    store = VectorStore(persist_path=str(tmp_path / "vector_store.json"), shared=True, **kwargs)
+    asyncio.run(store.load())
+    return store
+
+
+def test_shared_workers_pick_up_published_writes(rng, tmp_path):
+    # Compact on every write scope, so each one publishes new base files.
+    writer, reader = _worker(tmp_path, wal_compact_bytes=0), _worker(tmp_path, wal_compact_bytes=0)
+    vectors = [_unit(rng) for _ in range(20)]
+
+    async def train():
+        async with writer.writing():
+            return [await writer.add_case(_case(i), v.tolist()) for i, v in enumerate(vectors)]
+
+    ids = asyncio.run(train())
+    assert reader.size == 20
+    top = asyncio.run(reader.search(vectors[4].tolist(), top_k=1))[0]
+    assert top["case_id"] == ids[4]
+    # Both workers serve the same read-only mapping of the base file, not private copies.
+    for store in (writer, reader):
+        assert isinstance(store.snapshot().matrix, np.memmap)
+        assert not store.snapshot().matrix.flags.writeable
+
+    async def delete():
+        async with reader.writing():
+            assert await reader.delete_case(ids[4])
+
+    asyncio.run(delete())
+    assert writer.size == 19
+    assert writer._get_entry_by_id(ids[4]) is None
+
+
+def test_shared_store_rejects_writes_outside_writing(rng, tmp_path):
+    store = _worker(tmp_path)
+    with pytest.raises(RuntimeError):
+        asyncio.run(store.add_case(_case(0), _unit(rng).tolist()))
+
+
+def test_failed_write_scope_is_not_published(rng, tmp_path):
+    writer, reader = _worker(tmp_path), _worker(tmp_path)
+
+    async def failing():
+        async with writer.writing():
+            await writer.add_case(_case(0), _unit(rng).tolist())
+            raise ValueError("embedding service down")
+
+    with pytest.raises(ValueError):
+        asyncio.run(failing())
+    assert writer.size == 0
+    assert reader.size == 0
+
+
+def test_reader_keeps_serving_while_writer_publishes(rng, tmp_path):
+    writer, reader = _worker(tmp_path), _worker(tmp_path)
+
+    async def add(n):
+        async with writer.writing():
+            for i in range(n):
+                await writer.add_case(_case(i), _unit(rng).tolist())
+
+    asyncio.run(add(5))
+    assert reader.size == 5
+    writer._sharing.lock()
+    try:
+        writer._sharing.bump()
+        # A writer is mid-publish: the reader does not wait, it serves its current version.
+        assert not reader.refresh()
+        assert reader.size == 5
+    finally:
+        writer._sharing.unlock()
+    assert reader.refresh()
+
+
+def test_small_writes_are_published_as_wal_records(rng, tmp_path, monkeypatch):
+    writer, reader = _worker(tmp_path, wal_compact_bytes=0), _worker(tmp_path)
+    vectors = [_unit(rng) for _ in range(12)]
+
+    async def add(block, writer=writer):
+        async with writer.writing():
+            return [await writer.add_case(_case(i), vectors[i].tolist()) for i in block]
+
+    ids = asyncio.run(add(range(10)))
+    assert reader.size == 10
+    base = os.stat(tmp_path / "vector_store.npy")
+
+    # Later scopes under the compaction threshold only append to the shared WAL,
+    # and the reader applies just those records to the rows it already has.
+    writer._wal_compact_bytes = 1 << 30
+    monkeypatch.setattr(VectorStore, "_load_shared_copy", lambda *a, **k: pytest.fail("full re-load"))
+    ids += asyncio.run(add([10]))
+    ids += asyncio.run(add([11], writer=reader))
+    assert os.stat(tmp_path / "vector_store.npy").st_mtime_ns == base.st_mtime_ns
+    for store in (writer, reader):
+        assert store.size == 12
+        top = asyncio.run(store.search(vectors[11].tolist(), top_k=1))[0]
+        assert top["case_id"] == ids[11]
+        # The base stays the shared mapping; only the two new rows are private.
+        matrix = store.snapshot().matrix
+        assert isinstance(matrix.base, np.memmap) and matrix.base.shape[0] == 10
+        assert store._find_row(ids[10]) is not None
+    assert asyncio.run(reader.lexical_search("question 10"))[0]["case_id"] == ids[10]
+
+
+def test_compacted_base_is_reloaded_off_the_event_loop(rng, tmp_path):
+    writer, reader = _worker(tmp_path, wal_compact_bytes=0), _worker(tmp_path)
+    vectors = [_unit(rng) for _ in range(6)]
+
+    async def add(block):
+        async with writer.writing():
+            return [await writer.add_case(_case(i), vectors[i].tolist()) for i in block]
+
+    ids = asyncio.run(add(range(3)))
+    assert reader.size == 3
+    ids += asyncio.run(add(range(3, 6)))
+
+    async def read():
+        # The new base is loaded in a worker thread; meanwhile the old version is served.
+        assert not reader.refresh()
+        assert reader.snapshot().size == 3
+        await reader._reloading
+        return reader.snapshot()
+
+    snap = asyncio.run(read())
+    assert snap.size == 6 and isinstance(snap.matrix, np.memmap)
+    assert asyncio.run(reader.search(vectors[5].tolist(), top_k=1))[0]["case_id"] == ids[5]
+
+
+def test_reload_does_not_roll_back_a_write_made_meanwhile(rng, tmp_path):
+    writer, reader = _worker(tmp_path, wal_compact_bytes=0), _worker(tmp_path, wal_compact_bytes=0)
+    vectors = [_unit(rng) for _ in range(3)]
+
+    async def add(i):
+        async with writer.writing():
+            await writer.add_case(_case(i), vectors[i].tolist())
+
+    asyncio.run(add(0))
+    assert reader.size == 1
+    asyncio.run(add(1))
+
+    # The reader's own write commits while the compacted base is being loaded.
+    loaded, resume = threading.Event(), threading.Event()
+    load = reader._load_shared_copy
+
+    def slow_load(locked=False):
+        copy = load(locked)
+        if not locked:  # the reload, not the write scope's own catch-up
+            loaded.set()
+            resume.wait(5)
+        return copy
+
+    reader._load_shared_copy = slow_load
+
+    async def write_during_reload():
+        assert not reader.refresh()
+        await asyncio.to_thread(loaded.wait, 5)
+        async with reader.writing():
+            case_id = await reader.add_case(_case(2), vectors[2].tolist())
+        resume.set()
+        await reader._reloading
+        return case_id, reader.snapshot()
+
+    case_id, snap = asyncio.run(write_during_reload())
+    assert snap.size == 3 and snap.find_row(case_id) is not None
@@ -0,0 +1,220 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Recent error messages kept per job
+MAX_JOB_ERRORS = 20
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class TrainJobQueue:
+    """Background training: ``submit`` persists a job and returns at once; a
+    worker task ingests queued jobs one at a time, ``chunk_size`` cases per step.
+
+    Each chunk goes through ``ingest`` (which commits and publishes it), so new
+    cases become searchable while the job is still running. A job is two files
+    in ``directory``: ``<id>.cases.json`` holds the submitted cases (removed
+    once the job finishes) and ``<id>.json`` its status, rewritten after every
+    chunk. ``start()`` resumes jobs that were queued or running when the API
+    stopped, from their last recorded chunk; a chunk that committed before its
+    progress was saved is ingested again harmlessly, since ingest skips
+    content the store already holds.
+
+    With several API workers, a job is claimed through a ``flock`` on
+    ``<id>.lock``, so only one worker runs it; any worker reports its status.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ingest: Callable[[list[dict]], Awaitable[dict]],
+        chunk_size: int = 256,
+    ):
+        self._dir = directory
+        self._ingest = ingest
+        self.chunk_size = max(1, chunk_size)
+        self._jobs: dict[str, dict] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _path(self, job_id: str, suffix: str = ".json") -> str:
+        return os.path.join(self._dir, job_id + suffix)
+
+    @staticmethod
+    def _write_json(path: str, data) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read_status(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(job_id), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, job: dict) -> None:
+        try:
+            self._write_json(self._path(job["job_id"]), job)
+        except Exception as e:
+            logger.error(f"Error saving training job {job['job_id']}: {e}")
+
+    async def start(self) -> None:
+        """Load persisted jobs, re-queue unfinished ones and start the worker."""
+        os.makedirs(self._dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+        self._jobs = {}
+        for name in os.listdir(self._dir):
+            job_id, ext = os.path.splitext(name)
+            if ext == ".json" and JOB_ID_PATTERN.match(job_id):
+                job = self._read_status(job_id)
+                if job is not None:
+                    self._jobs[job_id] = job
+        unfinished = sorted(
+            (job for job in self._jobs.values() if job["status"] in ("queued", "running")),
+            key=lambda job: job["created_at"],
+        )
+        for job in unfinished:
+            self._queue.put_nowait(job["job_id"])
+        if unfinished:
+            logger.info(f"Resuming {len(unfinished)} training jobs")
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the worker; an interrupted job resumes from its last chunk on the next start."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, cases: list[dict]) -> dict:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "total": len(cases),
+            "processed": 0,
+            "added": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "progress": 0.0,
+            "errors": [],
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "elapsed_seconds": 0.0,
+            "cases_per_second": None,
+        }
+        await asyncio.to_thread(self._write_json, self._path(job_id, ".cases.json"), cases)
+        self._save(job)
+        self._jobs[job_id] = job
+        self._queue.put_nowait(job_id)
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Status of a job; jobs run by another worker are read from their status file."""
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] == "queued":
+            job = self._read_status(job_id) or job
+        return None if job is None else dict(job)
+
+    async def _run(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._claim_and_process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Training job {job_id} crashed: {e}")
+
+    async def _claim_and_process(self, job_id: str) -> None:
+        fd = os.open(self._path(job_id, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another worker is running it
+            # Another worker may have finished it meanwhile; the file is authoritative.
+            job = self._read_status(job_id) or self._jobs[job_id]
+            self._jobs[job_id] = job
+            if job["status"] in ("queued", "running"):
+                await self._process(job)
+        finally:
+            os.close(fd)
+
+    async def _process(self, job: dict) -> None:
+        job_id = job["job_id"]
+        cases_path = self._path(job_id, ".cases.json")
+        try:
+            with open(cases_path, "r") as f:
+                cases = await asyncio.to_thread(json.load, f)
+        except Exception as e:
+            self._finish(job, "failed", f"Cannot read submitted cases: {e}")
+            return
+        job["status"] = "running"
+        job["started_at"] = job["started_at"] or _now()
+        self._save(job)
+        elapsed_before = job["elapsed_seconds"]
+        start = time.perf_counter()
+        while job["processed"] < job["total"]:
+            offset = job["processed"]
+            chunk = cases[offset:offset + self.chunk_size]
+            try:
+                stats = await self._ingest(chunk)
+            except Exception as e:
+                logger.error(f"Training job {job_id} failed at case {offset}: {e}")
+                self._finish(job, "failed", f"Chunk at case {offset}: {e}")
+                return
+            job["processed"] += len(chunk)
+            job["added"] += stats["added"]
+            job["duplicates"] += stats["duplicates"]
+            job["failed"] += stats["failed"]
+            if stats["failed"]:
+                self._add_error(job, f"{stats['failed']} cases in the chunk at case {offset} failed to embed")
+            job["progress"] = round(job["processed"] / job["total"], 4)
+            elapsed = elapsed_before + time.perf_counter() - start
+            job["elapsed_seconds"] = round(elapsed, 3)
+            job["cases_per_second"] = round(job["processed"] / elapsed, 1)
+            self._save(job)
+        self._finish(job, "completed")
+        try:
+            os.remove(cases_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _add_error(job: dict, message: str) -> None:
+        job["errors"] = (job["errors"] + [message])[-MAX_JOB_ERRORS:]
+
+    def _finish(self, job: dict, status: str, error: Optional[str] = None) -> None:
+        job["status"] = status
+        job["finished_at"] = _now()
+        if error:
+            self._add_error(job, error)
+        if status == "completed":
+            job["progress"] = 1.0
+        self._save(job)
+        logger.info(
+            f"Training job {job['job_id']} {status}: {job['processed']}/{job['total']} cases, "
+            f"{job['added']} added, {job['duplicates']} duplicates, {job['failed']} failed"
+        )
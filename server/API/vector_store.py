@@ -1,77 +1,1034 @@
 import asyncio
+import base64
+import copy
+import itertools
+import hashlib
 import json
+import os
 import uuid
 import logging
-from datetime import datetime
-from typing import Optional
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import cached_property
+from datetime import datetime, timezone
+from typing import Optional, Union
 
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import normalize
+
+from ann_index import ExactIndex, InvertedLists, top_k_rows
+from lexical_index import BM25Index
+from quantization import make_quantizer
+from shared_store import StoreSharing
 
 logger = logging.getLogger(__name__)
 
+# Rows preallocated on the first insert; capacity doubles whenever it runs out.
+INITIAL_CAPACITY = 1024
+
+# On-disk layout written by VectorStore.save (see _write_binary).
+FORMAT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """Metadata restrictions for VectorStore.search. ``None`` fields do not filter.
+
+    Timestamps may be datetimes or ISO-8601 strings; naive values are UTC,
+    matching the ``created_at`` values the store writes.
+    """
+    categories: Optional[frozenset] = None
+    min_priority: Optional[int] = None
+    max_priority: Optional[int] = None
+    created_after: Optional[Union[datetime, str]] = None
+    created_before: Optional[Union[datetime, str]] = None
+
+
+def _timestamp(value: Union[datetime, str, None]) -> float:
+    """Epoch seconds for a datetime/ISO string (naive = UTC); NaN when missing or unparsable."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return float("nan")
+    if not isinstance(value, datetime):
+        return float("nan")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def content_hash(case: dict) -> str:
+    """Identity of a case's content (category, question, answer), used to skip duplicate ingests."""
+    content = "\0".join(str(case.get(field, "")) for field in ("category", "question", "answer"))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _content_rows(entry) -> tuple:
+    """Rows of a ``content_to_row`` entry: a row, or a tuple of rows when the content is stored twice."""
+    if entry is None:
+        return ()
+    return (entry,) if isinstance(entry, int) else entry
+
+
+def l2_normalize(vectors) -> np.ndarray:
+    """Row-wise L2 normalization to float32; a 1-D input is one row. Zero rows stay zero."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def mean_direction(vectors) -> np.ndarray:
+    """Unit-norm mean of the L2-normalized rows, so each row weighs the same whatever its norm."""
+    return l2_normalize(np.mean(l2_normalize(vectors), axis=0))
+
+
+def reciprocal_rank_fusion(result_lists: list[list[dict]], k: int = 60, top_k: Optional[int] = None) -> list[dict]:
+    """Fuse ranked result lists: each case scores sum(1 / (k + rank)) over the lists it appears in.
+
+    Fused results are ordered by ``rrf_score``; ``score`` keeps the best cosine
+    similarity the case reached in any list, so thresholds still apply to it.
+    """
+    fused: dict[str, dict] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            entry = fused.get(result["case_id"])
+            if entry is None:
+                entry = fused[result["case_id"]] = {**result, "rrf_score": 0.0}
+            elif result["score"] > entry["score"]:
+                entry["score"] = result["score"]
+            entry["rrf_score"] += 1.0 / (k + rank)
+    ranked = sorted(fused.values(), key=lambda r: r["rrf_score"], reverse=True)
+    return ranked if top_k is None else ranked[:top_k]
+
+
+def mmr_select(embeddings: np.ndarray, query_vec: np.ndarray, top_n: int, lambda_: float) -> list[int]:
+    """Greedy MMR over unit-norm candidate rows; returns selected positions in pick order.
+
+    Keeps a running max-redundancy array, so each step costs one matrix-vector
+    product instead of re-scanning every selected pair.
+    """
+    return mmr_select_batch(embeddings[None], query_vec[None], top_n, lambda_)[0]
+
+
+def mmr_select_batch(
+    embeddings: np.ndarray,
+    query_vecs: np.ndarray,
+    top_n: int,
+    lambda_: float,
+    valid: Optional[np.ndarray] = None,
+) -> list[list[int]]:
+    """Batched greedy MMR: ``embeddings`` is (B, n, d), ``query_vecs`` is (B, d).
+
+    ``valid`` masks padding when the candidate lists have different lengths.
+    """
+    batch, n, _ = embeddings.shape
+    if valid is None:
+        valid = np.ones((batch, n), dtype=bool)
+    available = valid.copy()
+    relevance = np.matmul(embeddings, query_vecs[:, :, None])[:, :, 0]
+    # Redundancy is 0 before the first pick; afterwards it is a true max, which can be negative.
+    max_redundancy = np.zeros((batch, n), dtype=relevance.dtype)
+    rows = np.arange(batch)
+    selected: list[list[int]] = [[] for _ in range(batch)]
+    for step in range(min(top_n, n)):
+        scores = lambda_ * relevance - (1 - lambda_) * max_redundancy
+        scores[~available] = -np.inf
+        best = np.argmax(scores, axis=1)
+        picked = available[rows, best]
+        for b in np.flatnonzero(picked):
+            selected[b].append(int(best[b]))
+        available[rows, best] = False
+        redundancy = np.matmul(embeddings, embeddings[rows, best][:, :, None])[:, :, 0]
+        if step == 0:
+            max_redundancy = redundancy
+        else:
+            np.maximum(max_redundancy, redundancy, out=max_redundancy)
+    return selected
+
+
+# Rows deleted since the last purge, as a fraction of all rows, that trigger one.
+PURGE_FRACTION = 0.25
+
+# Deletes and publishes draw increasing stamps from one clock (see LiveMask).
+_clock = itertools.count(1)
+# Deletion stamp of a row that is not deleted.
+NOT_DELETED = np.iinfo(np.int64).max
+
+
+class LiveMask:
+    """Which rows one snapshot sees as live: those not deleted before it was published.
+
+    The writer stamps a deleted row in its ``deleted_at`` array in place, with a
+    tick of the clock later than every published snapshot, so a delete costs
+    O(1) and the snapshots already published keep seeing the row. Indexing
+    (a row, a slice or an array of rows) returns booleans like a mask array.
+    """
+
+    __slots__ = ("_deleted_at", "_published")
+
+    def __init__(self, deleted_at: np.ndarray, published: int):
+        self._deleted_at = deleted_at
+        self._published = published
+
+    def __getitem__(self, rows):
+        return self._deleted_at[rows] > self._published
+
+
+class TailedMatrix:
+    """Float32 rows split into a read-only memory-mapped base and an in-RAM tail.
+
+    A quantized store scans its codes and reads float32 rows only to re-score a
+    few candidates, and shared workers should hold one copy of the rows between
+    them, so appending to a loaded store must not copy the base into the
+    process: the base stays on disk (in the page cache) and only rows appended
+    since the last compaction live in RAM.
+
+    Indexing with row numbers returns a plain array. Slices stay on one side of
+    the boundary when they can; a slice from row 0 that crosses it returns a
+    shorter TailedMatrix, and ``np.asarray`` concatenates.
+    """
+
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, base: np.ndarray, tail: Optional[np.ndarray] = None):
+        self.base = base
+        self.tail = np.empty((0, base.shape[1]), dtype=np.float32) if tail is None else tail
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.base.shape[0] + self.tail.shape[0], self.base.shape[1]
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __matmul__(self, other: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.base @ other, self.tail @ other])
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        out = np.concatenate([self.base, self.tail])
+        return out if dtype is None else out.astype(dtype)
+
+    def __getitem__(self, key):
+        n_base = self.base.shape[0]
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(len(self))
+            if stop <= n_base:
+                return self.base[start:stop]
+            if start >= n_base:
+                return self.tail[start - n_base:stop - n_base]
+            if start == 0:
+                return TailedMatrix(self.base, self.tail[:stop - n_base])
+            return np.concatenate([self.base[start:], self.tail[:stop - n_base]])
+        if isinstance(key, (int, np.integer)):
+            return self.base[key] if key < n_base else self.tail[key - n_base]
+        rows = np.asarray(key)
+        out = np.empty((rows.shape[0], self.shape[1]), dtype=np.float32)
+        in_base = rows < n_base
+        out[in_base] = self.base[rows[in_base]]
+        out[~in_base] = self.tail[rows[~in_base] - n_base]
+        return out
+
+    def __setitem__(self, key: slice, values) -> None:
+        start, stop, _ = key.indices(len(self))
+        n_base = self.base.shape[0]
+        if start < n_base:
+            raise ValueError("The memory-mapped base rows are read-only")
+        self.tail[start - n_base:stop - n_base] = values
+
+    def with_room(self, n: int, count: int) -> "TailedMatrix":
+        """Return a matrix with room for rows ``n..n+count-1``, growing only the tail."""
+        if n + count <= len(self):
+            return self
+        n_base = self.base.shape[0]
+        tail = np.empty((max(2 * self.tail.shape[0], INITIAL_CAPACITY, n + count - n_base), self.shape[1]),
+                        dtype=np.float32)
+        tail[:n - n_base] = self.tail[:n - n_base]
+        return TailedMatrix(self.base, tail)
+
+
+def resident_bytes(array) -> int:
+    """Bytes of ``array`` held in process memory; memory-mapped rows count as zero."""
+    if array is None or isinstance(array, np.memmap):
+        return 0
+    if isinstance(array, TailedMatrix):
+        return array.tail.nbytes
+    return array.nbytes
+
+
+def save_rows(f, matrix, chunk: int = 65_536, rows: Optional[np.ndarray] = None) -> None:
+    """``np.save`` a float32 row matrix block by block, so a TailedMatrix is never concatenated.
+
+    With ``rows`` (ascending), only those rows are written, gathered one block at a time.
+    """
+    count = matrix.shape[0] if rows is None else rows.shape[0]
+    header = {
+        "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+        "fortran_order": False,
+        "shape": (int(count), int(matrix.shape[1])),
+    }
+    np.lib.format.write_array_header_1_0(f, header)
+    for start in range(0, count, chunk):
+        block = matrix[start:start + chunk] if rows is None else matrix[rows[start:start + chunk]]
+        f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+
+
+@dataclass(frozen=True)
+class StoreSnapshot:
+    """One published, immutable version of a VectorStore's contents.
+
+    Readers take ``store.snapshot()`` (a single attribute read, no lock) and use
+    only that object, so concurrent writers can never shift rows under them.
+    Writers never modify a row a published snapshot can see: rows are appended
+    past ``n``, a delete stamps the row with a time after the snapshot (see
+    ``LiveMask``), and purging
+    tombstones or refitting the quantizer builds new arrays. A snapshot is
+    reclaimed by the garbage collector once the last reader drops it.
+    """
+    n: int  # rows 0..n-1 belong to this snapshot, tombstoned ones included
+    size: int  # live rows
+    matrix: Optional[np.ndarray]
+    meta: list
+    id_to_row: dict
+    content_to_row: dict  # content_hash -> row, or a tuple of rows for duplicate content (dead ones included)
+    live: Optional[LiveMask]  # None when nothing is tombstoned
+    priority: Optional[np.ndarray]
+    created: Optional[np.ndarray]
+    categories: InvertedLists
+    category_ids: dict
+    lexical: BM25Index
+    index: object  # ExactIndex or an IVF view (see IVFIndex.view)
+    quantizer: object = None
+    codes: Optional[np.ndarray] = None
+    rescore_factor: int = 4
+    version: int = 0  # bumped by every publish; answers derived from the contents key on it
+
+    @property
+    def dim(self) -> Optional[int]:
+        return None if self.matrix is None else self.matrix.shape[1]
+
+    @cached_property
+    def live_rows(self) -> Optional[np.ndarray]:
+        return None if self.live is None else self.live[:self.n]
+
+    def _visible(self, row: Optional[int]) -> Optional[int]:
+        if row is None or row >= self.n or (self.live is not None and not self.live[row]):
+            return None
+        return row
+
+    def find_row(self, case_id: str) -> Optional[int]:
+        return self._visible(self.id_to_row.get(case_id))
+
+    def find_content(self, key: str) -> Optional[int]:
+        """Live row holding a case with this ``content_hash``, if any."""
+        for row in _content_rows(self.content_to_row.get(key)):
+            if self._visible(row) is not None:
+                return row
+        return None
+
+    def rows(self):
+        """Live row numbers, in storage order."""
+        return range(self.n) if self.live is None else np.flatnonzero(self.live[:self.n]).tolist()
+
+    def filtered_rows(self, metadata_filter: SearchFilter) -> np.ndarray:
+        """Rows matching ``metadata_filter``: the category partitions, then attribute masks."""
+        if metadata_filter.categories is not None:
+            buckets = [self.category_ids[c] for c in metadata_filter.categories if c in self.category_ids]
+            rows = self.categories.gather(buckets, limit=self.n)
+        else:
+            rows = np.arange(self.n)
+        mask = np.ones(rows.shape[0], dtype=bool) if self.live is None else self.live[rows]
+        if metadata_filter.min_priority is not None:
+            mask &= self.priority[rows] >= metadata_filter.min_priority
+        if metadata_filter.max_priority is not None:
+            mask &= self.priority[rows] <= metadata_filter.max_priority
+        if metadata_filter.created_after is not None:
+            mask &= self.created[rows] >= _timestamp(metadata_filter.created_after)
+        if metadata_filter.created_before is not None:
+            mask &= self.created[rows] <= _timestamp(metadata_filter.created_before)
+        return rows[mask]
+
+    def top_k_rows(
+        self, query_vec: np.ndarray, top_k: int, metadata_filter: Optional[SearchFilter] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Ask the index backend for the top-K rows and their cosine scores.
+
+        A metadata filter bypasses the index and scans only the matching rows exactly.
+        """
+        if metadata_filter is not None:
+            rows = self.filtered_rows(metadata_filter)
+            scores = self.matrix[rows] @ query_vec
+            best = top_k_rows(scores, top_k)
+            return rows[best], scores[best]
+        if self.quantizer is not None and isinstance(self.index, ExactIndex):
+            approx = self.quantizer.scores(self.codes[:self.n], query_vec)
+            if self.live is not None:
+                approx[~self.live_rows] = -np.inf
+            candidates = top_k_rows(approx, top_k * self.rescore_factor)
+            candidates = candidates[np.isfinite(approx[candidates])]
+            exact = self.matrix[candidates] @ query_vec
+            best = top_k_rows(exact, top_k)
+            return candidates[best], exact[best]
+        return self.index.search(self.matrix[:self.n], query_vec, top_k, self.live_rows)
+
+    def top_k_rows_many(
+        self, query_matrix: np.ndarray, top_k: int, metadata_filter: Optional[SearchFilter] = None
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Per-query top-K for a (m, d) matrix of queries, scored with one matrix-matrix product.
+
+        Approximate backends (IVF, quantized scan) have their own candidate logic and
+        fall back to one search per query.
+        """
+        if metadata_filter is not None:
+            rows = self.filtered_rows(metadata_filter)
+        elif self.quantizer is None and isinstance(self.index, ExactIndex):
+            rows = None if self.live is None else np.flatnonzero(self.live_rows)
+        else:
+            return [self.top_k_rows(q, top_k) for q in query_matrix]
+        scores = ((self.matrix[:self.n] if rows is None else self.matrix[rows]) @ query_matrix.T).T
+        results = []
+        for row_scores in scores:
+            best = top_k_rows(row_scores, top_k)
+            results.append((best if rows is None else rows[best], row_scores[best]))
+        return results
+
+    def results(self, rows: np.ndarray, scores: np.ndarray) -> list[dict]:
+        vectors = self.matrix[rows]
+        return [
+            {**self.meta[row], "score": float(score), "embedding": vector}
+            for row, score, vector in zip(rows, scores, vectors)
+        ]
+
+    def candidate_matrix(self, candidates: list[dict]) -> np.ndarray:
+        """Stack candidate embeddings; search() results carry them, anything else is looked up by id."""
+        out = np.zeros((len(candidates), self.dim or 0), dtype=np.float32)
+        for i, c in enumerate(candidates):
+            embedding = c.get("embedding")
+            if embedding is None:
+                row = self.find_row(c["case_id"])
+                # Unknown ids keep a zero vector (should not happen normally)
+                embedding = self.matrix[row] if row is not None else None
+            if embedding is not None:
+                out[i] = embedding
+        return out
+
 
 class VectorStore:
-    """Persistent vector store with MMR reranking support."""
+    """Persistent vector store with MMR reranking support.
+
+    Search is delegated to a pluggable index backend: ``ExactIndex`` (default,
+    brute-force scan) or ``IVFIndex`` (approximate, sub-linear).
 
-    def __init__(self, persist_path: str = "vector_store.json"):
+    With ``quantization="int8"`` or ``"float16"`` the brute-force scan runs over
+    compact codes instead of the float32 matrix, and the best
+    ``top_k * rescore_factor`` candidates are re-scored exactly in float32. The
+    float32 base then stays memory-mapped (see TailedMatrix).
+
+    Reads are lock-free: every search runs against the current StoreSnapshot,
+    which writers replace (never modify) under ``self._lock``.
+
+    With ``shared=True`` several worker processes serve the same store: each
+    memory-maps the base files read-only (one copy in the page cache) and keeps
+    rows added since the last compaction in a private tail. Writes go through
+    ``writing()`` under a cross-process lock and are published as records on
+    the shared WAL; readers apply the new records when the shared generation
+    counter moves, and re-load the base in a worker thread only after a writer
+    compacted the WAL into new base files (see StoreSharing).
+    """
+
+    def __init__(
+        self,
+        persist_path: str = "vector_store.json",
+        index=None,
+        quantization: Optional[str] = None,
+        rescore_factor: int = 4,
+        wal_compact_bytes: int = 64 * 1024 * 1024,
+        shared: bool = False,
+    ):
         self._lock = asyncio.Lock()
         self._persist_path = persist_path
-        # Internal storage: list of dicts with keys: case_id, category, question, answer, created_at, embedding
-        self._entries: list[dict] = []
+        # Multi-process mode: the generation this worker has loaded, and whether it
+        # is inside writing() (holding the cross-process write lock).
+        self._sharing = StoreSharing(os.path.splitext(persist_path)[0]) if shared else None
+        self._generation: Optional[int] = None
+        self._base_epoch: Optional[int] = None
+        self._writing = False
+        self._write_scope_lock = asyncio.Lock()
+        # Re-load of a compacted shared base, running in a worker thread.
+        self._reloading: Optional[asyncio.Future] = None
+        # Mutations are logged to <store>.wal and folded into the base files by compact().
+        self._wal_lock = asyncio.Lock()
+        self._compact_lock = asyncio.Lock()
+        self._wal_buffer: list[str] = []
+        self._wal_bytes = 0
+        # Bytes of the live WAL segment applied to this worker's rows.
+        self._wal_offset = 0
+        self._wal_compact_bytes = wal_compact_bytes
+        self._compaction_task: Optional[asyncio.Task] = None
+        self._index = index if index is not None else ExactIndex()
+        self._quantizer = make_quantizer(quantization)
+        self._rescore_factor = rescore_factor
+        # Append to a loaded store without copying its memory-mapped rows: quantized
+        # stores only re-score from them, shared ones keep one copy in the page cache.
+        self._map_base = self._quantizer is not None or shared
+        # Writer-side state, published to readers as StoreSnapshots. Everything
+        # below is append-only between purges; see StoreSnapshot.
+        # Quantized copy of the matrix rows (only when quantization is on).
+        self._codes: Optional[np.ndarray] = None
+        # Row-aligned storage: L2-normalized float32 embeddings in a preallocated
+        # matrix and case metadata (case_id, category, question, answer, priority,
+        # created_at) in a parallel list. Only the first len(_meta) rows are used.
+        self._matrix: Optional[np.ndarray] = None
+        self._meta: list[dict] = []
+        # case_id -> row, kept in step with every append, purge and load.
+        self._id_to_row: dict[str, int] = {}
+        # content_hash -> row, maintained alongside _id_to_row.
+        self._content_to_row: dict[str, int] = {}
+        # Clock stamp of each row's delete (tombstone), NOT_DELETED for live rows,
+        # until the next purge; None = all live.
+        self._deleted_at: Optional[np.ndarray] = None
+        self._dead = 0
+        # Bumped whenever rows are renumbered (purge, reload), so a compaction can
+        # tell whether the base it wrote still lines up with the rows in memory.
+        self._purges = 0
+        # Filterable attributes: rows partitioned by category, plus row-aligned
+        # priority and created_at (epoch seconds) arrays.
+        self._categories = InvertedLists()
+        self._category_ids: dict[str, int] = {}
+        self._priority: Optional[np.ndarray] = None
+        self._created: Optional[np.ndarray] = None
+        # BM25 over question + answer; derived from metadata like the partitions above.
+        self._lexical = BM25Index()
+        # Knowledge-base version: counts publishes in this process.
+        self._version = 0
+        self._current: StoreSnapshot = self._build_snapshot()
 
     @property
     def size(self) -> int:
-        return len(self._entries)
+        return self.snapshot().size
 
-    async def add_case(self, case: dict, embedding: list[float]) -> str:
-        """Add a case with its embedding. Returns case_id."""
-        case_id = str(uuid.uuid4())
-        norm_embedding = normalize(np.array(embedding).reshape(1, -1))[0].tolist()
-        entry = {
-            "case_id": case_id,
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.snapshot().dim
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
+    def snapshot(self) -> StoreSnapshot:
+        """The current published version; stays valid (and unchanged) for as long as it is held."""
+        self.refresh()
+        return self._current
+
+    def refresh(self) -> bool:
+        """Catch up with versions other workers published to the shared store.
+
+        Never waits: while a writer is publishing, or a compacted base is being
+        re-loaded, the current snapshot keeps being served and the check is
+        repeated on the next read. New WAL records are applied in place; a new
+        base is loaded in a worker thread (inline when there is no running event
+        loop) and swapped in. Returns True once the newer version is served.
+        """
+        sharing = self._sharing
+        if sharing is None or self._writing or self._generation is None or self._reloading is not None:
+            return False
+        if sharing.generation() == self._generation or not sharing.try_lock_shared():
+            return False
+        try:
+            if sharing.base_epoch() == self._base_epoch:
+                self._catch_up_wal()
+                return True
+        finally:
+            sharing.unlock_shared()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            loaded = self._load_shared_copy()
+            if loaded is None:
+                return False
+            self._adopt(*loaded)
+            return True
+        self._reloading = asyncio.ensure_future(self._reload())
+        return False
+
+    def _catch_up_wal(self) -> None:
+        """Apply the shared WAL records other workers appended since this worker last read it.
+
+        Caller holds the shared lock (or the write lock).
+        """
+        generation = self._sharing.generation()
+        if not os.path.exists(self._wal_path):
+            self._generation = generation
+            return
+        with open(self._wal_path, "rb") as f:
+            f.seek(self._wal_offset)
+            data = f.read()
+        # Records are only published whole; a torn tail belongs to a writer that crashed.
+        data = data[:data.rfind(b"\n") + 1]
+        for line in data.splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring truncated WAL record in {self._wal_path}")
+                continue
+            self._apply_record(record)
+        self._wal_offset += len(data)
+        self._wal_bytes = self._wal_offset
+        self._publish()
+        self._generation = generation
+
+    def _load_shared_copy(self, locked: bool = False):
+        """Load the shared base and WAL into a private, unshared store.
+
+        Touches nothing readers of this store can see, so it can run in a worker
+        thread; ``_adopt`` then swaps the rows in. Returns None if a writer holds
+        the lock, unless the caller already holds it (``locked=True``).
+        """
+        sharing = self._sharing
+        if not locked and not sharing.try_lock_shared():
+            return None
+        try:
+            generation, epoch = sharing.generation(), sharing.base_epoch()
+            index = copy.copy(self._index)
+            index.reset()
+            loader = VectorStore(
+                self._persist_path, index=index,
+                quantization=None if self._quantizer is None else self._quantizer.kind,
+                rescore_factor=self._rescore_factor,
+            )
+            loader._map_base = self._map_base
+            loader._load_state()
+        finally:
+            if not locked:
+                sharing.unlock_shared()
+        return loader, generation, epoch
+
+    def _adopt(self, loader: "VectorStore", generation: int, epoch: int) -> None:
+        """Take over the rows ``_load_shared_copy`` loaded and publish them."""
+        for name in (
+            "_matrix", "_codes", "_meta", "_id_to_row", "_content_to_row", "_deleted_at", "_dead", "_categories",
+            "_category_ids", "_priority", "_created", "_lexical", "_index", "_quantizer", "_wal_bytes",
+            "_wal_offset",
+        ):
+            setattr(self, name, getattr(loader, name))
+        self._purges += 1
+        self._generation, self._base_epoch = generation, epoch
+        self._publish()
+
+    async def _reload(self) -> None:
+        generation = self._generation
+        try:
+            loaded = await asyncio.to_thread(self._load_shared_copy)
+            # A write scope that ran meanwhile caught up by itself and may have
+            # committed past the loaded copy; installing it would lose that write.
+            if (
+                loaded is not None and not self._writing and self._generation == generation
+                and loaded[1] >= self._generation
+            ):
+                self._adopt(*loaded)
+        except Exception as e:
+            logger.error(f"Error re-loading shared vector store: {e}")
+        finally:
+            self._reloading = None
+
+    def _build_snapshot(self) -> StoreSnapshot:
+        n = len(self._meta)
+        return StoreSnapshot(
+            n=n,
+            size=n - self._dead,
+            matrix=self._matrix,
+            meta=self._meta,
+            id_to_row=self._id_to_row,
+            content_to_row=self._content_to_row,
+            live=None if self._deleted_at is None else LiveMask(self._deleted_at, next(_clock)),
+            priority=self._priority,
+            created=self._created,
+            categories=self._categories,
+            category_ids=self._category_ids,
+            lexical=self._lexical,
+            index=self._index.view(),
+            quantizer=self._quantizer,
+            codes=self._codes,
+            rescore_factor=self._rescore_factor,
+            version=self._version,
+        )
+
+    def _publish(self, changed: bool = True) -> None:
+        """Make the writer-side state visible to readers in one atomic reference swap.
+
+        ``changed=False`` republishes the same cases (e.g. after a purge) without
+        bumping the knowledge-base version.
+        """
+        if changed:
+            self._version += 1
+        self._current = self._build_snapshot()
+
+    @staticmethod
+    def _ensure_row(array: Optional[np.ndarray], n: int, tail: tuple, dtype, count: int = 1) -> np.ndarray:
+        """Return ``array`` with room for rows ``n..n+count-1``, allocating or doubling as needed."""
+        if array is None:
+            return np.empty((max(INITIAL_CAPACITY, n + count),) + tail, dtype=dtype)
+        if n + count > array.shape[0]:
+            grown = np.empty((max(2 * array.shape[0], n + count),) + tail, dtype=dtype)
+            grown[:n] = array[:n]
+            return grown
+        return array
+
+    def _add_attributes(self, row: int, meta: dict) -> None:
+        """Record ``row`` in its category partition and the priority/created_at arrays."""
+        category = meta.get("category", "")
+        bucket = self._category_ids.get(category)
+        if bucket is None:
+            bucket = self._category_ids[category] = self._categories.add_bucket()
+        self._categories.append(row, bucket)
+        self._priority = self._ensure_row(self._priority, row, (), np.int64)
+        self._priority[row] = meta.get("priority", 1)
+        self._created = self._ensure_row(self._created, row, (), np.float64)
+        self._created[row] = _timestamp(meta.get("created_at"))
+        self._lexical.append(row, f"{meta.get('question', '')} {meta.get('answer', '')}")
+
+    def _append(self, meta: dict, vector: np.ndarray) -> None:
+        """Append one normalized row."""
+        self._append_many([meta], vector[None, :])
+
+    def _append_many(self, metas: list[dict], vectors: np.ndarray, keys: Optional[list[str]] = None) -> None:
+        """Append a block of normalized rows, growing the matrix geometrically when full.
+
+        ``keys`` are the rows' content hashes, if the caller already computed them.
+        """
+        n, m = len(self._meta), len(metas)
+        dim = vectors.shape[1]
+        if self._matrix is not None and dim != self._matrix.shape[1]:
+            raise ValueError(f"Embedding dimension {dim} does not match store dimension {self._matrix.shape[1]}")
+        if self._map_base and isinstance(self._matrix, np.memmap):
+            # Keep the loaded base on disk; only the new rows go to RAM (see TailedMatrix).
+            self._matrix = TailedMatrix(self._matrix)
+        if isinstance(self._matrix, TailedMatrix):
+            self._matrix = self._matrix.with_room(n, m)
+        else:
+            self._matrix = self._ensure_row(self._matrix, n, (dim,), np.float32, m)
+        self._matrix[n:n + m] = vectors
+        if self._quantizer is not None:
+            self._codes = self._ensure_row(self._codes, n, (dim,), self._quantizer.dtype, m)
+            self._codes[n:n + m] = self._quantizer.encode(vectors)
+        if self._deleted_at is not None:
+            self._deleted_at = self._ensure_row(self._deleted_at, n, (), np.int64, m)
+            self._deleted_at[n:n + m] = NOT_DELETED
+        if keys is None:
+            keys = [content_hash(meta) for meta in metas]
+        for row, meta, key in zip(range(n, n + m), metas, keys):
+            self._add_attributes(row, meta)
+            self._id_to_row[meta["case_id"]] = row
+            self._add_content(key, row)
+        # Appending the metadata last makes the row count grow only once the rows are complete.
+        self._meta.extend(metas)
+        if self._quantizer is not None and self._quantizer.needs_fit(n + m):
+            self._requantize()
+        for row, vector in enumerate(vectors, start=n):
+            self._index.add(row, vector)
+        if self._index.needs_training(n + m):
+            self._index.train(self._matrix[:n + m])
+
+    def _tombstone(self, row: int) -> None:
+        """Stamp ``row`` deleted (seen by snapshots published from now on); purge once enough rows are dead.
+
+        A memory-mapped matrix is not purged here, which would read it into
+        RAM: the next compaction writes only the live rows (see _checkpoint).
+        """
+        n = len(self._meta)
+        if self._deleted_at is None:
+            self._deleted_at = np.full(n, NOT_DELETED, dtype=np.int64)
+        self._deleted_at[row] = next(_clock)
+        self._dead += 1
+        if self._purge_due and not self._mapped:
+            self._purge()
+
+    @property
+    def _purge_due(self) -> bool:
+        return self._dead > 0 and self._dead >= PURGE_FRACTION * len(self._meta)
+
+    @property
+    def _mapped(self) -> bool:
+        return self._map_base and isinstance(self._matrix, (np.memmap, TailedMatrix))
+
+    def _purge(self) -> None:
+        """Drop tombstoned rows into new arrays and structures, renumbering the survivors."""
+        if not self._dead:
+            return
+        keep = np.flatnonzero(self._deleted_at[:len(self._meta)] == NOT_DELETED)
+        self._matrix = self._matrix[keep] if keep.size else None
+        self._renumber(keep)
+
+    def _renumber(self, keep: np.ndarray) -> None:
+        """Keep rows ``keep`` (ascending) of everything but the matrix, numbered from 0.
+
+        Kept rows that are tombstoned stay tombstoned.
+        """
+        if self._codes is not None:
+            self._codes = self._codes[keep] if keep.size else None
+        deleted_at = None if self._deleted_at is None else self._deleted_at[keep]
+        self._meta = [self._meta[row] for row in keep.tolist()]
+        self._dead = 0 if deleted_at is None else int(np.count_nonzero(deleted_at != NOT_DELETED))
+        self._deleted_at = deleted_at if self._dead else None
+        self._purges += 1
+        self._index.compact(keep)
+        self._reindex()
+
+    def _find_row(self, case_id: str) -> Optional[int]:
+        row = self._id_to_row.get(case_id)
+        if row is None or (self._deleted_at is not None and self._deleted_at[row] != NOT_DELETED):
+            return None
+        return row
+
+    def _find_content(self, key: str) -> Optional[int]:
+        for row in _content_rows(self._content_to_row.get(key)):
+            if self._deleted_at is None or self._deleted_at[row] == NOT_DELETED:
+                return row
+        return None
+
+    def _add_content(self, key: str, row: int) -> None:
+        # Duplicate content keeps every row, so deleting one leaves the others findable.
+        rows = _content_rows(self._content_to_row.get(key))
+        self._content_to_row[key] = rows + (row,) if rows else row
+
+    def _reindex(self) -> None:
+        """Rebuild the id index, category partitions and attribute arrays from metadata."""
+        self._id_to_row = {meta["case_id"]: row for row, meta in enumerate(self._meta)}
+        n = len(self._meta)
+        live = range(n) if self._deleted_at is None else np.flatnonzero(self._deleted_at[:n] == NOT_DELETED).tolist()
+        self._content_to_row = {}
+        for row in live:
+            self._add_content(content_hash(self._meta[row]), row)
+        self._categories = InvertedLists()
+        self._category_ids = {}
+        self._priority = None
+        self._created = None
+        self._lexical = BM25Index()
+        for row, meta in enumerate(self._meta):
+            self._add_attributes(row, meta)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        return l2_normalize(embedding)
+
+    def _check_writable(self) -> None:
+        if self._sharing is not None and not self._writing:
+            raise RuntimeError("A shared vector store can only be modified inside `async with store.writing()`")
+
+    @asynccontextmanager
+    async def writing(self):
+        """Scope for a batch of add_case / delete_case calls, made durable on exit.
+
+        Single process: commits the WAL on exit. Shared between workers: holds the
+        cross-process write lock, first catches up with versions other workers
+        published, and on exit commits the scope's records to the shared WAL and
+        bumps the generation so the other workers apply them. Once the WAL
+        outgrows ``wal_compact_bytes`` it is compacted into new base files first.
+        If the block raises, its unpublished changes are dropped.
+        """
+        if self._sharing is None:
+            yield
+            await self.commit()
+            return
+        async with self._write_scope_lock:
+            await asyncio.to_thread(self._sharing.lock)
+            self._writing = True
+            try:
+                await self._catch_up_locked()
+                try:
+                    yield
+                except BaseException:
+                    self._wal_buffer.clear()
+                    await self._reload_locked()
+                    raise
+                await self.commit()
+                self._wal_offset = self._wal_bytes
+                rebased = self._wal_bytes >= self._wal_compact_bytes or (self._purge_due and self._mapped)
+                if rebased:
+                    await self.compact()
+                    self._wal_offset = 0
+                self._generation = self._sharing.bump(rebased)
+                self._base_epoch = self._sharing.base_epoch()
+            finally:
+                self._writing = False
+                self._sharing.unlock()
+
+    async def _catch_up_locked(self) -> None:
+        """Bring this worker up to the latest shared version; caller holds the write lock."""
+        if self._sharing.generation() == self._generation:
+            return
+        if self._sharing.base_epoch() == self._base_epoch:
+            self._catch_up_wal()
+        else:
+            await self._reload_locked()
+
+    async def _reload_locked(self) -> None:
+        self._adopt(*await asyncio.to_thread(self._load_shared_copy, True))
+
+    @staticmethod
+    def _new_meta(case: dict) -> dict:
+        return {
+            "case_id": str(uuid.uuid4()),
             "category": case.get("category", ""),
             "question": case.get("question", ""),
             "answer": case.get("answer", ""),
             "priority": case.get("priority", 1),
             "created_at": datetime.utcnow().isoformat(),
-            "embedding": norm_embedding,
         }
+
+    def _log_add(self, meta: dict, vector: np.ndarray) -> None:
+        self._log({
+            "op": "add",
+            "meta": meta,
+            "embedding": base64.b64encode(vector.tobytes()).decode("ascii"),
+        })
+
+    async def add_case(self, case: dict, embedding: list[float]) -> str:
+        """Add a case with its embedding. Returns case_id."""
+        meta = self._new_meta(case)
+        vector = self._normalize(embedding)
+        self._check_writable()
         async with self._lock:
-            self._entries.append(entry)
-        return case_id
+            self._append(meta, vector)
+            self._publish()
+            self._log_add(meta, vector)
+        return meta["case_id"]
 
-    async def search(self, query_embedding: list[float], top_k: int = 5) -> list[dict]:
-        """Top-K cosine similarity search. Returns list of {case_id, score, case metadata}."""
-        if not self._entries:
+    async def add_cases(self, cases: list[dict], embeddings) -> list[Optional[str]]:
+        """Bulk add: one normalization, one block append and one publish for the whole batch.
+
+        Cases whose content (``content_hash``) is already stored, or repeats an
+        earlier case of the batch, are skipped. Returns the new case_id of each
+        case, None for skipped ones.
+        """
+        if not cases:
+            return []
+        vectors = l2_normalize(embeddings)
+        if vectors.ndim != 2 or vectors.shape[0] != len(cases):
+            raise ValueError(f"Expected {len(cases)} embeddings of equal dimension")
+        metas = [self._new_meta(case) for case in cases]
+        self._check_writable()
+        async with self._lock:
+            keep, seen = [], set()
+            keys = [content_hash(meta) for meta in metas]
+            for i, key in enumerate(keys):
+                if key not in seen and self._find_content(key) is None:
+                    seen.add(key)
+                    keep.append(i)
+            if keep:
+                self._append_many([metas[i] for i in keep], vectors[keep], [keys[i] for i in keep])
+                self._publish()
+                for i in keep:
+                    self._log_add(metas[i], vectors[i])
+        case_ids: list[Optional[str]] = [None] * len(cases)
+        for i in keep:
+            case_ids[i] = metas[i]["case_id"]
+        return case_ids
+
+    def search_sync(
+        self, query_embedding: list[float], top_k: int = 5, metadata_filter: Optional[SearchFilter] = None
+    ) -> list[dict]:
+        """Top-K cosine similarity search. Returns list of {case_id, score, case metadata}.
+
+        ``metadata_filter`` restricts the search to matching cases. Each result also
+        carries its float32 ``embedding`` so mmr_rerank does not have to look the
+        rows up again.
+        """
+        snap = self.snapshot()
+        if not snap.size or top_k <= 0:
             return []
 
         try:
-            query_vec = normalize(np.array(query_embedding).reshape(1, -1))
-            embeddings_matrix = np.array([e["embedding"] for e in self._entries])
-            similarities = cosine_similarity(query_vec, embeddings_matrix)[0]
-
-            top_k = min(top_k, len(self._entries))
-            top_indices = np.argsort(similarities)[::-1][:top_k]
-
-            results = []
-            for idx in top_indices:
-                entry = self._entries[idx]
-                results.append({
-                    "case_id": entry["case_id"],
-                    "score": float(similarities[idx]),
-                    "category": entry["category"],
-                    "question": entry["question"],
-                    "answer": entry["answer"],
-                    "priority": entry.get("priority", 1),
-                    "created_at": entry["created_at"],
-                })
-            return results
+            query_vec = self._normalize(query_embedding)
+            rows, scores = snap.top_k_rows(query_vec, top_k, metadata_filter)
+            return snap.results(rows, scores)
         except Exception as e:
             logger.error(f"Error during vector search: {e}")
             return []
 
+    def search_many_sync(
+        self,
+        query_embeddings: list[list[float]],
+        top_k: int = 5,
+        metadata_filter: Optional[SearchFilter] = None,
+    ) -> list[list[dict]]:
+        """Top-K search for several query vectors at once; one result list per query."""
+        snap = self.snapshot()
+        if not snap.size or top_k <= 0 or not query_embeddings:
+            return [[] for _ in query_embeddings]
+
+        try:
+            query_matrix = l2_normalize(query_embeddings)
+            return [
+                snap.results(rows, scores)
+                for rows, scores in snap.top_k_rows_many(query_matrix, top_k, metadata_filter)
+            ]
+        except Exception as e:
+            logger.error(f"Error during multi-vector search: {e}")
+            return [[] for _ in query_embeddings]
+
+    async def search_many(
+        self,
+        query_embeddings: list[list[float]],
+        top_k: int = 5,
+        metadata_filter: Optional[SearchFilter] = None,
+    ) -> list[list[dict]]:
+        """Top-K search for several query vectors at once; one result list per query."""
+        return self.search_many_sync(query_embeddings, top_k, metadata_filter)
+
+    async def search(
+        self, query_embedding: list[float], top_k: int = 5, metadata_filter: Optional[SearchFilter] = None
+    ) -> list[dict]:
+        """Top-K cosine similarity search. Returns list of {case_id, score, case metadata}."""
+        return self.search_sync(query_embedding, top_k, metadata_filter)
+
+    def lexical_search_sync(
+        self,
+        query_text: str,
+        top_k: int = 5,
+        metadata_filter: Optional[SearchFilter] = None,
+        query_embeddings: Optional[list[list[float]]] = None,
+    ) -> list[dict]:
+        """BM25 keyword search over question + answer; needs no embedding.
+
+        Each result carries ``lexical_score`` (BM25 normalized to 0..1), and as
+        evidence for it ``lexical_terms`` (distinct query terms matched) and
+        ``lexical_idf`` (their summed idf). ``score`` is the best cosine
+        similarity to ``query_embeddings`` when given, so the results can be
+        fused with dense ones; otherwise it is ``lexical_score``.
+        """
+        snap = self.snapshot()
+        if not snap.size or top_k <= 0:
+            return []
+        try:
+            rows = None if metadata_filter is None else snap.filtered_rows(metadata_filter)
+            rows, lexical, terms, idf = snap.lexical.search(query_text, top_k, snap.n, rows, snap.live_rows)
+            if query_embeddings:
+                query_matrix = l2_normalize(query_embeddings)
+                scores = (snap.matrix[rows] @ query_matrix.T).max(axis=1) if rows.size else lexical
+            else:
+                scores = lexical
+            return [
+                {**result, "lexical_score": float(value), "lexical_terms": int(n_terms), "lexical_idf": float(mass)}
+                for result, value, n_terms, mass in zip(snap.results(rows, scores), lexical, terms, idf)
+            ]
+        except Exception as e:
+            logger.error(f"Error during lexical search: {e}")
+            return []
+
+    async def lexical_search(
+        self,
+        query_text: str,
+        top_k: int = 5,
+        metadata_filter: Optional[SearchFilter] = None,
+        query_embeddings: Optional[list[list[float]]] = None,
+    ) -> list[dict]:
+        """BM25 keyword search over question + answer; see lexical_search_sync."""
+        return self.lexical_search_sync(query_text, top_k, metadata_filter, query_embeddings)
+
     async def mmr_rerank(
         self,
         candidates: list[dict],
@@ -89,113 +1046,455 @@ class VectorStore:
             return candidates
 
         try:
-            query_vec = normalize(np.array(query_embedding).reshape(1, -1))[0]
-
-            # Build embedding matrix for candidates from store
-            candidate_embeddings = []
-            for c in candidates:
-                entry = self._get_entry_by_id(c["case_id"])
-                if entry:
-                    candidate_embeddings.append(np.array(entry["embedding"]))
-                else:
-                    # Fallback: use zero vector (should not happen normally)
-                    candidate_embeddings.append(np.zeros_like(query_vec))
-
-            candidate_embeddings = np.array(candidate_embeddings)
-
-            # Similarity of each candidate to query
-            query_sims = cosine_similarity(candidate_embeddings, query_vec.reshape(1, -1)).flatten()
-
-            # Pairwise similarities between candidates
-            pairwise_sims = cosine_similarity(candidate_embeddings)
-
-            selected_indices = []
-            remaining_indices = list(range(len(candidates)))
-
-            for _ in range(top_n):
-                best_score = -float("inf")
-                best_idx = -1
-
-                for idx in remaining_indices:
-                    relevance = query_sims[idx]
-                    if selected_indices:
-                        max_redundancy = max(pairwise_sims[idx][s] for s in selected_indices)
-                    else:
-                        max_redundancy = 0.0
-
-                    mmr_score = lambda_ * relevance - (1 - lambda_) * max_redundancy
-                    if mmr_score > best_score:
-                        best_score = mmr_score
-                        best_idx = idx
-
-                if best_idx >= 0:
-                    selected_indices.append(best_idx)
-                    remaining_indices.remove(best_idx)
-
-            return [candidates[i] for i in selected_indices]
+            query_vec = self._normalize(query_embedding)
+            selected = mmr_select(self.snapshot().candidate_matrix(candidates), query_vec, top_n, lambda_)
+            return [candidates[i] for i in selected]
         except Exception as e:
             logger.error(f"Error during MMR reranking: {e}")
             return candidates[:top_n]
 
+    async def mmr_rerank_batch(
+        self,
+        candidate_lists: list[list[dict]],
+        query_embeddings: list[list[float]],
+        top_n: int = 3,
+        lambda_: float = 0.7,
+    ) -> list[list[dict]]:
+        """MMR for several queries at once; each step is one batched NumPy op across all queries."""
+        if not candidate_lists:
+            return []
+
+        try:
+            snap = self.snapshot()
+            width = max(len(c) for c in candidate_lists)
+            batch = np.zeros((len(candidate_lists), width, snap.dim or 0), dtype=np.float32)
+            valid = np.zeros((len(candidate_lists), width), dtype=bool)
+            for b, candidates in enumerate(candidate_lists):
+                if candidates:
+                    batch[b, :len(candidates)] = snap.candidate_matrix(candidates)
+                    valid[b, :len(candidates)] = True
+            query_vecs = l2_normalize(query_embeddings)
+            selected = mmr_select_batch(batch, query_vecs, top_n, lambda_, valid=valid)
+            return [
+                [candidates[i] for i in picks if i < len(candidates)]
+                for candidates, picks in zip(candidate_lists, selected)
+            ]
+        except Exception as e:
+            logger.error(f"Error during batched MMR reranking: {e}")
+            return [candidates[:top_n] for candidates in candidate_lists]
+
     def _get_entry_by_id(self, case_id: str) -> Optional[dict]:
-        for entry in self._entries:
-            if entry["case_id"] == case_id:
-                return entry
-        return None
+        snap = self.snapshot()
+        row = snap.find_row(case_id)
+        return None if row is None else snap.meta[row]
 
     async def delete_case(self, case_id: str) -> bool:
         """Delete a case by case_id. Returns True if found and deleted."""
+        self._check_writable()
         async with self._lock:
-            for i, entry in enumerate(self._entries):
-                if entry["case_id"] == case_id:
-                    self._entries.pop(i)
-                    return True
-        return False
+            row = self._find_row(case_id)
+            if row is None:
+                return False
+            self._tombstone(row)
+            self._publish()
+            self._log({"op": "delete", "case_id": case_id})
+            return True
 
     async def get_all_cases(self) -> list[dict]:
         """Return metadata for all cases (no embeddings)."""
+        snap = self.snapshot()
         return [
             {
-                "case_id": e["case_id"],
-                "category": e["category"],
-                "question": e["question"],
-                "answer": e["answer"],
-                "priority": e.get("priority", 1),
-                "created_at": e["created_at"],
+                "case_id": m["case_id"],
+                "category": m["category"],
+                "question": m["question"],
+                "answer": m["answer"],
+                "priority": m.get("priority", 1),
+                "created_at": m["created_at"],
             }
-            for e in self._entries
+            for m in (snap.meta[row] for row in snap.rows())
         ]
 
-    async def save(self):
-        """Persist store to JSON file."""
-        async with self._lock:
+    @property
+    def _embeddings_path(self) -> str:
+        return os.path.splitext(self._persist_path)[0] + ".npy"
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.splitext(self._persist_path)[0] + ".meta.json"
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.splitext(self._persist_path)[0] + ".index.npz"
+
+    @property
+    def _codes_path(self) -> str:
+        return os.path.splitext(self._persist_path)[0] + ".codes.npy"
+
+    @property
+    def _wal_path(self) -> str:
+        return os.path.splitext(self._persist_path)[0] + ".wal"
+
+    @property
+    def _retired_wal_path(self) -> str:
+        # WAL segment being folded into the base by a running (or interrupted) compaction.
+        return self._wal_path + ".old"
+
+    def _checkpoint(self) -> dict:
+        """Capture everything _write_binary needs; tombstones are purged first.
+
+        Published rows are never modified in place, so the arrays are handed to
+        the writer thread as views rather than copies. A memory-mapped matrix
+        is not purged in RAM: ``keep`` lists the live rows for the writer thread
+        to gather from disk, and _remap_base renumbers the rest to match.
+        """
+        if self._dead and not self._mapped:
+            self._purge()
+        self._publish(changed=False)
+        snap = self._current
+        n = snap.n
+        keep, meta, index = None, snap.meta[:n], self._index
+        if self._dead:
+            keep = np.flatnonzero(snap.live_rows)
+            meta = [snap.meta[row] for row in keep.tolist()]
+            index = copy.deepcopy(self._index)
+            index.compact(keep)
+        return {
+            "meta": meta,
+            "rows": n,
+            "keep": keep,
+            "dim": snap.dim or 0,
+            "matrix": None if snap.matrix is None else snap.matrix[:n],
+            "codes": None if snap.codes is None else snap.codes[:n],
+            "quantization": (
+                {"kind": snap.quantizer.kind, **snap.quantizer.state()} if snap.quantizer is not None else None
+            ),
+            "index_kind": index.kind,
+            "index": index.state(),
+            "purges": self._purges,
+        }
+
+    @staticmethod
+    def _replace_durably(write, tmp_path: str, path: str, mode: str = "wb") -> None:
+        with open(tmp_path, mode) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _write_binary(self, snapshot: dict):
+        """Write embeddings (.npy) and metadata sidecar atomically via temp files + rename.
+
+        Runs in a worker thread during compaction; it only touches ``snapshot``.
+        """
+        n, keep = len(snapshot["meta"]), snapshot["keep"]
+        embeddings = snapshot["matrix"] if snapshot["matrix"] is not None else np.empty((0, 0), dtype=np.float32)
+        if snapshot["index"] is not None:
+            self._replace_durably(
+                lambda f: np.savez(f, kind=snapshot["index_kind"], **snapshot["index"]),
+                self._index_path + ".tmp", self._index_path,
+            )
+        elif os.path.exists(self._index_path):
+            os.remove(self._index_path)
+        header = {"format_version": FORMAT_VERSION, "count": n, "dim": snapshot["dim"], "cases": snapshot["meta"]}
+        if snapshot["codes"] is not None:
+            codes = snapshot["codes"] if keep is None else snapshot["codes"][keep]
+            self._replace_durably(lambda f: np.save(f, codes), self._codes_path + ".tmp", self._codes_path)
+            header["quantization"] = snapshot["quantization"]
+        elif os.path.exists(self._codes_path):
+            os.remove(self._codes_path)
+        self._replace_durably(
+            lambda f: save_rows(f, embeddings, rows=keep), self._embeddings_path + ".tmp", self._embeddings_path
+        )
+        self._replace_durably(lambda f: json.dump(header, f), self._meta_path + ".tmp", self._meta_path, mode="w")
+
+    def _read_binary(self) -> tuple[dict, Optional[np.ndarray]]:
+        """Read the metadata sidecar and memory-map the embeddings read-only."""
+        with open(self._meta_path, "r") as f:
+            header = json.load(f)
+        meta = header["cases"]
+        if not meta:
+            return header, None
+        matrix = np.load(self._embeddings_path, mmap_mode="r")
+        if matrix.shape[0] != len(meta):
+            raise ValueError(
+                f"{self._embeddings_path} has {matrix.shape[0]} rows but metadata lists {len(meta)} cases"
+            )
+        return header, matrix
+
+    def _restore_codes(self, state: Optional[dict]):
+        """Memory-map persisted codes if they match the quantizer, otherwise re-encode the matrix."""
+        self._codes = None
+        n = len(self._meta)
+        if self._quantizer is None or n == 0:
+            return
+        if state and state.get("kind") == self._quantizer.kind and os.path.exists(self._codes_path):
+            codes = np.load(self._codes_path, mmap_mode="r")
+            if codes.shape[0] == n:
+                quantizer = copy.copy(self._quantizer)
+                quantizer.restore(state)
+                self._quantizer, self._codes = quantizer, codes
+                return
+        self._requantize()
+
+    def _requantize(self, chunk: int = 65_536):
+        """Refit a copy of the quantizer on the stored rows and re-encode into a new code array.
+
+        Published snapshots keep the quantizer and codes they were built with.
+        """
+        n = len(self._meta)
+        quantizer = copy.copy(self._quantizer)
+        quantizer.fit(self._matrix[:n])
+        capacity = n if self._codes is None else self._codes.shape[0]
+        codes = np.empty((capacity, self._matrix.shape[1]), dtype=quantizer.dtype)
+        for start in range(0, n, chunk):
+            stop = min(start + chunk, n)
+            codes[start:stop] = quantizer.encode(self._matrix[start:stop])
+        self._quantizer, self._codes = quantizer, codes
+
+    def _remap_base(self, snapshot: dict) -> None:
+        """Serve the rows a compaction just wrote from the new base file instead of RAM.
+
+        Rows appended since the checkpoint move to a fresh in-RAM tail. If the
+        checkpoint dropped tombstoned rows, the other structures are renumbered
+        to match the file. Skipped if the rows were renumbered meanwhile, since
+        the file no longer lines up.
+        """
+        count, covered, keep = len(snapshot["meta"]), snapshot["rows"], snapshot["keep"]
+        n = len(self._meta)
+        if (not count and keep is None) or snapshot["purges"] != self._purges or n < covered:
+            return
+        base = np.load(self._embeddings_path, mmap_mode="r") if count else None
+        if base is not None and base.shape[0] != count:
+            return
+        appended = self._matrix[covered:n] if n > covered else None
+        if keep is not None:
+            self._renumber(np.concatenate([keep, np.arange(covered, n)]))
+        if base is None:
+            self._matrix = None if appended is None else np.array(appended, dtype=np.float32)
+        elif appended is not None:
+            self._matrix = TailedMatrix(base).with_room(count, len(appended))
+            self._matrix[count:count + len(appended)] = appended
+        else:
+            self._matrix = base
+        self._publish(changed=False)
+
+    def _restore_index(self):
+        """Restore the persisted index if it matches the loaded rows, otherwise rebuild it."""
+        self._index.reset()
+        n = len(self._meta)
+        if os.path.exists(self._index_path):
+            try:
+                with np.load(self._index_path) as state:
+                    if str(state["kind"]) == self._index.kind:
+                        self._index.restore(dict(state), n)
+                        return
+            except Exception as e:
+                logger.warning(f"Discarding persisted index {self._index_path}: {e}")
+                self._index.reset()
+        if self._index.needs_training(n):
+            self._index.train(self._matrix[:n])
+
+    # -- write-ahead log -----------------------------------------------------
+
+    def _log(self, record: dict) -> None:
+        """Buffer a WAL record; commit() makes it durable."""
+        self._wal_buffer.append(json.dumps(record))
+
+    def _wal_append(self, lines: list[str]) -> int:
+        """Append and fsync a batch of records. Runs in a worker thread."""
+        data = "\n".join(lines) + "\n"
+        with open(self._wal_path, "a") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return len(data)
+
+    async def _flush_wal(self) -> None:
+        # Caller holds self._wal_lock.
+        if not self._wal_buffer:
+            return
+        lines, self._wal_buffer = self._wal_buffer, []
+        try:
+            self._wal_bytes += await asyncio.to_thread(self._wal_append, lines)
+        except Exception:
+            self._wal_buffer = lines + self._wal_buffer
+            raise
+
+    def _apply_record(self, record: dict) -> None:
+        """Replay one WAL record. Idempotent, since a WAL may overlap the base it follows."""
+        if record["op"] == "add":
+            meta = record["meta"]
+            if meta["case_id"] not in self._id_to_row:
+                self._append(meta, np.frombuffer(base64.b64decode(record["embedding"]), dtype=np.float32))
+        elif record["op"] == "delete":
+            row = self._find_row(record["case_id"])
+            if row is not None:
+                self._tombstone(row)
+
+    def _replay_wal(self) -> int:
+        """Apply the retired and the live WAL segments on top of the loaded base."""
+        replayed = 0
+        self._wal_bytes = 0
+        for path in (self._retired_wal_path, self._wal_path):
+            if not os.path.exists(path):
+                continue
+            self._wal_bytes += os.path.getsize(path)
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final write from a crash; nothing after it was acknowledged.
+                        logger.warning(f"Ignoring truncated WAL record in {path}")
+                        break
+                    self._apply_record(record)
+                    replayed += 1
+        self._wal_offset = os.path.getsize(self._wal_path) if os.path.exists(self._wal_path) else 0
+        return replayed
+
+    def _rotate_wal(self) -> None:
+        """Retire the live WAL segment so compaction can drop it once the new base is written."""
+        if not os.path.exists(self._wal_path):
+            return
+        if os.path.exists(self._retired_wal_path):
+            # A previous compaction failed; keep its records and add the live ones after them.
+            with open(self._wal_path, "r") as src, open(self._retired_wal_path, "a") as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self._wal_path)
+        else:
+            os.replace(self._wal_path, self._retired_wal_path)
+
+    async def commit(self):
+        """Durably append buffered mutations to the WAL.
+
+        Concurrent callers share one write + fsync: whoever holds the WAL lock
+        flushes every record buffered so far. Schedules a background compaction
+        once the WAL outgrows ``wal_compact_bytes``, or once enough rows of a
+        memory-mapped matrix are tombstoned to purge them (see _tombstone).
+        """
+        async with self._wal_lock:
+            try:
+                await self._flush_wal()
+            except Exception as e:
+                logger.error(f"Error appending to vector store WAL: {e}")
+                return
+        # Shared stores compact from writing(), under the cross-process lock.
+        due = self._wal_bytes >= self._wal_compact_bytes or (self._purge_due and self._mapped)
+        if self._sharing is None and due and (
+            self._compaction_task is None or self._compaction_task.done()
+        ):
+            self._compaction_task = asyncio.create_task(self.compact())
+
+    async def compact(self):
+        """Rewrite the base snapshot in a worker thread, then drop the WAL it covers."""
+        async with self._compact_lock:
+            async with self._wal_lock:
+                try:
+                    await self._flush_wal()
+                    self._rotate_wal()
+                except Exception as e:
+                    logger.error(f"Error rotating vector store WAL: {e}")
+                    return
+                # Records buffered from here on land in the new WAL segment.
+                snapshot = self._checkpoint()
+                self._wal_bytes = 0
             try:
-                data = []
-                for entry in self._entries:
-                    data.append({
-                        "case_id": entry["case_id"],
-                        "category": entry["category"],
-                        "question": entry["question"],
-                        "answer": entry["answer"],
-                        "priority": entry.get("priority", 1),
-                        "created_at": entry["created_at"],
-                        "embedding": entry["embedding"],
-                    })
-                with open(self._persist_path, "w") as f:
-                    json.dump(data, f)
-                logger.info(f"Vector store saved: {len(data)} entries to {self._persist_path}")
+                await asyncio.to_thread(self._write_binary, snapshot)
+                if os.path.exists(self._retired_wal_path):
+                    os.remove(self._retired_wal_path)
+                if self._map_base:
+                    async with self._lock:
+                        self._remap_base(snapshot)
+                logger.info(f"Vector store compacted: {len(snapshot['meta'])} entries to {self._embeddings_path}")
             except Exception as e:
-                logger.error(f"Error saving vector store: {e}")
+                logger.error(f"Error compacting vector store: {e}")
+
+    async def save(self):
+        """Checkpoint: commit pending WAL records, then compact them into the base files.
+
+        A shared store has nothing to do: every writing() block already published.
+        """
+        if self._sharing is not None:
+            return
+        await self.commit()
+        await self.compact()
 
     async def load(self):
-        """Load store from JSON file if it exists."""
+        """Load the base snapshot (migrating a legacy JSON store once), then replay the WAL."""
         try:
-            with open(self._persist_path, "r") as f:
-                data = json.load(f)
             async with self._lock:
-                self._entries = data
-            logger.info(f"Vector store loaded: {len(data)} entries from {self._persist_path}")
-        except FileNotFoundError:
-            logger.info(f"No existing vector store at {self._persist_path}, starting fresh")
+                if self._sharing is None:
+                    self._load_state()
+                    return
+                # Migration and WAL replay may write files: do them as the only writer.
+                await asyncio.to_thread(self._sharing.lock)
+                try:
+                    self._load_state()
+                    self._generation = self._sharing.generation()
+                    self._base_epoch = self._sharing.base_epoch()
+                finally:
+                    self._sharing.unlock()
         except Exception as e:
             logger.error(f"Error loading vector store: {e}")
+
+    def _reset_rows(self) -> None:
+        self._matrix = None
+        self._codes = None
+        self._meta = []
+        self._deleted_at, self._dead = None, 0
+        self._purges += 1
+        self._index.reset()
+        if self._quantizer is not None:
+            self._quantizer = make_quantizer(self._quantizer.kind)
+
+    def _load_state(self) -> None:
+        """Replace the writer-side state with the persisted one (base + WAL) and publish it."""
+        self._reset_rows()
+        if os.path.exists(self._meta_path):
+            header, matrix = self._read_binary()
+            # The memory-mapped matrix is read-only and exactly full, so the
+            # first append grows it into a new in-RAM array.
+            self._matrix = matrix
+            self._meta = header["cases"]
+            self._reindex()
+            self._restore_index()
+            self._restore_codes(header.get("quantization"))
+            logger.info(f"Vector store loaded: {len(self._meta)} entries from {self._embeddings_path}")
+        elif os.path.exists(self._persist_path):
+            self._migrate_legacy_json()
+        else:
+            self._reindex()
+            logger.info(f"No existing vector store at {self._persist_path}, starting fresh")
+        replayed = self._replay_wal()
+        self._publish()
+        if replayed:
+            logger.info(f"Vector store replayed {replayed} WAL records ({self._current.size} entries)")
+
+    def _migrate_legacy_json(self):
+        meta, matrix = read_legacy_json(self._persist_path)
+        self._matrix = matrix
+        self._meta = meta
+        self._reindex()
+        self._restore_index()
+        self._restore_codes(None)
+        self._write_binary(self._checkpoint())
+        os.replace(self._persist_path, self._persist_path + ".migrated")
+        logger.info(
+            f"Vector store migrated: {len(meta)} entries from {self._persist_path} to {self._embeddings_path}"
+        )
+
+
+def read_legacy_json(path: str) -> tuple[list[dict], Optional[np.ndarray]]:
+    """Parse the pre-binary ``vector_store.json`` format (one embedding list per entry)."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    if not data:
+        return [], None
+    matrix = np.array([entry.pop("embedding") for entry in data], dtype=np.float32)
+    matrix = l2_normalize(matrix)
+    for entry in data:
+        entry.setdefault("priority", 1)
+    return data, matrix
@@ -42,4 +42,4 @@ pull_model "${LLM_MODEL:-mistral}" || exit 1
 pull_model "${EMBEDDING_MODEL:-nomic-embed-text}" || exit 1
 
 echo "Starting FastAPI application..."
-exec uvicorn main:app --host 0.0.0.0 --port 8002
+exec uvicorn main:app --host 0.0.0.0 --port 8002 --workers "${API_WORKERS:-1}"